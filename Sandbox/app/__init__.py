@@ -42,6 +42,13 @@ def create_app(config_class=Config):
     from app.errors import register_error_handlers
     register_error_handlers(app)
     
+    # Count and time database queries per request
+    from app.instrumentation import register_instrumentation
+    register_instrumentation(app)
+    
+    # Register ORM event hooks that keep derived data in sync
+    from app import search, balances, job_history, choices  # noqa: F401
+    
     # Ensure the upload directory exists
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
@@ -6,6 +6,10 @@ from app.auth.forms import LoginForm, RegistrationForm, ResetPasswordForm
 from app.models import User
 from werkzeug.urls import url_parse
 from datetime import datetime
+from app.pagination import paginate_query
+
+# Sort keys for the user list; the trailing id makes the order total for cursors
+USER_LIST_KEYS = [(User.username, False), (User.id, False)]
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -90,9 +94,7 @@ def users():
         flash('You do not have permission to view users', 'danger')
         return redirect(url_for('main.index'))
     
-    page = request.args.get('page', 1, type=int)
-    users = User.query.order_by(User.username).paginate(
-        page=page, per_page=current_app.config['ITEMS_PER_PAGE'], error_out=False)
+    users = paginate_query(User.query, USER_LIST_KEYS, current_app.config['ITEMS_PER_PAGE'])
     return render_template('auth/users.html', title='Users', users=users)
 
 @bp.route('/users/<int:id>/activate')
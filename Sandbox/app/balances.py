@@ -0,0 +1,112 @@
+from collections import namedtuple
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+from app import db
+from app.models import Invoice, Payment
+
+# Invoice.amount_paid and Invoice.balance_due are adjusted with a relative
+# UPDATE in the same flush that inserts, edits or deletes a Payment, so they
+# stay correct under concurrent payments and roll back with the payment.
+# Bulk query.update()/delete() on payments bypasses these hooks; run
+# `flask check_balances --fix` after any such maintenance.
+
+BalanceMismatch = namedtuple('BalanceMismatch', ['invoice_id', 'invoice_number', 'amount_paid',
+                                                 'balance_due', 'expected_paid', 'expected_balance'])
+
+def _adjust(connection, invoice_id, delta):
+    """Add delta to an invoice's amount_paid and subtract it from balance_due"""
+    if invoice_id is None or not delta:
+        return
+    connection.execute(update(Invoice.__table__).where(Invoice.__table__.c.id == invoice_id).values(
+        amount_paid=Invoice.__table__.c.amount_paid + delta,
+        balance_due=func.coalesce(Invoice.__table__.c.total_amount, 0.0) - Invoice.__table__.c.amount_paid - delta
+    ))
+
+def _mark_stale(target, *invoice_ids):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_invoice_balances', set()).update(i for i in invoice_ids if i is not None)
+
+# Load the previous amount/invoice_id when they are reassigned, even if the
+# attribute was expired by a commit, so after_update can compute the delta.
+@event.listens_for(Payment.amount, 'set', active_history=True)
+@event.listens_for(Payment.invoice_id, 'set', active_history=True)
+def _track_previous_value(target, value, oldvalue, initiator):
+    pass
+
+@event.listens_for(Payment, 'after_insert')
+def _payment_inserted(mapper, connection, target):
+    _adjust(connection, target.invoice_id, float(target.amount or 0))
+    _mark_stale(target, target.invoice_id)
+
+@event.listens_for(Payment, 'after_update')
+def _payment_updated(mapper, connection, target):
+    amount = get_history(target, 'amount')
+    invoice = get_history(target, 'invoice_id')
+    if not amount.has_changes() and not invoice.has_changes():
+        return
+    old_amount = amount.deleted[0] if amount.deleted else target.amount
+    old_invoice_id = invoice.deleted[0] if invoice.deleted else target.invoice_id
+    _adjust(connection, old_invoice_id, -float(old_amount or 0))
+    _adjust(connection, target.invoice_id, float(target.amount or 0))
+    _mark_stale(target, old_invoice_id, target.invoice_id)
+
+@event.listens_for(Payment, 'after_delete')
+def _payment_deleted(mapper, connection, target):
+    _adjust(connection, target.invoice_id, -float(target.amount or 0))
+    _mark_stale(target, target.invoice_id)
+
+@event.listens_for(Invoice, 'before_insert')
+def _invoice_inserted(mapper, connection, target):
+    target.amount_paid = target.amount_paid or 0.0
+    target.balance_due = float(target.total_amount or 0) - target.amount_paid
+
+@event.listens_for(Invoice, 'before_update')
+def _invoice_updated(mapper, connection, target):
+    # Recompute against the stored amount_paid, not the possibly stale
+    # in-memory value, when the invoice total changes.
+    if get_history(target, 'total_amount').has_changes():
+        target.balance_due = float(target.total_amount or 0) - Invoice.amount_paid
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def _expire_stale_balances(session, flush_context):
+    """Reload amount_paid/balance_due on invoices changed behind the ORM's back"""
+    stale = session.info.pop('stale_invoice_balances', None)
+    if not stale:
+        return
+    for invoice in list(session.identity_map.values()):
+        if isinstance(invoice, Invoice) and invoice.id in stale:
+            session.expire(invoice, ['amount_paid', 'balance_due'])
+
+def check_balances(fix=False, tolerance=0.005):
+    """Compare stored balances with the payments table; optionally repair them
+
+    Returns the list of BalanceMismatch rows found before any fix.
+    """
+    paid = db.session.query(
+        Payment.invoice_id.label('invoice_id'),
+        func.sum(Payment.amount).label('paid')
+    ).group_by(Payment.invoice_id).subquery()
+
+    rows = db.session.query(
+        Invoice.id, Invoice.invoice_number, Invoice.amount_paid, Invoice.balance_due,
+        Invoice.total_amount, func.coalesce(paid.c.paid, 0.0)
+    ).outerjoin(paid, paid.c.invoice_id == Invoice.id).order_by(Invoice.id)
+
+    mismatches = []
+    for invoice_id, number, amount_paid, balance_due, total, expected_paid in rows:
+        expected_balance = float(total or 0) - float(expected_paid)
+        if abs((amount_paid or 0) - expected_paid) > tolerance or \
+                abs((balance_due or 0) - expected_balance) > tolerance:
+            mismatches.append(BalanceMismatch(invoice_id, number, amount_paid, balance_due,
+                                              float(expected_paid), expected_balance))
+
+    if fix and mismatches:
+        for mismatch in mismatches:
+            db.session.execute(update(Invoice.__table__).where(Invoice.__table__.c.id == mismatch.invoice_id).values(
+                amount_paid=mismatch.expected_paid,
+                balance_due=mismatch.expected_balance
+            ))
+        db.session.commit()
+    return mismatches
@@ -0,0 +1,42 @@
+from flask import g, has_app_context
+from app.models import Job, JobStatus
+from app.queries import with_job_relations
+
+# Job statuses shown on the production board and schedule, in workflow order
+ACTIVE_STATUSES = [JobStatus.PENDING, JobStatus.PREPRESS, JobStatus.PRESS,
+                   JobStatus.POSTPRESS, JobStatus.QUALITY_CHECK]
+
+class ProductionBoard:
+    """Active jobs grouped by status, with order, customer and product loaded"""
+
+    def __init__(self, jobs):
+        self.columns = {status: [] for status in ACTIVE_STATUSES}
+        for job in jobs:
+            self.columns[job.status].append(job)
+
+    def jobs(self, status):
+        """Jobs currently in the given JobStatus"""
+        return self.columns.get(status, [])
+
+    def counts(self):
+        """Number of jobs per status"""
+        return {status: len(jobs) for status, jobs in self.columns.items()}
+
+    def as_schedule(self):
+        """Jobs keyed by lower-case status name, as the schedule template expects"""
+        return {status.name.lower(): jobs for status, jobs in self.columns.items()}
+
+def load_production_board():
+    """Fetch every active job in one joined query and group it by status"""
+    jobs = with_job_relations(Job.query) \
+        .filter(Job.status.in_(ACTIVE_STATUSES)) \
+        .order_by(Job.start_date, Job.created_at, Job.id).all()
+    return ProductionBoard(jobs)
+
+def get_production_board():
+    """Production board for the current request, loaded at most once"""
+    if not has_app_context():
+        return load_production_board()
+    if 'production_board' not in g:
+        g.production_board = load_production_board()
+    return g.production_board
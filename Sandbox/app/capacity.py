@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+import numpy as np
+from flask import current_app
+from app import db
+from app.models import Job
+from app.scheduler import STAGES, REMAINING_STAGES
+
+# Hours booked per day and stage. A scheduled job's window from start_date
+# to completion_date is divided between the stages in SCHEDULE_STAGE_SPLIT
+# proportions, in stage order, and each stage the job still has to pass
+# through books its share of estimated_hours evenly over the working days
+# of its part of the window. Stages are binned with a difference array
+# (+rate on the first day, -rate after the last) and one cumulative sum,
+# so the cost grows with jobs plus days rather than jobs times days.
+
+MAX_DAYS = 366
+
+def _day_index(days, start):
+    return (days - np.datetime64(start, 'D')).astype(np.int64)
+
+def _stage_windows(statuses, hours, first, last, split):
+    """(stage index, hours, first day, last day) arrays, one entry per remaining stage of each job"""
+    shares = np.array([split.get(stage.name, 0.0) for stage in STAGES], dtype=np.float64)
+    bounds = np.concatenate(([0.0], np.cumsum(shares))) / (shares.sum() or 1.0)
+    span = (last - first).astype(np.int64) + 1
+    parts = []
+    for i, stage in enumerate(STAGES):
+        remaining = np.array([stage in REMAINING_STAGES.get(status, ()) for status in statuses], dtype=bool)
+        lo = first + np.floor(span * bounds[i]).astype(np.int64)
+        hi = first + np.maximum(np.ceil(span * bounds[i + 1]).astype(np.int64) - 1, 0)
+        hi = np.maximum(hi, lo)
+        parts.append((np.full(remaining.sum(), i), hours[remaining] * shares[i], lo[remaining], hi[remaining]))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+def capacity_heatmap(start, end):
+    """Booked and available hours per stage per day for start..end (dates, inclusive)"""
+    config = current_app.config
+    days = (end - start).days + 1
+    range_start = datetime.combine(start, datetime.min.time())
+    range_end = datetime.combine(end, datetime.min.time()) + timedelta(days=1)
+
+    rows = db.session.query(Job.status, Job.estimated_hours, Job.start_date, Job.completion_date) \
+        .filter(Job.status.in_(list(REMAINING_STAGES)), Job.start_date.isnot(None), Job.start_date < range_end,
+                db.or_(Job.completion_date >= range_start, Job.completion_date.is_(None))).all()
+
+    calendar_days = np.arange(np.datetime64(start, 'D'), np.datetime64(start, 'D') + days)
+    business = np.is_busday(calendar_days)
+    booked = np.zeros((len(STAGES), days))
+    if rows:
+        statuses, hours, starts, ends = zip(*rows)
+        default_hours = config['SCHEDULE_DEFAULT_HOURS']
+        hours = np.array([h or default_hours for h in hours], dtype=np.float64)
+        first = np.array([s.date() for s in starts], dtype='datetime64[D]')
+        last = np.array([(e or s).date() for s, e in zip(starts, ends)], dtype='datetime64[D]')
+        last = np.maximum(last, first)
+        stage, hours, first, last = _stage_windows(statuses, hours, first, last, config['SCHEDULE_STAGE_SPLIT'])
+
+        # Hours go to working days only, unless the stage falls entirely on a weekend
+        working = np.busday_count(first, last + 1)
+        weekend_only = working == 0
+        rate = hours / np.where(weekend_only, (last - first).astype(np.int64) + 1, working)
+
+        lo = np.clip(_day_index(first, start), 0, days)
+        hi = np.clip(_day_index(last, start) + 1, 0, days)
+        for selected, mask in ((~weekend_only, business), (weekend_only, None)):
+            selected = selected & (lo < hi)
+            spread = np.zeros((len(STAGES), days + 1))
+            np.add.at(spread, (stage[selected], lo[selected]), rate[selected])
+            np.add.at(spread, (stage[selected], hi[selected]), -rate[selected])
+            spread = np.cumsum(spread, axis=1)[:, :days]
+            booked += spread * mask if mask is not None else spread
+
+    per_day = config['SCHEDULE_HOURS_PER_DAY']
+    capacity = {}
+    for stage in STAGES:
+        machines = config['SCHEDULE_MACHINES'].get(stage.name)
+        if machines:
+            capacity[stage.name.lower()] = np.round(np.where(business, machines * per_day, 0.0), 2).tolist()
+
+    return {
+        'start': start.isoformat(),
+        'days': days,
+        'stages': [stage.name.lower() for stage in STAGES],
+        'hours': np.round(booked, 2).tolist(),
+        'total': np.round(booked.sum(axis=0), 2).tolist(),
+        'capacity': capacity,
+    }
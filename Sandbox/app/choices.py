@@ -0,0 +1,105 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from flask import current_app
+from sqlalchemy import event
+from app import db
+from app.models import Customer, Product, Material
+
+# Select-field choices for customers, products and materials, cached per
+# process. A kind is reloaded after a transaction in this process commits
+# an insert, update or delete of a row of its model, and at the latest
+# after CHOICES_TTL seconds so changes made by other worker processes show
+# up. Labels hold only fields that rarely change; stock levels are left
+# out, since other processes would go on showing stale stock until the TTL.
+# Each cached list also carries sorted (name, label, id) indexes for
+# prefix lookups, so autocomplete is a binary search rather than a query.
+
+ChoiceList = namedtuple('ChoiceList', ['loaded_at', 'choices', 'index'])
+
+def _material_label(id, name, unit):
+    return f"{name} ({unit})" if unit else name
+
+# Kind -> (model, columns loaded, label builder)
+CHOICE_KINDS = {
+    'customer': (Customer, (Customer.id, Customer.name), lambda id, name: name),
+    'product': (Product, (Product.id, Product.name), lambda id, name: name),
+    'material': (Material, (Material.id, Material.name, Material.unit), _material_label),
+}
+MODEL_KINDS = {model: kind for kind, (model, columns, label) in CHOICE_KINDS.items()}
+
+_cache = {}
+_lock = threading.Lock()
+
+def _load(kind):
+    model, columns, label = CHOICE_KINDS[kind]
+    rows = db.session.query(*columns).order_by(columns[1], columns[0]).all()
+    choices = [(row[0], label(*row)) for row in rows]
+    names, words = [], []
+    for row, (id, text) in zip(rows, choices):
+        parts = (row[1] or '').lower().split()
+        names.append((' '.join(parts), text, id))
+        # Later word starts too, so "acme" finds "The Acme Company"
+        words.extend((' '.join(parts[i:]), text, id) for i in range(1, len(parts)))
+    names.sort()
+    words.sort()
+    return ChoiceList(time.monotonic(), choices, (names, words))
+
+def _get(kind):
+    entry = _cache.get(kind)
+    if entry is None or time.monotonic() - entry.loaded_at > current_app.config['CHOICES_TTL']:
+        with _lock:
+            entry = _cache.get(kind)
+            if entry is None or time.monotonic() - entry.loaded_at > current_app.config['CHOICES_TTL']:
+                entry = _cache[kind] = _load(kind)
+    return entry
+
+def get_choices(kind):
+    """(id, label) pairs for a select field, ordered by name; shared, do not modify"""
+    return _get(kind).choices
+
+def autocomplete(kind, prefix, limit=10):
+    """Up to limit (id, label) pairs with a word starting with prefix"""
+    prefix = ' '.join((prefix or '').lower().split())
+    if not prefix:
+        return []
+    matches, seen = [], set()
+    # Names starting with the prefix come first, then names with a later word starting with it
+    for index in _get(kind).index:
+        position = bisect_left(index, (prefix,))
+        while len(matches) < limit and position < len(index) and index[position][0].startswith(prefix):
+            key, text, id = index[position]
+            if id not in seen:
+                seen.add(id)
+                matches.append((id, text))
+            position += 1
+    return matches
+
+def invalidate(*kinds):
+    """Drop cached choices so they are reloaded on next use"""
+    for kind in kinds or list(CHOICE_KINDS):
+        _cache.pop(kind, None)
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed(session, flush_context):
+    """Note the kinds of any model with inserted, updated or deleted rows"""
+    kinds = {MODEL_KINDS[type(obj)] for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+             if type(obj) in MODEL_KINDS}
+    if kinds:
+        session.info.setdefault('changed_choices', set()).update(kinds)
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed(session):
+    """Drop the choices changed by the committed transaction
+
+    Dropping them at flush time would let another thread reload the old
+    committed rows before this commit and keep them for CHOICES_TTL.
+    """
+    kinds = session.info.pop('changed_choices', None)
+    if kinds:
+        invalidate(*kinds)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed(session):
+    session.info.pop('changed_choices', None)
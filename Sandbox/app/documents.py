@@ -0,0 +1,305 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+from collections import defaultdict
+from datetime import datetime
+from xml.sax.saxutils import escape
+from flask import current_app
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from app import db
+from app.models import Invoice, Job, Product, OrderStatus
+from app.queries import with_invoice_relations
+from app.imposition import plan_job
+from app.tasks import map_in_process, task, result_path
+from app.exports import ChunkSink
+
+# PDF invoices, quotes and job tickets. Each document is first reduced to a
+# plain dict of the values it prints; the cache key is a hash of that dict,
+# so any change to the invoice, order, jobs or customer shown on it yields a
+# new file, and an unchanged document is served from disk without being
+# rendered again. Rendering is done by reportlab on the task process pool,
+# since it is pure CPU work on plain data. Requests only zip a few
+# invoices themselves; a month with more than PDF_INLINE_ZIP_MAX invoices
+# goes to the task runner.
+
+LAYOUT_VERSION = 1  # Bump when the layout changes to invalidate cached files
+
+def _date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+def _customer(customer):
+    if customer is None:
+        return {'name': '', 'lines': []}
+    place = ' '.join(part for part in (customer.city, customer.state, customer.postal_code) if part)
+    lines = [customer.contact_person, customer.address, place, customer.country, customer.email]
+    return {'name': customer.name, 'lines': [line for line in lines if line]}
+
+def _job_lines(order_ids):
+    """Printed line per job, for several orders in one query"""
+    lines = defaultdict(list)
+    if not order_ids:
+        return lines
+    rows = db.session.query(Job.order_id, Job.job_number, Product.name, Job.quantity, Job.width,
+                            Job.height, Job.pages, Job.colors, Job.paper_type) \
+        .outerjoin(Product, Job.product_id == Product.id) \
+        .filter(Job.order_id.in_(order_ids)).order_by(Job.order_id, Job.id)
+    for order_id, number, product, quantity, width, height, pages, colours, paper in rows:
+        specs = []
+        if width and height:
+            specs.append(f'{width:g} x {height:g} mm')
+        if pages and pages > 1:
+            specs.append(f'{pages} pp')
+        specs.extend(value for value in (colours, paper) if value)
+        lines[order_id].append({'job_number': number, 'product': product or '', 'quantity': quantity or 0,
+                                'specs': ', '.join(specs)})
+    return lines
+
+def invoice_documents(invoices):
+    """Printable data for each invoice, loading job lines for all of them at once"""
+    lines = _job_lines({invoice.order_id for invoice in invoices if invoice.order_id})
+    header = current_app.config['DOCUMENT_HEADER']
+    documents = []
+    for invoice in invoices:
+        order = invoice.order
+        documents.append({
+            'header': header,
+            'number': invoice.invoice_number,
+            'status': invoice.status.value if invoice.status else '',
+            'created': _date(invoice.created_at),
+            'due': _date(invoice.due_date),
+            'order_number': order.order_number if order else '',
+            'customer': _customer(order.customer if order else None),
+            'lines': lines.get(invoice.order_id, []),
+            'amount': invoice.amount or 0.0,
+            'tax': invoice.tax_amount or 0.0,
+            'total': invoice.total_amount or 0.0,
+            'paid': invoice.amount_paid or 0.0,
+            'balance': invoice.balance_due or 0.0,
+            'notes': invoice.notes or '',
+        })
+    return documents
+
+def quote_document(order):
+    """Printable data for a quote (or, once accepted, an order confirmation)"""
+    return {
+        'header': current_app.config['DOCUMENT_HEADER'],
+        'title': 'Quote' if order.status == OrderStatus.QUOTE else 'Order Confirmation',
+        'number': order.order_number,
+        'created': _date(order.created_at),
+        'due': _date(order.due_date),
+        'customer': _customer(order.customer),
+        'lines': _job_lines([order.id]).get(order.id, []),
+        'total': order.total_amount or 0.0,
+        'notes': order.notes or '',
+    }
+
+def job_ticket_document(job):
+    """Printable data for a production job ticket, including its imposition"""
+    plan = plan_job(job)
+    order = job.order
+    return {
+        'header': current_app.config['DOCUMENT_HEADER'],
+        'number': job.job_number,
+        'status': job.status.value if job.status else '',
+        'order_number': order.order_number if order else '',
+        'customer': order.customer.name if order and order.customer else '',
+        'due': _date(order.due_date if order else None),
+        'product': job.product.name if job.product else '',
+        'quantity': job.quantity or 0,
+        'size': f'{job.width:g} x {job.height:g} mm' if job.width and job.height else '',
+        'pages': job.pages or 1,
+        'colors': job.colors or '',
+        'paper': job.paper_type or '',
+        'finishing': job.finishing or '',
+        'estimated_hours': job.estimated_hours or 0.0,
+        'start': _date(job.start_date),
+        'completion': _date(job.completion_date),
+        'imposition': {
+            'sheet': plan.sheet_name,
+            'up': plan.layout.up,
+            'sheets': plan.sheets,
+        } if plan else None,
+        'notes': job.notes or '',
+    }
+
+# Rendering. These run in worker processes and only see the plain dicts.
+
+def _money(value):
+    return f'${value:,.2f}'
+
+def _build(story):
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=18 * mm, rightMargin=18 * mm,
+                            topMargin=18 * mm, bottomMargin=18 * mm)
+    doc.build(story)
+    return buffer.getvalue()
+
+def _text(value, styles):
+    return Paragraph(escape(value).replace('\n', '<br/>'), styles['Normal'])
+
+def _heading(data, title, styles):
+    return [_text('\n'.join(data['header']), styles), Spacer(1, 8 * mm),
+            Paragraph(escape(f"{title} {data['number']}"), styles['Title'])]
+
+def _grid(rows, widths, header=True):
+    table = Table(rows, colWidths=widths, repeatRows=1 if header else 0)
+    style = [('FONTSIZE', (0, 0), (-1, -1), 9),
+             ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+             ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.grey)]
+    if header:
+        style += [('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e9ecef')),
+                  ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold')]
+    table.setStyle(TableStyle(style))
+    return table
+
+def _address(customer, styles):
+    lines = [f"<b>{escape(customer['name'])}</b>"] + [escape(line) for line in customer['lines']]
+    return Paragraph('<br/>'.join(lines), styles['Normal'])
+
+def _line_table(lines, styles):
+    rows = [['Job', 'Description', 'Quantity']]
+    for line in lines:
+        description = escape(line['product'])
+        if line['specs']:
+            description += f"<br/><font size=8>{escape(line['specs'])}</font>"
+        rows.append([line['job_number'], Paragraph(description, styles['Normal']), f"{line['quantity']:,}"])
+    return _grid(rows, [35 * mm, 105 * mm, 30 * mm])
+
+def render_invoice(data):
+    """Invoice PDF bytes"""
+    styles = getSampleStyleSheet()
+    story = _heading(data, 'Invoice', styles)
+    story += [_address(data['customer'], styles), Spacer(1, 6 * mm),
+              _grid([['Invoice date', data['created']], ['Due date', data['due']],
+                     ['Order', data['order_number']], ['Status', data['status']]],
+                    [40 * mm, 60 * mm], header=False),
+              Spacer(1, 6 * mm), _line_table(data['lines'], styles), Spacer(1, 6 * mm)]
+    totals = _grid([['Amount', _money(data['amount'])], ['Tax', _money(data['tax'])],
+                    ['Total', _money(data['total'])], ['Paid', _money(data['paid'])],
+                    ['Balance due', _money(data['balance'])]], [40 * mm, 35 * mm], header=False)
+    totals.hAlign = 'RIGHT'
+    story.append(totals)
+    if data['notes']:
+        story += [Spacer(1, 6 * mm), _text(data['notes'], styles)]
+    return _build(story)
+
+def render_quote(data):
+    """Quote or order confirmation PDF bytes"""
+    styles = getSampleStyleSheet()
+    story = _heading(data, data['title'], styles)
+    story += [_address(data['customer'], styles), Spacer(1, 6 * mm),
+              _grid([['Date', data['created']], ['Required by', data['due']]], [40 * mm, 60 * mm], header=False),
+              Spacer(1, 6 * mm), _line_table(data['lines'], styles), Spacer(1, 6 * mm)]
+    total = _grid([['Total', _money(data['total'])]], [40 * mm, 35 * mm], header=False)
+    total.hAlign = 'RIGHT'
+    story.append(total)
+    if data['notes']:
+        story += [Spacer(1, 6 * mm), _text(data['notes'], styles)]
+    return _build(story)
+
+def render_job_ticket(data):
+    """Job ticket PDF bytes"""
+    styles = getSampleStyleSheet()
+    story = _heading(data, 'Job Ticket', styles)
+    rows = [['Order', data['order_number']], ['Customer', data['customer']], ['Due', data['due']],
+            ['Status', data['status']], ['Product', data['product']], ['Quantity', f"{data['quantity']:,}"],
+            ['Finished size', data['size']], ['Pages', str(data['pages'])], ['Colours', data['colors']],
+            ['Paper', data['paper']], ['Finishing', data['finishing']],
+            ['Estimated hours', f"{data['estimated_hours']:g}"], ['Start', data['start']],
+            ['Completion', data['completion']]]
+    if data['imposition']:
+        imposition = data['imposition']
+        rows += [['Press sheet', imposition['sheet']], ['Up', str(imposition['up'])],
+                 ['Sheets', f"{imposition['sheets']:,}"]]
+    story.append(_grid(rows, [40 * mm, 130 * mm], header=False))
+    if data['notes']:
+        story += [Spacer(1, 6 * mm), Paragraph('<b>Notes</b>', styles['Normal']),
+                  _text(data['notes'], styles)]
+    return _build(story)
+
+RENDERERS = {
+    'invoice': render_invoice,
+    'quote': render_quote,
+    'job_ticket': render_job_ticket,
+}
+
+# Disk cache
+
+def cache_path(kind, data):
+    """Cache file for a document; its name is a hash of everything printed on it"""
+    encoded = json.dumps([LAYOUT_VERSION, kind, data], sort_keys=True, default=str).encode()
+    digest = hashlib.sha256(encoded).hexdigest()
+    return os.path.join(current_app.config['PDF_CACHE_FOLDER'], kind, digest[:2], f'{digest}.pdf')
+
+def _store(path, content):
+    # Write then rename, so a concurrent reader never sees a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as out:
+        out.write(content)
+    os.replace(temp, path)
+
+def cached_pdfs(kind, documents):
+    """Cache path for each document, rendering all misses in parallel"""
+    paths = [cache_path(kind, data) for data in documents]
+    missing = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+    rendered = map_in_process(RENDERERS[kind], [documents[i] for i in missing])
+    for i, content in zip(missing, rendered):
+        _store(paths[i], content)
+    return paths
+
+def invoice_pdf(invoice):
+    return cached_pdfs('invoice', invoice_documents([invoice]))[0]
+
+def quote_pdf(order):
+    return cached_pdfs('quote', [quote_document(order)])[0]
+
+def job_ticket_pdf(job):
+    return cached_pdfs('job_ticket', [job_ticket_document(job)])[0]
+
+# Bulk invoices
+
+ZIP_BATCH = 50  # Invoices rendered per batch while streaming a ZIP
+
+def _in_month(query, year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return query.filter(Invoice.created_at >= start, Invoice.created_at < end)
+
+def month_invoices(year, month):
+    """Invoices created in a month, oldest first"""
+    return _in_month(with_invoice_relations(Invoice.query), year, month) \
+        .order_by(Invoice.created_at, Invoice.id).all()
+
+def month_invoice_count(year, month):
+    """Number of invoices created in a month"""
+    return _in_month(Invoice.query, year, month).count()
+
+def stream_invoice_zip(invoices):
+    """Yield a ZIP of invoice PDFs chunk by chunk, rendering in batches as it goes"""
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for start in range(0, len(invoices), ZIP_BATCH):
+            batch = invoices[start:start + ZIP_BATCH]
+            for invoice, path in zip(batch, cached_pdfs('invoice', invoice_documents(batch))):
+                archive.write(path, f'{invoice.invoice_number}.pdf')
+            yield sink.drain()
+    yield sink.drain()
+
+def zip_filename(year, month):
+    return f'invoices-{year:04d}-{month:02d}.zip'
+
+@task('invoice_zip')
+def invoice_zip_task(year, month):
+    """Write a month's invoice ZIP to a result file for later download"""
+    filename = zip_filename(year, month)
+    with open(result_path(filename), 'wb') as out:
+        for chunk in stream_invoice_zip(month_invoices(year, month)):
+            out.write(chunk)
+    return {'file': filename, 'mimetype': 'application/zip'}
@@ -0,0 +1,288 @@
+import csv
+import enum
+import io
+import zipfile
+from datetime import datetime, date
+from xml.sax.saxutils import escape
+from flask import Response, abort, stream_with_context, jsonify
+from flask_login import current_user
+from sqlalchemy.orm import aliased
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models import Order, Job, Invoice, Payment, Customer, Product, OrderStatus, InvoiceStatus
+from app.queries import filter_invoices, filter_jobs, JOB_STATUS_GROUPS
+from app.tasks import task, enqueue, result_path, task_payload
+
+# Rows are fetched through a server-side cursor in batches of this size and
+# written out chunk by chunk, so memory use does not grow with the export.
+BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def _order_rows(filters):
+    query = db.session.query(
+        Order.order_number, Customer.name, Order.status, Order.created_at,
+        Order.due_date, Order.total_amount, Order.notes
+    ).outerjoin(Customer, Order.customer_id == Customer.id)
+    if filters.get('status') and filters['status'] != 'all':
+        query = query.filter(Order.status == OrderStatus[filters['status']])
+    if filters.get('start_date'):
+        query = query.filter(Order.created_at >= filters['start_date'])
+    if filters.get('end_date'):
+        query = query.filter(Order.created_at <= filters['end_date'])
+    if filters.get('customer_id'):
+        query = query.filter(Order.customer_id == filters['customer_id'])
+    return query.order_by(Order.id)
+
+def _job_rows(filters):
+    query = db.session.query(
+        Job.job_number, Order.order_number, Customer.name, Product.name, Job.status,
+        Job.quantity, Job.created_at, Job.start_date, Job.completion_date,
+        Job.estimated_hours, Job.actual_hours, Job.width, Job.height, Job.pages,
+        Job.colors, Job.paper_type, Job.finishing
+    ).outerjoin(Order, Job.order_id == Order.id) \
+        .outerjoin(Customer, Order.customer_id == Customer.id) \
+        .outerjoin(Product, Job.product_id == Product.id)
+    return filter_jobs(query, filters.get('start_date'), filters.get('end_date'),
+                       filters.get('status', 'all')).order_by(Job.id)
+
+def _invoice_rows(filters):
+    query = db.session.query(
+        Invoice.invoice_number, Order.order_number, Customer.name, Invoice.status,
+        Invoice.created_at, Invoice.due_date, Invoice.amount, Invoice.tax_amount,
+        Invoice.total_amount, Invoice.amount_paid, Invoice.balance_due
+    ).outerjoin(Order, Invoice.order_id == Order.id) \
+        .outerjoin(Customer, Order.customer_id == Customer.id)
+    return filter_invoices(query, filters.get('status', 'all'), filters.get('start_date'),
+                           filters.get('end_date'), filters.get('customer_id')).order_by(Invoice.id)
+
+def _payment_rows(filters):
+    invoice = aliased(Invoice)
+    query = db.session.query(
+        invoice.invoice_number, Customer.name, Payment.payment_date, Payment.amount,
+        Payment.payment_method, Payment.reference_number, Payment.notes
+    ).outerjoin(invoice, Payment.invoice_id == invoice.id) \
+        .outerjoin(Order, invoice.order_id == Order.id) \
+        .outerjoin(Customer, Order.customer_id == Customer.id)
+    if filters.get('start_date'):
+        query = query.filter(Payment.payment_date >= filters['start_date'])
+    if filters.get('end_date'):
+        query = query.filter(Payment.payment_date <= filters['end_date'])
+    if filters.get('customer_id'):
+        query = query.filter(Order.customer_id == filters['customer_id'])
+    return query.order_by(Payment.id)
+
+# Export name -> (column headers, row query builder)
+EXPORTS = {
+    'orders': (['Order Number', 'Customer', 'Status', 'Created', 'Due Date', 'Total Amount', 'Notes'],
+               _order_rows),
+    'jobs': (['Job Number', 'Order Number', 'Customer', 'Product', 'Status', 'Quantity', 'Created',
+              'Start Date', 'Completion Date', 'Estimated Hours', 'Actual Hours', 'Width (mm)',
+              'Height (mm)', 'Pages', 'Colors', 'Paper Type', 'Finishing'],
+             _job_rows),
+    'invoices': (['Invoice Number', 'Order Number', 'Customer', 'Status', 'Created', 'Due Date',
+                  'Amount', 'Tax', 'Total Amount', 'Amount Paid', 'Balance Due'],
+                 _invoice_rows),
+    'payments': (['Invoice Number', 'Customer', 'Payment Date', 'Amount', 'Method', 'Reference', 'Notes'],
+                 _payment_rows),
+}
+
+def _plain(value):
+    """Convert enums and dates to the text shown in exports"""
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+def iter_rows(name, filters=None):
+    """Yield plain row tuples for an export, streaming from the database"""
+    headers, build = EXPORTS[name]
+    query = build(filters or {}).execution_options(stream_results=True, yield_per=BATCH_SIZE)
+    for row in query:
+        yield tuple(_plain(value) for value in row)
+
+def stream_csv(name, filters=None):
+    """Yield an export as CSV text chunks of roughly BATCH_SIZE rows"""
+    headers, build = EXPORTS[name]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for i, row in enumerate(iter_rows(name, filters), 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if i % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+class ChunkSink:
+    """Write-only file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_row(row_number, values):
+    cells = []
+    for i, value in enumerate(values):
+        ref = f'{_column_letter(i)}{row_number}'
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            text = escape(str(value))
+            cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        else:
+            cells.append(f'<c r="{ref}"><v>{value}</v></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+def stream_xlsx(name, filters=None):
+    """Yield an export as a single-sheet XLSX workbook, chunk by chunk
+
+    The workbook is zipped onto a non-seekable sink, so each compressed
+    batch of rows can be sent as soon as it is produced.
+    """
+    headers, build = EXPORTS[name]
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for part, content in XLSX_PARTS.items():
+            workbook.writestr(part, content)
+        workbook.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{escape(name.title())}" sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>'))
+        yield sink.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                         '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                         '<sheetData>' + _xlsx_row(1, headers)).encode())
+            batch = []
+            for row_number, row in enumerate(iter_rows(name, filters), 2):
+                batch.append(_xlsx_row(row_number, row))
+                if len(batch) == BATCH_SIZE:
+                    sheet.write(''.join(batch).encode())
+                    batch = []
+                    yield sink.drain()
+            sheet.write((''.join(batch) + '</sheetData></worksheet>').encode())
+    yield sink.drain()
+
+def stream_export(name, fmt, filters=None):
+    """Yield the chunks of an export in the given format ('csv' or 'xlsx')"""
+    if fmt == 'xlsx':
+        return stream_xlsx(name, filters)
+    return (chunk.encode('utf-8') for chunk in stream_csv(name, filters))
+
+def export_filename(name, fmt):
+    return f"{name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+
+# Export name -> accepted status filter values besides 'all'; payments have no status
+STATUS_FILTERS = {
+    'orders': OrderStatus.__members__,
+    'jobs': JOB_STATUS_GROUPS,
+    'invoices': InvoiceStatus.__members__,
+}
+
+def parse_filters(name, args):
+    """Read export filters from request args using the list view parameter names
+
+    Aborts with 400 for a malformed date or a status the export does not
+    know, before any of the response has been sent.
+    """
+    status = args.get('status') or 'all'
+    if status != 'all' and name in STATUS_FILTERS and status not in STATUS_FILTERS[name]:
+        abort(400)
+    filters = {
+        'status': status,
+        'customer_id': args.get('customer_id', 0, type=int),
+    }
+    for key in ('start_date', 'end_date'):
+        value = args.get(key)
+        if value:
+            try:
+                filters[key] = datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                abort(400)
+    return filters
+
+FILTER_ARGS = ('status', 'customer_id', 'start_date', 'end_date')
+
+@task('export')
+def export_task(name, fmt, args):
+    """Write an export to a result file for later download"""
+    filename = export_filename(name, fmt)
+    with open(result_path(filename), 'wb') as out:
+        for chunk in stream_export(name, fmt, parse_filters(name, MultiDict(args))):
+            out.write(chunk)
+    return {'file': filename, 'mimetype': FORMATS[fmt]}
+
+def export_response(name, fmt, args):
+    """Chunked download response for an export
+
+    With background=1 the export is written by the task runner instead and
+    the response is the task's status (202), to be polled for a download link.
+    """
+    if fmt not in FORMATS or name not in EXPORTS:
+        abort(404)
+    filters = parse_filters(name, args)
+    if args.get('background'):
+        raw = {key: args[key] for key in FILTER_ARGS if args.get(key)}
+        record = enqueue('export', name, fmt, raw, user_id=current_user.id)
+        db.session.commit()
+        return jsonify(task_payload(record)), 202
+    return Response(
+        stream_with_context(stream_export(name, fmt, filters)),
+        mimetype=FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{export_filename(name, fmt)}"'}
+    )
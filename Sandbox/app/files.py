@@ -0,0 +1,265 @@
+import fcntl
+import hashlib
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.utils import secure_filename
+from app import db
+from app.models import JobFile, FileUpload
+
+# Job artwork store. File contents are kept once per SHA-256 under
+# FILE_STORE_FOLDER/objects/ab/cd/<hash>, so reprints of the same artwork
+# share one copy; JobFile rows link jobs to contents by hash and keep the
+# uploaded name. Large files arrive through resumable uploads: the client
+# opens a FileUpload, then appends chunks at the offset the server reports
+# until the whole size has been received. Every write streams straight to
+# disk in COPY_BUFFER pieces, so no request holds a file in memory.
+#
+# Deleting a job file only removes its row. Contents no job refers to are
+# removed later by sweep_blobs(), and only once they have not been touched
+# for FILE_ORPHAN_GRACE_HOURS: attaching existing content touches it
+# first, so a request that is about to link content never loses it to a
+# concurrent delete.
+#
+# A client that sends a hash up front skips the transfer only for content
+# already on the job or uploaded by the same user; otherwise the hash is
+# just checked against the bytes once they have all arrived.
+
+ALLOWED_EXTENSIONS = {'pdf', 'ai', 'psd', 'jpg', 'jpeg', 'png', 'tif', 'tiff', 'eps', 'indd'}
+COPY_BUFFER = 1024 * 1024
+
+class UploadError(ValueError):
+    """Raised for an upload request that cannot be accepted"""
+
+class OffsetMismatch(Exception):
+    """Raised when a chunk does not start where the received bytes end"""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def _store_folder(*parts):
+    return os.path.join(current_app.config['FILE_STORE_FOLDER'], *parts)
+
+def blob_path(sha256):
+    """Path of the stored content for a hash"""
+    return _store_folder('objects', sha256[:2], sha256[2:4], sha256)
+
+def _incoming_path(name):
+    folder = _store_folder('incoming')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name)
+
+def _touch_blob(sha256):
+    """Mark stored content as in use; returns False if it is not stored"""
+    try:
+        os.utime(blob_path(sha256))
+    except FileNotFoundError:
+        return False
+    return True
+
+def _commit_blob(temp_path, sha256):
+    """Move received bytes into the store, or drop them if the content is already there"""
+    path = blob_path(sha256)
+    if _touch_blob(sha256):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+    return path
+
+def attach_file(job, sha256, size, filename, user_id=None):
+    """Link stored content to a job under a file name; does not commit"""
+    job_file = JobFile(job_id=job.id, sha256=sha256, size=size, filename=secure_filename(filename) or 'file',
+                       user_id=user_id)
+    db.session.add(job_file)
+    return job_file
+
+def store_stream(stream):
+    """Copy a file-like object into the store; returns (sha256, size)"""
+    temp_path = _incoming_path(f'stream-{secrets.token_hex(16)}')
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, 'wb') as out:
+            while True:
+                data = stream.read(COPY_BUFFER)
+                if not data:
+                    break
+                hasher.update(data)
+                out.write(data)
+                size += len(data)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    sha256 = hasher.hexdigest()
+    _commit_blob(temp_path, sha256)
+    return sha256, size
+
+def save_upload(job, storage, user_id=None):
+    """Store a form FileStorage and attach it to the job; does not commit"""
+    sha256, size = store_stream(storage.stream)
+    return attach_file(job, sha256, size, storage.filename, user_id)
+
+def delete_job_file(job_file):
+    """Remove a job's file; does not commit
+
+    The stored content stays until sweep_blobs() finds no job refers to it.
+    """
+    db.session.delete(job_file)
+
+def sweep_blobs(grace_hours):
+    """Remove stored contents no job file refers to and untouched for grace_hours; returns how many"""
+    folder = _store_folder('objects')
+    cutoff = time.time() - grace_hours * 3600
+    referenced = {sha256 for (sha256,) in db.session.query(JobFile.sha256).distinct()}
+    count = 0
+    for root, dirs, names in os.walk(folder):
+        for name in names:
+            path = os.path.join(root, name)
+            if name in referenced:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    count += 1
+            except FileNotFoundError:
+                continue
+    return count
+
+# Resumable uploads
+
+# Running hash of uploads whose chunks all came to this process, as
+# {upload id: (bytes hashed, hasher)}. Other uploads are hashed from disk
+# when they complete.
+_hashers = {}
+_hashers_lock = threading.Lock()
+
+def _known_file(job, sha256, user_id):
+    """A job file with this content on the same job or uploaded by the same user, if any"""
+    criteria = [JobFile.job_id == job.id]
+    if user_id is not None:
+        criteria.append(JobFile.user_id == user_id)
+    return JobFile.query.filter(JobFile.sha256 == sha256, db.or_(*criteria)).first()
+
+def start_upload(job, filename, size, user_id=None, sha256=None):
+    """Open a resumable upload, or attach known content at once; does not commit
+
+    Returns a FileUpload, or a JobFile when sha256 names stored content
+    that is already on this job or was uploaded by the same user. Anyone
+    else has to send the bytes, which must then match the hash, so knowing
+    a hash is not enough to get at someone else's file.
+    """
+    if not filename or not allowed_file(filename):
+        raise UploadError('File type not allowed')
+    if size is None or size <= 0 or size > current_app.config['UPLOAD_MAX_SIZE']:
+        raise UploadError('Invalid file size')
+    if sha256:
+        sha256 = sha256.lower()
+        if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+            raise UploadError('Invalid sha256')
+        known = _known_file(job, sha256, user_id)
+        if known is not None and _touch_blob(sha256):
+            return attach_file(job, sha256, known.size, filename, user_id)
+    upload = FileUpload(id=secrets.token_urlsafe(32), job_id=job.id, user_id=user_id,
+                        filename=filename, size=size, sha256=sha256)
+    db.session.add(upload)
+    open(_incoming_path(upload.id), 'wb').close()
+    with _hashers_lock:
+        _hashers[upload.id] = (0, hashlib.sha256())
+    return upload
+
+def upload_offset(upload):
+    """Bytes received so far"""
+    path = _incoming_path(upload.id)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def append_chunk(upload, offset, stream, length):
+    """Append length bytes from stream at offset; returns the new offset
+
+    Raises OffsetMismatch if offset is not the current end of the upload,
+    including when another request is writing to it.
+    """
+    path = _incoming_path(upload.id)
+    with open(path, 'ab') as out:
+        try:
+            fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise OffsetMismatch(upload_offset(upload))
+        current = out.seek(0, os.SEEK_END)
+        if offset != current:
+            raise OffsetMismatch(current)
+        if current + length > upload.size:
+            raise UploadError('Chunk runs past the declared size')
+
+        with _hashers_lock:
+            hashed, hasher = _hashers.pop(upload.id, (None, None))
+        if hashed != current:
+            hasher = None
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_BUFFER, remaining))
+            if not data:
+                break
+            out.write(data)
+            if hasher:
+                hasher.update(data)
+            remaining -= len(data)
+        out.flush()
+        end = out.tell()
+        if hasher and not remaining:
+            with _hashers_lock:
+                _hashers[upload.id] = (end, hasher)
+        return end
+
+def _hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(COPY_BUFFER), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+def finish_upload(upload):
+    """Move a fully received upload into the store and attach it to its job; commits"""
+    path = _incoming_path(upload.id)
+    size = upload_offset(upload)
+    if size != upload.size:
+        raise OffsetMismatch(size)
+    with _hashers_lock:
+        hashed, hasher = _hashers.pop(upload.id, (None, None))
+    sha256 = hasher.hexdigest() if hasher and hashed == size else _hash_file(path)
+    if upload.sha256 and upload.sha256 != sha256:
+        cancel_upload(upload)
+        raise UploadError('Content does not match the declared sha256')
+    _commit_blob(path, sha256)
+    job_file = attach_file(upload.job, sha256, size, upload.filename, upload.user_id)
+    db.session.delete(upload)
+    db.session.commit()
+    return job_file
+
+def cancel_upload(upload):
+    """Discard an upload and the bytes received; commits"""
+    path = _incoming_path(upload.id)
+    if os.path.exists(path):
+        os.remove(path)
+    with _hashers_lock:
+        _hashers.pop(upload.id, None)
+    db.session.delete(upload)
+    db.session.commit()
+
+def expire_uploads(hours):
+    """Cancel uploads that have not received data for hours; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    count = 0
+    for upload in FileUpload.query.filter(FileUpload.created_at < cutoff).all():
+        path = _incoming_path(upload.id)
+        if not os.path.exists(path) or datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+            cancel_upload(upload)
+            count += 1
+    return count
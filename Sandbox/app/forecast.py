@@ -0,0 +1,177 @@
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from app import db
+from app.models import Job, Order, OrderForecast, JobStatus, OrderStatus
+from app.scheduler import get_schedule
+from app.tasks import task
+
+# Due-date risk for open orders. Overrun ratios (actual_hours /
+# estimated_hours) of completed jobs are kept per product. Each simulation
+# draws a ratio per open job from its product's history (or every
+# product's, when a product has few completed jobs), stretches the job's
+# remaining work hours (not the time it waits for a workstation) and adds
+# them to its scheduled finish, and takes the latest job in each order as
+# the order's finish. All draws for a chunk of orders are one
+# (jobs x samples) array.
+#
+# Results are stored in order_forecasts, shared by every process. Views
+# only read the table; `flask forecast` (run from cron) or the
+# forecast_refresh task recomputes every order, and completing a job
+# recomputes only the orders it can affect.
+
+OrderRisk = namedtuple('OrderRisk', ['order_id', 'due_date', 'probability', 'p50', 'p90'])
+
+MIN_PRODUCT_SAMPLES = 5
+RATIO_BOUNDS = (0.2, 5.0)
+CHUNK_JOBS = 4096
+CLOSED_ORDER_STATUSES = [OrderStatus.QUOTE, OrderStatus.DELIVERED, OrderStatus.CANCELLED]
+
+class OverrunModel:
+    """Observed actual/estimated hour ratios of completed jobs, per product"""
+
+    def __init__(self):
+        self.by_product = {}
+        self.pooled = []
+
+    @classmethod
+    def load(cls):
+        model = cls()
+        rows = db.session.query(Job.product_id, Job.estimated_hours, Job.actual_hours) \
+            .filter(Job.status == JobStatus.COMPLETED, Job.estimated_hours > 0, Job.actual_hours > 0)
+        for product_id, estimated, actual in rows:
+            model.add(product_id, estimated, actual)
+        return model
+
+    def add(self, product_id, estimated, actual):
+        if not estimated or not actual or estimated <= 0 or actual <= 0:
+            return
+        ratio = min(max(actual / estimated, RATIO_BOUNDS[0]), RATIO_BOUNDS[1])
+        self.by_product.setdefault(product_id, []).append(ratio)
+        self.pooled.append(ratio)
+
+    def samples(self, product_id):
+        """Ratios to draw from for a product"""
+        ratios = self.by_product.get(product_id, [])
+        if len(ratios) >= MIN_PRODUCT_SAMPLES:
+            return np.asarray(ratios)
+        return np.asarray(self.pooled or [1.0])
+
+def _open_jobs(schedule, order_ids=None):
+    """(order id, due date, product id, scheduled finish, remaining work hours) for open jobs of dated,
+    open orders"""
+    query = db.session.query(Job.id, Job.order_id, Order.due_date, Job.product_id) \
+        .join(Order, Job.order_id == Order.id) \
+        .filter(Order.due_date.isnot(None), Job.status != JobStatus.COMPLETED,
+                Order.status.notin_(CLOSED_ORDER_STATUSES))
+    if order_ids is not None:
+        query = query.filter(Job.order_id.in_(order_ids))
+    rows = []
+    for job_id, order_id, due_date, product_id in query:
+        placement = schedule.placements.get(job_id)
+        finish = placement.end if placement else 0.0
+        work = sum(end - begin for _, begin, end in placement.stages) if placement else 0.0
+        rows.append((order_id, due_date, product_id, finish, work))
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+def simulate(model, schedule, order_ids=None, samples=None, seed=None):
+    """Monte Carlo due-date risk for open orders; returns {order_id: OrderRisk}"""
+    samples = samples or current_app.config['FORECAST_SAMPLES']
+    rng = np.random.default_rng(seed)
+    rows = _open_jobs(schedule, order_ids)
+    risks = {}
+    calendar = schedule.calendar
+
+    # Chunks of whole orders keep the draw array bounded
+    start = 0
+    while start < len(rows):
+        end = min(start + CHUNK_JOBS, len(rows))
+        while end < len(rows) and rows[end][0] == rows[end - 1][0]:
+            end += 1
+        chunk = rows[start:end]
+        start = end
+
+        order_col = np.array([row[0] for row in chunk])
+        product_col = [row[2] for row in chunk]
+        scheduled = np.array([row[3] for row in chunk], dtype=np.float64)
+        work = np.array([row[4] for row in chunk], dtype=np.float64)
+
+        ratios = np.ones((len(chunk), samples))
+        products = np.array(product_col, dtype=object)
+        for product_id in set(product_col):
+            mask = products == product_id
+            pool = model.samples(product_id)
+            ratios[mask] = pool[rng.integers(0, len(pool), size=(int(mask.sum()), samples))]
+
+        # Queueing stays as scheduled; only the work itself over- or underruns
+        finish = scheduled[:, None] + work[:, None] * (ratios - 1.0)
+        firsts = np.flatnonzero(np.r_[True, order_col[1:] != order_col[:-1]])
+        order_finish = np.maximum.reduceat(finish, firsts, axis=0)
+        due_dates = [chunk[i][1] for i in firsts]
+        due_hours = calendar.to_hours(due_dates)
+        probability = (order_finish > due_hours[:, None]).mean(axis=1)
+        p50, p90 = np.percentile(order_finish, [50, 90], axis=1)
+
+        for i, first in enumerate(firsts):
+            order_id = int(order_col[first])
+            risks[order_id] = OrderRisk(order_id, due_dates[i], float(probability[i]),
+                                        calendar.to_datetime(float(p50[i])),
+                                        calendar.to_datetime(float(p90[i])))
+    return risks
+
+def _store(risks, order_ids=None):
+    """Replace the stored forecasts of order_ids (or of every order) with risks; does not commit"""
+    query = OrderForecast.query
+    if order_ids is not None:
+        query = query.filter(OrderForecast.order_id.in_(order_ids))
+    query.delete(synchronize_session=False)
+    computed_at = datetime.utcnow()
+    db.session.add_all(OrderForecast(order_id=risk.order_id, due_date=risk.due_date, probability=risk.probability,
+                                     p50=risk.p50, p90=risk.p90, computed_at=computed_at)
+                       for risk in risks.values())
+
+def refresh():
+    """Reload the overrun model, recompute every open order and store the results; commits"""
+    risks = simulate(OverrunModel.load(), get_schedule())
+    _store(risks)
+    db.session.commit()
+    return risks
+
+@task('forecast_refresh')
+def refresh_task():
+    """refresh() in the background; returns how many orders were forecast"""
+    return {'orders': len(refresh())}
+
+def get_order_risks(order_ids):
+    """Stored forecast (OrderForecast) per order id, for orders that have one"""
+    if not order_ids:
+        return {}
+    rows = OrderForecast.query.filter(OrderForecast.order_id.in_(list(order_ids)))
+    return {row.order_id: row for row in rows}
+
+def job_completed(job, moved_job_ids=()):
+    """Recompute and store the forecasts of the orders a completed job can affect; commits
+
+    Affected orders are the job's own order, open orders with jobs of the
+    same product, and orders of any jobs the scheduler moved as a result.
+    The overrun model is reloaded, so it includes the job.
+    """
+    moved = list(moved_job_ids)
+    affected = {job.order_id}
+    affected.update(order_id for (order_id,) in db.session.query(Job.order_id).filter(
+        Job.product_id == job.product_id, Job.status != JobStatus.COMPLETED))
+    if moved:
+        affected.update(order_id for (order_id,) in
+                        db.session.query(Job.order_id).filter(Job.id.in_(moved)))
+    affected.discard(None)
+    _store(simulate(OverrunModel.load(), get_schedule(), affected), affected)
+    db.session.commit()
+
+@task('forecast_job_completed')
+def job_completed_task(job_id, moved_job_ids):
+    """job_completed() for a job id, run in the background"""
+    job = db.session.get(Job, job_id)
+    if job is not None:
+        job_completed(job, moved_job_ids)
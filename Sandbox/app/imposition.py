@@ -0,0 +1,106 @@
+from collections import namedtuple
+from functools import lru_cache
+import math
+from flask import current_app
+
+# Layouts are at most two guillotine blocks: a grid of pieces in one
+# orientation plus a strip of rotated pieces in the leftover width or
+# height. The same handful of piece and sheet sizes repeat across thousands
+# of jobs, so layouts are memoized; sizes are rounded to 0.1 mm to keep
+# keys stable.
+
+LAYOUT_CACHE_SIZE = 4096
+
+Block = namedtuple('Block', ['across', 'down', 'rotated'])
+Layout = namedtuple('Layout', ['up', 'blocks', 'efficiency'])
+ImpositionPlan = namedtuple('ImpositionPlan', ['sheet_name', 'sheet_size', 'layout', 'sheets'])
+
+def parse_colors(colors):
+    """Split a '4/4' style colour spec into (front, back) colour counts"""
+    if not colors:
+        return 4, 0
+    parts = str(colors).replace(' ', '').split('/')
+    try:
+        front = int(parts[0])
+        back = int(parts[1]) if len(parts) > 1 and parts[1] else 0
+    except ValueError:
+        return 4, 0
+    return max(front, 0), max(back, 0)
+
+def _round(value):
+    return round(float(value), 1)
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def _layout(piece_w, piece_h, sheet_w, sheet_h, bleed, margin):
+    w, h = piece_w + 2 * bleed, piece_h + 2 * bleed
+    usable_w, usable_h = sheet_w - 2 * margin, sheet_h - 2 * margin
+    best = Layout(0, (), 0.0)
+    if w <= 0 or h <= 0 or usable_w <= 0 or usable_h <= 0:
+        return best
+
+    for a, b, rotated in ((w, h, False), (h, w, True)):
+        full_across, full_down = math.floor(usable_w / a), math.floor(usable_h / b)
+        # Main block of `across` columns with a rotated strip in the width left over
+        splits = [(Block(across, full_down, rotated),
+                   Block(math.floor((usable_w - across * a) / b), math.floor(usable_h / a), not rotated))
+                  for across in range(full_across, -1, -1)]
+        # Main block of `down` rows with a rotated strip in the height left over
+        splits += [(Block(full_across, down, rotated),
+                    Block(math.floor(usable_w / b), math.floor((usable_h - down * b) / a), not rotated))
+                   for down in range(full_down, -1, -1)]
+        for main, rest in splits:
+            up = main.across * main.down + rest.across * rest.down
+            if up > best.up:
+                blocks = tuple(block for block in (main, rest) if block.across and block.down)
+                best = Layout(up, blocks, up * piece_w * piece_h / (sheet_w * sheet_h))
+    return best
+
+def layout(piece_w, piece_h, sheet_w, sheet_h, bleed=None, margin=None):
+    """Most pieces of a finished size that fit on a sheet, with bleed around each piece
+
+    Sizes are in mm. margin is the unprintable edge (gripper) on each side
+    of the sheet. Returns a Layout with up == 0 when the piece does not fit.
+    """
+    if bleed is None:
+        bleed = current_app.config['IMPOSITION_BLEED']
+    if margin is None:
+        margin = current_app.config['IMPOSITION_MARGIN']
+    return _layout(_round(piece_w), _round(piece_h), _round(sheet_w), _round(sheet_h),
+                   _round(bleed), _round(margin))
+
+def layout_cache_info():
+    """Hit/miss statistics for the layout memo"""
+    return _layout.cache_info()
+
+def sheets_needed(quantity, up, pages=1, sides=1):
+    """Press sheets for a run: each piece has ceil(pages / sides) leaves"""
+    if not up:
+        return None
+    leaves = math.ceil((pages or 1) / sides)
+    return math.ceil((quantity or 0) * leaves / up)
+
+def best_plan(width, height, quantity=1, pages=1, sides=1, sheet_sizes=None, bleed=None):
+    """Sheet size from the catalog that uses the least paper area for a run
+
+    sheet_sizes maps a name to (width, height) in mm and defaults to the
+    SHEET_SIZES config. Returns None if the piece fits no sheet.
+    """
+    sheet_sizes = sheet_sizes or current_app.config['SHEET_SIZES']
+    best, best_area = None, None
+    for name, (sheet_w, sheet_h) in sheet_sizes.items():
+        fit = layout(width, height, sheet_w, sheet_h, bleed)
+        if not fit.up:
+            continue
+        sheets = sheets_needed(quantity, fit.up, pages, sides)
+        area = sheets * sheet_w * sheet_h
+        if best_area is None or area < best_area or (area == best_area and fit.up > best.layout.up):
+            best, best_area = ImpositionPlan(name, (sheet_w, sheet_h), fit, sheets), area
+    return best
+
+def plan_job(job, sheet_sizes=None, bleed=None):
+    """Best imposition for a job's finished size, or None if it has no size"""
+    if not job.width or not job.height:
+        return None
+    sides = 2 if parse_colors(job.colors)[1] else 1
+    return best_plan(float(job.width), float(job.height), job.quantity or 1, job.pages or 1,
+                     sides, sheet_sizes, bleed)
@@ -0,0 +1,85 @@
+import json
+import logging
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from app import db
+
+# Per-request database timing. Cursor execute events on the app's engine
+# count statements and add up their time in flask.g; each response gets a
+# Server-Timing header and one JSON log line with the totals. Statements
+# slower than SQL_SLOW_QUERY_MS are logged in full with their parameters,
+# whether or not they ran in a request (background tasks, CLI commands).
+# Queries run while a streamed response body is sent come after the
+# header has gone out and are not counted.
+
+logger = logging.getLogger('app.sql')
+
+MAX_PARAMETERS_LOGGED = 2000  # Characters of bound parameters kept in a slow query log line
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _record(conn, statement, parameters, executemany, threshold):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'sql_queries' in g:
+        g.sql_queries += 1
+        g.sql_seconds += elapsed
+    if threshold is not None and elapsed * 1000 >= threshold:
+        logger.warning(json.dumps({
+            'event': 'slow_query',
+            'duration_ms': round(elapsed * 1000, 2),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'statement': statement,
+            'parameters': repr(parameters)[:MAX_PARAMETERS_LOGGED],
+            'executemany': executemany,
+        }))
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    starts = exception_context.connection.info.get('query_start') if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def register_instrumentation(app):
+    """Hook query counting and timing into the app's engine and requests"""
+    if not app.config['SQL_INSTRUMENTATION']:
+        return
+
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        _record(conn, statement, parameters, executemany, app.config['SQL_SLOW_QUERY_MS'])
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+    @app.before_request
+    def start_request_timing():
+        g.request_start = time.perf_counter()
+        g.sql_queries = 0
+        g.sql_seconds = 0.0
+
+    @app.after_request
+    def report_request_timing(response):
+        if 'request_start' not in g:
+            return response
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        db_ms = g.sql_seconds * 1000
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.2f};desc="{g.sql_queries} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total_ms:.2f}')
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 2),
+            'db_queries': g.sql_queries,
+            'db_ms': round(db_ms, 2),
+        }))
+        return response
@@ -1,37 +1,47 @@
 from datetime import datetime, timedelta
-from flask import render_template, redirect, url_for, flash, request, current_app
-from flask_login import login_required
+from flask import render_template, redirect, url_for, flash, request, current_app, jsonify, abort, send_file, \
+    Response, stream_with_context
+from flask_login import login_required, current_user
 from app import db
 from app.invoicing import bp
 from app.invoicing.forms import InvoiceForm, PaymentForm, InvoiceSearchForm, InvoiceReportForm
-from app.models import Invoice, Order, Customer, Payment, InvoiceStatus
+from app.models import Invoice, Order, Payment, InvoiceStatus
+from app.metrics import get_status_snapshot
+from app.queries import with_invoice_relations, filter_invoices
+from app.sequences import next_number
+from app.pagination import paginate_query
+from app.reporting import monthly_invoice_summary, invoice_status_report
+from app.exports import export_response
+from app.mail import queue_email
+from app.documents import invoice_pdf, month_invoices, month_invoice_count, stream_invoice_zip, zip_filename
+from app.tasks import enqueue, task_payload
+from app.choices import get_choices
+
+# Sort keys for the invoice list; the trailing id makes the order total for cursors
+INVOICE_LIST_KEYS = [(Invoice.created_at, True), (Invoice.id, True)]
 
 @bp.route('/')
 @login_required
 def index():
     """Invoice dashboard showing recent and outstanding invoices"""
-    # Get counts of invoices by status
-    draft_count = Invoice.query.filter_by(status=InvoiceStatus.DRAFT).count()
-    sent_count = Invoice.query.filter_by(status=InvoiceStatus.SENT).count()
-    paid_count = Invoice.query.filter_by(status=InvoiceStatus.PAID).count()
-    overdue_count = Invoice.query.filter_by(status=InvoiceStatus.OVERDUE).count()
+    # Get counts and totals of invoices by status in a single grouped query
+    snapshot = get_status_snapshot(orders=False, jobs=False, customers=False)
     
-    # Calculate total outstanding amount
-    outstanding_invoices = Invoice.query.filter(Invoice.status.in_([InvoiceStatus.SENT, InvoiceStatus.OVERDUE])).all()
-    total_outstanding = sum(invoice.total_amount for invoice in outstanding_invoices)
+    # Total outstanding is the maintained balance_due, summed in the same grouped query
+    total_outstanding = snapshot.outstanding(InvoiceStatus.SENT, InvoiceStatus.OVERDUE)
     
     # Get recent invoices
-    recent_invoices = Invoice.query.order_by(Invoice.created_at.desc()).limit(10).all()
+    recent_invoices = with_invoice_relations(Invoice.query).order_by(Invoice.created_at.desc()).limit(10).all()
     
     # Get overdue invoices
-    overdue_invoices = Invoice.query.filter_by(status=InvoiceStatus.OVERDUE).order_by(Invoice.due_date).all()
+    overdue_invoices = with_invoice_relations(Invoice.query).filter_by(status=InvoiceStatus.OVERDUE).order_by(Invoice.due_date).all()
     
     return render_template('invoicing/index.html', 
                           title='Invoicing Dashboard',
-                          draft_count=draft_count,
-                          sent_count=sent_count,
-                          paid_count=paid_count,
-                          overdue_count=overdue_count,
+                          draft_count=snapshot.invoices(InvoiceStatus.DRAFT),
+                          sent_count=snapshot.invoices(InvoiceStatus.SENT),
+                          paid_count=snapshot.invoices(InvoiceStatus.PAID),
+                          overdue_count=snapshot.invoices(InvoiceStatus.OVERDUE),
                           total_outstanding=total_outstanding,
                           recent_invoices=recent_invoices,
                           overdue_invoices=overdue_invoices)
@@ -43,15 +53,16 @@ def list_invoices():
     form = InvoiceSearchForm()
     
     # Populate customer choices
-    form.customer_id.choices = [(0, 'All Customers')] + [
-        (c.id, c.name) for c in Customer.query.order_by(Customer.name).all()
-    ]
+    form.customer_id.choices = [(0, 'All Customers')] + get_choices('customer')
     
     # Get filter parameters from request
     status = request.args.get('status', 'all')
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
-    customer_id = request.args.get('customer_id', '0', type=int)
+    customer_id = request.args.get('customer_id', 0, type=int)
+    
+    if status != 'all' and status not in InvoiceStatus.__members__:
+        abort(400)
     
     # Set form values from request
     if status != 'all':
@@ -63,35 +74,36 @@ def list_invoices():
     if customer_id:
         form.customer_id.data = customer_id
     
-    # Start with base query
-    query = Invoice.query
-    
-    # Apply filters
-    if status != 'all':
-        query = query.filter_by(status=InvoiceStatus[status])
-    
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at >= start_date)
-    
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at <= end_date)
-    
-    if customer_id > 0:
-        # Join through orders to filter by customer
-        query = query.join(Order).filter(Order.customer_id == customer_id)
+    # Start with base query, loading order and customer alongside each invoice,
+    # and apply the same filters the invoice export uses
+    query = filter_invoices(
+        with_invoice_relations(Invoice.query),
+        status=status,
+        start_date=form.start_date.data if start_date_str else None,
+        end_date=form.end_date.data if end_date_str else None,
+        customer_id=customer_id
+    )
     
     # Get paginated results
-    page = request.args.get('page', 1, type=int)
-    invoices = query.order_by(Invoice.created_at.desc()).paginate(
-        page=page, per_page=current_app.config['ITEMS_PER_PAGE'], error_out=False)
+    invoices = paginate_query(query, INVOICE_LIST_KEYS, current_app.config['ITEMS_PER_PAGE'])
     
     return render_template('invoicing/list.html',
                           title='Invoices',
                           form=form,
                           invoices=invoices)
 
+@bp.route('/export/<fmt>')
+@login_required
+def export_invoices(fmt):
+    """Download invoices as CSV or XLSX using the invoice list filters"""
+    return export_response('invoices', fmt, request.args)
+
+@bp.route('/payments/export/<fmt>')
+@login_required
+def export_payments(fmt):
+    """Download payments as CSV or XLSX"""
+    return export_response('payments', fmt, request.args)
+
 @bp.route('/create/<int:order_id>', methods=['GET', 'POST'])
 @login_required
 def create_invoice(order_id):
@@ -100,18 +112,8 @@ def create_invoice(order_id):
     form = InvoiceForm()
     
     if form.validate_on_submit():
-        # Generate a unique invoice number: INV-YYYYMMDD-XXX
-        date_str = datetime.utcnow().strftime('%Y%m%d')
-        last_invoice = Invoice.query.filter(Invoice.invoice_number.like(f'INV-{date_str}-%')).order_by(
-            Invoice.invoice_number.desc()).first()
-        
-        if last_invoice:
-            last_num = int(last_invoice.invoice_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-            
-        invoice_number = f'INV-{date_str}-{new_num:03d}'
+        # Allocate a unique invoice number: INV-YYYYMMDD-XXX
+        invoice_number = next_number('INV')
         
         # Calculate total amount
         amount = form.amount.data
@@ -154,16 +156,43 @@ def view_invoice(id):
     invoice = Invoice.query.get_or_404(id)
     payments = Payment.query.filter_by(invoice_id=invoice.id).order_by(Payment.payment_date).all()
     
-    # Calculate total paid amount
-    total_paid = sum(payment.amount for payment in payments)
-    balance_due = invoice.total_amount - total_paid
-    
     return render_template('invoicing/view_invoice.html',
                           title=f'Invoice {invoice.invoice_number}',
                           invoice=invoice,
                           payments=payments,
-                          total_paid=total_paid,
-                          balance_due=balance_due)
+                          total_paid=invoice.amount_paid,
+                          balance_due=invoice.balance_due)
+
+@bp.route('/<int:id>/pdf')
+@login_required
+def invoice_pdf_view(id):
+    """Invoice as a PDF, rendered once per change and then served from the cache"""
+    invoice = Invoice.query.get_or_404(id)
+    return send_file(invoice_pdf(invoice), mimetype='application/pdf',
+                     as_attachment=bool(request.args.get('download')),
+                     download_name=f'{invoice.invoice_number}.pdf')
+
+@bp.route('/pdf/<int:year>/<int:month>')
+@login_required
+def invoice_pdf_zip(year, month):
+    """ZIP of PDFs for every invoice created in a month, streamed as it is built
+    
+    With background=1, or when the month has more than PDF_INLINE_ZIP_MAX
+    invoices, the ZIP is built by the task runner and the task's status is
+    returned (202) instead.
+    """
+    if not 1 <= month <= 12 or not 1900 <= year <= 9999:
+        abort(404)
+    if request.args.get('background') or \
+            month_invoice_count(year, month) > current_app.config['PDF_INLINE_ZIP_MAX']:
+        record = enqueue('invoice_zip', year, month, user_id=current_user.id)
+        db.session.commit()
+        return jsonify(task_payload(record)), 202
+    return Response(
+        stream_with_context(stream_invoice_zip(month_invoices(year, month))),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{zip_filename(year, month)}"'}
+    )
 
 @bp.route('/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -215,15 +244,13 @@ def record_payment(id):
     """Record a payment for an invoice"""
     invoice = Invoice.query.get_or_404(id)
     
-    # Calculate current balance
-    payments = Payment.query.filter_by(invoice_id=invoice.id).all()
-    total_paid = sum(payment.amount for payment in payments)
-    balance_due = invoice.total_amount - total_paid
+    # Current balance is maintained on the invoice as payments are recorded
+    balance_due = invoice.balance_due
     
     form = PaymentForm()
     
     if form.validate_on_submit():
-        payment_amount = form.amount.data
+        payment_amount = float(form.amount.data)
         
         # Validate payment amount
         if payment_amount > balance_due:
@@ -241,7 +268,7 @@ def record_payment(id):
             db.session.add(payment)
             
             # Update invoice status if fully paid
-            new_total_paid = total_paid + payment_amount
+            new_total_paid = invoice.amount_paid + payment_amount
             if new_total_paid >= invoice.total_amount:
                 invoice.status = InvoiceStatus.PAID
             else:
@@ -273,6 +300,13 @@ def mark_sent(id):
     
     if invoice.status == InvoiceStatus.DRAFT:
         invoice.status = InvoiceStatus.SENT
+        
+        # Email the customer in the background when mail is configured
+        customer = invoice.order.customer if invoice.order else None
+        if current_app.config['MAIL_SERVER'] and customer and customer.email:
+            queue_email([customer.email], f'Invoice {invoice.invoice_number}',
+                        render_template('invoicing/email_invoice.txt', invoice=invoice, customer=customer),
+                        user_id=current_user.id)
         db.session.commit()
         flash('Invoice marked as sent', 'success')
     else:
@@ -323,65 +357,19 @@ def reports():
         end_date = form.end_date.data
         report_type = form.report_type.data
         
-        # Base query - invoices within date range
-        query = Invoice.query.filter(
-            (Invoice.created_at >= start_date) & 
-            (Invoice.created_at <= end_date)
-        )
-        
-        if report_type == 'outstanding':
-            # Outstanding invoices (sent or overdue)
-            invoices = query.filter(Invoice.status.in_([InvoiceStatus.SENT, InvoiceStatus.OVERDUE])).order_by(Invoice.due_date).all()
-            title = "Outstanding Invoices Report"
-            
-        elif report_type == 'paid':
-            # Paid invoices
-            invoices = query.filter_by(status=InvoiceStatus.PAID).order_by(Invoice.created_at.desc()).all()
-            title = "Paid Invoices Report"
-            
-        elif report_type == 'overdue':
-            # Overdue invoices
-            invoices = query.filter_by(status=InvoiceStatus.OVERDUE).order_by(Invoice.due_date).all()
-            title = "Overdue Invoices Report"
-            
-        elif report_type == 'monthly':
-            # Monthly summary - group by month
-            invoices = query.order_by(Invoice.created_at).all()
-            
-            # Group by month
-            monthly_data = {}
-            for invoice in invoices:
-                month_key = invoice.created_at.strftime('%Y-%m')
-                if month_key not in monthly_data:
-                    monthly_data[month_key] = {
-                        'month': invoice.created_at.strftime('%B %Y'),
-                        'count': 0,
-                        'total': 0,
-                        'paid': 0,
-                        'outstanding': 0
-                    }
-                
-                monthly_data[month_key]['count'] += 1
-                monthly_data[month_key]['total'] += invoice.total_amount
-                
-                if invoice.status == InvoiceStatus.PAID:
-                    monthly_data[month_key]['paid'] += invoice.total_amount
-                elif invoice.status in [InvoiceStatus.SENT, InvoiceStatus.OVERDUE]:
-                    monthly_data[month_key]['outstanding'] += invoice.total_amount
-            
-            # Sort by month
-            months = sorted(monthly_data.keys())
-            sorted_monthly_data = [monthly_data[month] for month in months]
+        if report_type == 'monthly':
+            # Monthly summary - grouped by month and status in the database
+            monthly_data, totals = monthly_invoice_summary(start_date, end_date)
             
             # Prepare report data
             report_data = {
                 'title': "Monthly Invoicing Summary",
                 'start_date': start_date,
                 'end_date': end_date,
-                'monthly_data': sorted_monthly_data,
-                'total_invoiced': sum(invoice.total_amount for invoice in invoices),
-                'total_paid': sum(invoice.total_amount for invoice in invoices if invoice.status == InvoiceStatus.PAID),
-                'total_outstanding': sum(invoice.total_amount for invoice in invoices if invoice.status in [InvoiceStatus.SENT, InvoiceStatus.OVERDUE])
+                'monthly_data': monthly_data,
+                'total_invoiced': totals['total_invoiced'],
+                'total_paid': totals['total_paid'],
+                'total_outstanding': totals['total_outstanding']
             }
             
             return render_template('invoicing/monthly_report.html',
@@ -389,17 +377,19 @@ def reports():
                                   form=form,
                                   report_data=report_data)
         
-        # For non-monthly reports, calculate totals
-        total_amount = sum(invoice.total_amount for invoice in invoices)
+        # Outstanding, paid and overdue reports share one row query and SQL totals
+        title, report = invoice_status_report(report_type, start_date, end_date,
+                                              current_app.config['REPORT_MAX_ROWS'])
         
         # Prepare report data
         report_data = {
             'title': title,
             'start_date': start_date,
             'end_date': end_date,
-            'invoices': invoices,
-            'total_amount': total_amount,
-            'count': len(invoices)
+            'invoices': report.rows,
+            'total_amount': report.total_amount,
+            'count': report.count,
+            'truncated': report.truncated
         }
     
     # Default to current month for initial form display
@@ -0,0 +1,119 @@
+from collections import namedtuple
+from datetime import datetime
+from flask import has_request_context
+from flask_login import current_user
+from sqlalchemy import event, func, literal
+from sqlalchemy.orm.attributes import get_history
+from app import db
+from app.models import Job, JobStatus, JobStatusEvent
+
+# Every job status transition is written to job_status_events in the same
+# flush that changes Job.status, including the initial status of new jobs.
+# Routes attach a note or timestamp with change_job_status(); any other
+# assignment to Job.status is still recorded, just without a note.
+
+StageTime = namedtuple('StageTime', ['status', 'visits', 'total_hours', 'avg_hours'])
+
+def change_job_status(job, status, note=None, at=None):
+    """Move a job to a new status, recording an optional note on the event"""
+    job.status = status
+    db.session.info.setdefault('job_status_details', {})[id(job)] = (note, at)
+
+def _current_user_id():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+@event.listens_for(db.session, 'before_flush')
+def _record_status_events(session, flush_context, instances):
+    details = session.info.pop('job_status_details', {})
+    for job in list(session.new) + list(session.dirty):
+        if not isinstance(job, Job):
+            continue
+        if job in session.new:
+            from_status, to_status = None, job.status or JobStatus.PENDING
+        else:
+            history = get_history(job, 'status')
+            if not history.has_changes() or not history.added:
+                continue
+            from_status = history.deleted[0] if history.deleted else None
+            to_status = history.added[0]
+            if from_status == to_status:
+                continue
+        note, at = details.get(id(job), (None, None))
+        session.add(JobStatusEvent(job=job, from_status=from_status, to_status=to_status,
+                                   at=at or datetime.utcnow(), user_id=_current_user_id(), note=note))
+
+# Load the previous status when it is reassigned, even after a commit has
+# expired it, so the event records where the job came from.
+@event.listens_for(Job.status, 'set', active_history=True)
+def _track_previous_status(target, value, oldvalue, initiator):
+    pass
+
+def seconds_between(start, end):
+    """SQL expression for the number of seconds between two datetime columns"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.extract('epoch', end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400.0
+
+def _stage_intervals(now):
+    """Subquery of events with the time each job left the stage (or now if it has not)"""
+    left_at = func.lead(JobStatusEvent.at).over(
+        partition_by=JobStatusEvent.job_id,
+        order_by=(JobStatusEvent.at, JobStatusEvent.id)
+    )
+    return db.session.query(
+        JobStatusEvent.job_id.label('job_id'),
+        JobStatusEvent.to_status.label('status'),
+        JobStatusEvent.at.label('entered_at'),
+        func.coalesce(left_at, literal(now, db.DateTime)).label('left_at')
+    ).subquery()
+
+def time_in_stage(start_date=None, end_date=None, job_id=None):
+    """Visits and hours spent per stage, for stage entries in the date range
+
+    Stages a job is still in are measured up to now. Returns a dict of
+    JobStatus -> StageTime; the terminal COMPLETED stage is left out.
+    """
+    intervals = _stage_intervals(datetime.utcnow())
+    seconds = seconds_between(intervals.c.entered_at, intervals.c.left_at)
+    query = db.session.query(
+        intervals.c.status, func.count(), func.coalesce(func.sum(seconds), 0.0)
+    ).filter(intervals.c.status != JobStatus.COMPLETED)
+    if start_date:
+        query = query.filter(intervals.c.entered_at >= start_date)
+    if end_date:
+        query = query.filter(intervals.c.entered_at <= end_date)
+    if job_id:
+        query = query.filter(intervals.c.job_id == job_id)
+
+    stages = {}
+    for status, visits, total_seconds in query.group_by(intervals.c.status):
+        total_hours = float(total_seconds) / 3600.0
+        stages[status] = StageTime(status, visits, total_hours, total_hours / visits if visits else 0.0)
+    return stages
+
+def stage_throughput(start_date, end_date):
+    """Number of jobs entering each stage within the date range"""
+    rows = db.session.query(JobStatusEvent.to_status, func.count(JobStatusEvent.id)) \
+        .filter(JobStatusEvent.at >= start_date, JobStatusEvent.at <= end_date) \
+        .group_by(JobStatusEvent.to_status)
+    counts = {status: 0 for status in JobStatus}
+    counts.update({status: count for status, count in rows})
+    return counts
+
+def wip_at(when):
+    """Number of jobs in each stage at the given moment"""
+    ranked = db.session.query(
+        JobStatusEvent.to_status.label('status'),
+        func.row_number().over(
+            partition_by=JobStatusEvent.job_id,
+            order_by=(JobStatusEvent.at.desc(), JobStatusEvent.id.desc())
+        ).label('rank')
+    ).filter(JobStatusEvent.at <= when).subquery()
+
+    rows = db.session.query(ranked.c.status, func.count()) \
+        .filter(ranked.c.rank == 1).group_by(ranked.c.status)
+    counts = {status: 0 for status in JobStatus}
+    counts.update({status: count for status, count in rows})
+    return counts
@@ -0,0 +1,30 @@
+import smtplib
+from email.message import EmailMessage
+from flask import current_app
+from app.tasks import task, enqueue
+
+# Outgoing mail goes through the task runner so an SMTP round trip never
+# holds up a request. Nothing is sent when MAIL_SERVER is not configured.
+
+@task('send_email')
+def send_email(recipients, subject, body, sender=None):
+    """Send a plain-text email over SMTP using the MAIL_* settings"""
+    config = current_app.config
+    if not config['MAIL_SERVER']:
+        return {'sent': False, 'reason': 'MAIL_SERVER is not configured'}
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = sender or config['MAIL_DEFAULT_SENDER']
+    message['To'] = ', '.join(recipients)
+    message.set_content(body)
+    with smtplib.SMTP(config['MAIL_SERVER'], config['MAIL_PORT'], timeout=30) as smtp:
+        if config['MAIL_USE_TLS']:
+            smtp.starttls()
+        if config['MAIL_USERNAME']:
+            smtp.login(config['MAIL_USERNAME'], config['MAIL_PASSWORD'])
+        smtp.send_message(message)
+    return {'sent': True, 'recipients': list(recipients)}
+
+def queue_email(recipients, subject, body, user_id=None):
+    """Send an email in the background once the session commits; returns the Task"""
+    return enqueue('send_email', list(recipients), subject, body, user_id=user_id)
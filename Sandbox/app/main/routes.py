@@ -1,47 +1,46 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, jsonify, abort, send_file
 from flask_login import login_required, current_user
 from app.main import bp
 from app.main.forms import ProfileUpdateForm, PasswordChangeForm
-from app.models import Order, Customer, Job, Invoice, OrderStatus, JobStatus, InvoiceStatus, db
+from app.models import Order, InvoiceStatus, Task, db
+from app.metrics import get_status_snapshot
+from app.queries import with_order_relations
+from app.materials import get_low_stock_materials
+from app.tasks import task_payload, result_path
+from app.choices import autocomplete, CHOICE_KINDS
 from datetime import datetime
+import json
+import os
+
+# Number of low-stock materials listed on the dashboard
+LOW_STOCK_WIDGET_LIMIT = 10
+
+# Most suggestions returned by the autocomplete endpoint
+MAX_AUTOCOMPLETE = 50
 
 @bp.route('/')
 @bp.route('/index')
 @login_required
 def index():
     """Dashboard view showing key metrics and recent activity"""
-    # Get count of orders by status
-    order_counts = {
-        'pending': Order.query.filter_by(status=OrderStatus.PENDING).count(),
-        'in_production': Order.query.filter_by(status=OrderStatus.IN_PRODUCTION).count(),
-        'completed': Order.query.filter_by(status=OrderStatus.COMPLETED).count(),
-    }
-    
-    # Get count of jobs by status
-    job_counts = {
-        'pending': Job.query.filter_by(status=JobStatus.PENDING).count(),
-        'prepress': Job.query.filter_by(status=JobStatus.PREPRESS).count(),
-        'press': Job.query.filter_by(status=JobStatus.PRESS).count(),
-        'postpress': Job.query.filter_by(status=JobStatus.POSTPRESS).count(),
-        'quality_check': Job.query.filter_by(status=JobStatus.QUALITY_CHECK).count(),
-    }
+    # Status counts for orders, jobs and invoices in one grouped query per table
+    snapshot = get_status_snapshot()
     
     # Get recent orders
-    recent_orders = Order.query.order_by(Order.created_at.desc()).limit(5).all()
+    recent_orders = with_order_relations(Order.query).order_by(Order.created_at.desc()).limit(5).all()
     
-    # Get overdue invoices
-    overdue_invoices = Invoice.query.filter_by(status=InvoiceStatus.OVERDUE).count()
-    
-    # Get total customers
-    total_customers = Customer.query.count()
+    # Materials at or below reorder level, served by the reorder margin index
+    low_stock = get_low_stock_materials(limit=LOW_STOCK_WIDGET_LIMIT)
     
     return render_template('main/index.html', 
                           title='Dashboard',
-                          order_counts=order_counts,
-                          job_counts=job_counts,
+                          snapshot=snapshot,
+                          order_counts=snapshot.order_count_map(),
+                          job_counts=snapshot.job_count_map(),
                           recent_orders=recent_orders,
-                          overdue_invoices=overdue_invoices,
-                          total_customers=total_customers)
+                          low_stock=low_stock,
+                          overdue_invoices=snapshot.invoices(InvoiceStatus.OVERDUE),
+                          total_customers=snapshot.total_customers)
 
 @bp.route('/about')
 def about():
@@ -93,3 +92,38 @@ def change_password():
                 flash(f'{field}: {error}', 'danger')
     
     return redirect(url_for('main.profile'))
+
+def _get_task_or_404(id):
+    task = Task.query.get_or_404(id)
+    if task.user_id != current_user.id and not current_user.is_admin:
+        abort(404)
+    return task
+
+@bp.route('/tasks/<int:id>')
+@login_required
+def task_status(id):
+    """Status of a background task, as JSON for polling"""
+    return jsonify(task_payload(_get_task_or_404(id)))
+
+@bp.route('/tasks/<int:id>/download')
+@login_required
+def task_download(id):
+    """Download the file produced by a finished background task"""
+    task = _get_task_or_404(id)
+    result = json.loads(task.result) if task.status == 'done' and task.result else None
+    if not isinstance(result, dict) or not result.get('file'):
+        abort(404)
+    path = result_path(result['file'], task.id)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype=result.get('mimetype'), as_attachment=True,
+                     download_name=result['file'])
+
+@bp.route('/autocomplete/<kind>')
+@login_required
+def autocomplete_choices(kind):
+    """Typeahead suggestions for customer, product or material fields, as JSON"""
+    if kind not in CHOICE_KINDS:
+        abort(404)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_AUTOCOMPLETE)
+    return jsonify([{'id': id, 'text': text} for id, text in autocomplete(kind, request.args.get('q'), limit)])
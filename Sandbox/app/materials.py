@@ -1,6 +1,27 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
 from app import db
-from app.models import Material
+from app.models import Material, MaterialMovement, Job
 from flask import flash
+from sqlalchemy import func, update
+
+# Stock levels only change through post_movement(): a single conditional
+# UPDATE on materials plus a material_movements ledger row, so concurrent
+# usages of the same material cannot overwrite each other or go negative.
+
+MaterialUsage = namedtuple('MaterialUsage', ['material_id', 'name', 'unit', 'quantity', 'cost'])
+JobUsage = namedtuple('JobUsage', ['job_id', 'job_number', 'quantity'])
+ReorderLine = namedtuple('ReorderLine', ['material_id', 'name', 'unit', 'stock_level', 'reorder_level',
+                                         'daily_usage', 'days_of_cover', 'shortfall'])
+
+class InsufficientStock(Exception):
+    """Raised when a stock decrement is larger than the stock on hand"""
+
+    def __init__(self, material_id, requested, available):
+        super().__init__(f'Material {material_id}: {requested} requested, {available} available')
+        self.material_id = material_id
+        self.requested = requested
+        self.available = available
 
 def get_materials():
     """Get all materials"""
@@ -21,46 +42,187 @@ def create_material(name, description, unit_price, stock_level, reorder_level, u
         unit=unit
     )
     db.session.add(material)
+    db.session.flush()
+    _record_opening_stock(material)
     db.session.commit()
     flash(f'Material {name} created successfully', 'success')
     return material
 
-def update_material(id, name, description, unit_price, stock_level, reorder_level, unit):
-    """Update an existing material"""
+def update_material(id, name, description, unit_price, stock_level, reorder_level, unit, original_stock_level):
+    """Update an existing material
+
+    original_stock_level is the stock level the edit form was loaded with
+    (sent back as a hidden field). Returns None, changing nothing, if the
+    edit would take the stock below zero.
+    """
     material = get_material(id)
     material.name = name
     material.description = description
     material.unit_price = unit_price
-    material.stock_level = stock_level
     material.reorder_level = reorder_level
     material.unit = unit
+    
+    # Apply the edit as a ledger adjustment relative to the level the form
+    # was based on, so usage posted while the form was open still counts
+    delta = float(stock_level or 0) - float(original_stock_level or 0)
+    if delta:
+        try:
+            post_movement(id, delta, 'adjustment', note='Stock level edited')
+        except InsufficientStock as e:
+            db.session.rollback()
+            flash(f'{name} not updated: only {e.available} {unit} now in stock, '
+                  f'so the stock level cannot be reduced by {-delta:g}.', 'danger')
+            return None
     db.session.commit()
     flash(f'Material {name} updated successfully', 'success')
     return material
 
-def update_stock(id, quantity, is_addition=True):
+def update_stock(id, quantity, is_addition=True, user_id=None):
     """Update material stock level"""
     material = get_material(id)
     
     if is_addition:
-        material.stock_level += quantity
+        post_movement(id, quantity, 'receipt', user_id=user_id)
         action = "added to"
     else:
-        if material.stock_level < quantity:
-            flash(f'Cannot remove {quantity} {material.unit} from {material.name}. Only {material.stock_level} {material.unit} available.', 'danger')
+        try:
+            post_movement(id, -quantity, 'adjustment', user_id=user_id)
+        except InsufficientStock as e:
+            flash(f'Cannot remove {quantity} {material.unit} from {material.name}. Only {e.available} {material.unit} available.', 'danger')
             return False
-        material.stock_level -= quantity
         action = "removed from"
     
     db.session.commit()
     flash(f'{quantity} {material.unit} {action} {material.name} stock', 'success')
     
     # Check if stock is below reorder level
-    if material.stock_level <= material.reorder_level:
+    if material.reorder_margin <= 0:
         flash(f'Warning: {material.name} stock is low ({material.stock_level} {material.unit}). Reorder level is {material.reorder_level} {material.unit}.', 'warning')
     
     return True
 
+def post_movement(material_id, quantity, kind, job_id=None, note=None, user_id=None):
+    """Apply a signed stock change and add its ledger row, without committing
+
+    Negative quantities only apply while stock_level covers them; otherwise
+    InsufficientStock is raised and nothing is changed.
+    """
+    quantity = float(quantity)
+    stmt = update(Material).where(Material.id == material_id) \
+        .values(stock_level=Material.stock_level + quantity)
+    if quantity < 0:
+        stmt = stmt.where(Material.stock_level >= -quantity)
+    
+    if db.session.execute(stmt).rowcount != 1:
+        available = db.session.query(Material.stock_level).filter(Material.id == material_id).scalar()
+        if available is None:
+            raise LookupError(f'Material {material_id} does not exist')
+        raise InsufficientStock(material_id, -quantity, available)
+    
+    movement = MaterialMovement(material_id=material_id, job_id=job_id, kind=kind,
+                                quantity=quantity, note=note, user_id=user_id)
+    db.session.add(movement)
+    return movement
+
+def consume_material(material_id, quantity, job_id=None, note=None, user_id=None):
+    """Take quantity of a material out of stock for a job, without committing"""
+    return post_movement(material_id, -float(quantity), 'usage', job_id, note, user_id)
+
+def post_usages(usages, job_id=None, user_id=None):
+    """Record several material usages in one transaction, all or nothing
+
+    usages is an iterable of (material_id, quantity) or (material_id,
+    quantity, note). They are applied in material id order so concurrent
+    batches lock rows in the same order. Raises InsufficientStock, leaving
+    stock untouched, if any line cannot be covered.
+    """
+    usages = sorted(usages, key=lambda usage: usage[0])
+    with db.session.begin_nested():
+        movements = [consume_material(usage[0], usage[1], job_id,
+                                      usage[2] if len(usage) > 2 else None, user_id)
+                     for usage in usages]
+    db.session.commit()
+    return movements
+
+def job_material_usage(job_id):
+    """Net quantity and cost of each material used on a job"""
+    quantity = func.sum(-MaterialMovement.quantity)
+    rows = db.session.query(
+        Material.id, Material.name, Material.unit, quantity, quantity * Material.unit_price
+    ).join(MaterialMovement, MaterialMovement.material_id == Material.id) \
+        .filter(MaterialMovement.job_id == job_id, MaterialMovement.kind == 'usage') \
+        .group_by(Material.id, Material.name, Material.unit, Material.unit_price) \
+        .order_by(Material.name)
+    return [MaterialUsage(*row) for row in rows]
+
+def material_usage_by_job(material_id, start_date=None, end_date=None):
+    """Quantity of a material used per job, largest first"""
+    quantity = func.sum(-MaterialMovement.quantity)
+    query = db.session.query(MaterialMovement.job_id, Job.job_number, quantity) \
+        .outerjoin(Job, MaterialMovement.job_id == Job.id) \
+        .filter(MaterialMovement.material_id == material_id, MaterialMovement.kind == 'usage')
+    if start_date:
+        query = query.filter(MaterialMovement.at >= start_date)
+    if end_date:
+        query = query.filter(MaterialMovement.at <= end_date)
+    rows = query.group_by(MaterialMovement.job_id, Job.job_number).order_by(quantity.desc())
+    return [JobUsage(*row) for row in rows]
+
+def low_stock_query():
+    """Materials at or below their reorder level, lowest margin first"""
+    return Material.query.filter(Material.reorder_margin <= 0) \
+        .order_by(Material.reorder_margin, Material.name)
+
+def get_low_stock_materials(limit=None):
+    """Materials at or below their reorder level"""
+    query = low_stock_query()
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def daily_usage(days=30, as_of=None):
+    """Average daily usage per material id over the last `days` days of the ledger"""
+    as_of = as_of or datetime.utcnow()
+    rows = db.session.query(MaterialMovement.material_id, func.sum(-MaterialMovement.quantity)) \
+        .filter(MaterialMovement.kind == 'usage',
+                MaterialMovement.at > as_of - timedelta(days=days),
+                MaterialMovement.at <= as_of) \
+        .group_by(MaterialMovement.material_id)
+    return {material_id: float(total) / days for material_id, total in rows}
+
+def reorder_report(days=30, horizon=14, as_of=None):
+    """Materials at or below reorder level, or projected to run out within `horizon` days
+
+    Days of cover is the stock on hand divided by average daily usage over
+    the last `days` days; it is None for materials with no recent usage.
+    Lines are sorted by days of cover, then by how far below reorder level
+    the material is.
+    """
+    usage = daily_usage(days, as_of)
+    lines = []
+    for material in Material.query.order_by(Material.name):
+        stock = float(material.stock_level or 0)
+        reorder = float(material.reorder_level or 0)
+        per_day = usage.get(material.id, 0.0)
+        cover = stock / per_day if per_day > 0 else None
+        if stock > reorder and (cover is None or cover >= horizon):
+            continue
+        lines.append(ReorderLine(material.id, material.name, material.unit, stock, reorder,
+                                 per_day, cover, max(reorder - stock, 0.0)))
+    lines.sort(key=lambda line: (line.days_of_cover is None, line.days_of_cover or 0,
+                                 line.stock_level - line.reorder_level))
+    return lines
+
+def _record_opening_stock(material):
+    """Ledger row for the stock a material is created with
+
+    Opening balances are adjustments, as in the add_material_movements
+    migration, so receipt totals only count stock actually received.
+    """
+    if material.stock_level:
+        db.session.add(MaterialMovement(material_id=material.id, kind='adjustment',
+                                        quantity=material.stock_level, note='Opening stock'))
+
 def delete_material(id):
     """Delete a material"""
     material = get_material(id)
@@ -150,6 +312,8 @@ def add_default_materials():
                 unit=material_data['unit']
             )
             db.session.add(material)
+            db.session.flush()
+            _record_opening_stock(material)
         
         db.session.commit()
         return True
@@ -0,0 +1,89 @@
+from dataclasses import dataclass, field
+from sqlalchemy import func
+from app import db
+from app.models import Order, Job, Invoice, Customer, OrderStatus, JobStatus, InvoiceStatus
+
+@dataclass(frozen=True)
+class StatusSnapshot:
+    """Point-in-time status counts for orders, jobs and invoices"""
+    order_counts: dict = field(default_factory=dict)
+    job_counts: dict = field(default_factory=dict)
+    invoice_counts: dict = field(default_factory=dict)
+    invoice_totals: dict = field(default_factory=dict)
+    invoice_balances: dict = field(default_factory=dict)
+    total_customers: int = 0
+
+    def orders(self, status):
+        """Number of orders with the given OrderStatus"""
+        return self.order_counts.get(status, 0)
+
+    def jobs(self, status):
+        """Number of jobs with the given JobStatus"""
+        return self.job_counts.get(status, 0)
+
+    def invoices(self, status):
+        """Number of invoices with the given InvoiceStatus"""
+        return self.invoice_counts.get(status, 0)
+
+    def invoiced(self, *statuses):
+        """Sum of invoice total_amount across the given statuses"""
+        return sum(self.invoice_totals.get(status, 0.0) for status in statuses)
+
+    def outstanding(self, *statuses):
+        """Sum of invoice balance_due across the given statuses"""
+        return sum(self.invoice_balances.get(status, 0.0) for status in statuses)
+
+    def order_count_map(self):
+        """Order counts keyed by lower-case status name, for templates"""
+        return {status.name.lower(): count for status, count in self.order_counts.items()}
+
+    def job_count_map(self):
+        """Job counts keyed by lower-case status name, for templates"""
+        return {status.name.lower(): count for status, count in self.job_counts.items()}
+
+def _grouped_counts(model, status_enum):
+    """Count rows of a model per status with a single GROUP BY query"""
+    counts = {status: 0 for status in status_enum}
+    rows = db.session.query(model.status, func.count(model.id)).group_by(model.status).all()
+    for status, count in rows:
+        if status is not None:
+            counts[status] = count
+    return counts
+
+def order_status_counts():
+    """Get the number of orders in each OrderStatus"""
+    return _grouped_counts(Order, OrderStatus)
+
+def job_status_counts():
+    """Get the number of jobs in each JobStatus"""
+    return _grouped_counts(Job, JobStatus)
+
+def invoice_status_totals():
+    """Get the number, summed total_amount and summed balance_due of invoices in each InvoiceStatus"""
+    counts = {status: 0 for status in InvoiceStatus}
+    totals = {status: 0.0 for status in InvoiceStatus}
+    balances = {status: 0.0 for status in InvoiceStatus}
+    rows = db.session.query(
+        Invoice.status,
+        func.count(Invoice.id),
+        func.coalesce(func.sum(Invoice.total_amount), 0.0),
+        func.coalesce(func.sum(Invoice.balance_due), 0.0)
+    ).group_by(Invoice.status).all()
+    for status, count, total, balance in rows:
+        if status is not None:
+            counts[status] = count
+            totals[status] = float(total)
+            balances[status] = float(balance)
+    return counts, totals, balances
+
+def get_status_snapshot(orders=True, jobs=True, invoices=True, customers=True):
+    """Build a StatusSnapshot with one aggregate query per requested table"""
+    invoice_counts, invoice_totals, invoice_balances = invoice_status_totals() if invoices else ({}, {}, {})
+    return StatusSnapshot(
+        order_counts=order_status_counts() if orders else {},
+        job_counts=job_status_counts() if jobs else {},
+        invoice_counts=invoice_counts,
+        invoice_totals=invoice_totals,
+        invoice_balances=invoice_balances,
+        total_customers=(db.session.query(func.count(Customer.id)).scalar() or 0) if customers else 0
+    )
@@ -2,7 +2,8 @@ from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db, login_manager
-from sqlalchemy import Enum
+from sqlalchemy import Enum, func, literal_column
+from sqlalchemy.ext.hybrid import hybrid_property
 import enum
 
 class OrderStatus(enum.Enum):
@@ -94,7 +95,7 @@ class Order(db.Model):
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'))
     status = db.Column(db.Enum(OrderStatus), default=OrderStatus.QUOTE)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     due_date = db.Column(db.DateTime)
     total_amount = db.Column(db.Float, default=0.0)
     notes = db.Column(db.Text)
@@ -131,9 +132,27 @@ class Material(db.Model):
     unit = db.Column(db.String(20))  # e.g., sheets, meters, etc.
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    @hybrid_property
+    def reorder_margin(self):
+        """Stock above the reorder level; zero or less means reorder
+        
+        A missing stock or reorder level counts as zero, in SQL as well,
+        so those materials stay in the index and the low-stock list.
+        """
+        return (self.stock_level or 0) - (self.reorder_level or 0)
+    
+    @reorder_margin.expression
+    def reorder_margin(cls):
+        # Literal zeros keep the expression identical to the index definition
+        zero = literal_column('0')
+        return func.coalesce(cls.stock_level, zero) - func.coalesce(cls.reorder_level, zero)
+    
     def __repr__(self):
         return f'<Material {self.name}>'
 
+# Expression index so "reorder_margin <= 0" (at or below reorder level) is an index range scan
+db.Index('ix_materials_reorder_margin', Material.reorder_margin)
+
 class Job(db.Model):
     __tablename__ = 'jobs'
     id = db.Column(db.Integer, primary_key=True)
@@ -143,8 +162,9 @@ class Job(db.Model):
     quantity = db.Column(db.Integer, default=1)
     status = db.Column(db.Enum(JobStatus), default=JobStatus.PENDING)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    start_date = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    start_date = db.Column(db.DateTime, index=True)
+    scheduled_manually = db.Column(db.Boolean, nullable=False, default=False)  # Dates set by an operator, kept by the scheduler
     completion_date = db.Column(db.DateTime)
     estimated_hours = db.Column(db.Float, default=0.0)
     actual_hours = db.Column(db.Float, default=0.0)
@@ -162,6 +182,144 @@ class Job(db.Model):
     def __repr__(self):
         return f'<Job {self.job_number}>'
 
+class JobStatusEvent(db.Model):
+    """One job status transition; from_status is empty for the job's first event"""
+    __tablename__ = 'job_status_events'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)
+    from_status = db.Column(db.Enum(JobStatus))
+    to_status = db.Column(db.Enum(JobStatus), nullable=False)
+    at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    note = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_job_status_events_job_id_at', 'job_id', 'at'),
+        db.Index('ix_job_status_events_to_status_at', 'to_status', 'at'),
+    )
+    
+    # Relationships
+    job = db.relationship('Job', backref=db.backref('status_events', lazy='dynamic',
+                                                    order_by='JobStatusEvent.at'))
+    user = db.relationship('User')
+    
+    def __repr__(self):
+        return f'<JobStatusEvent {self.job_id}: {self.from_status} -> {self.to_status}>'
+
+class MaterialMovement(db.Model):
+    """Ledger entry for a stock change; quantity is negative for usage"""
+    __tablename__ = 'material_movements'
+    id = db.Column(db.Integer, primary_key=True)
+    material_id = db.Column(db.Integer, db.ForeignKey('materials.id'), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'))
+    kind = db.Column(db.String(20), nullable=False)  # usage, receipt or adjustment
+    quantity = db.Column(db.Float, nullable=False)
+    at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    note = db.Column(db.Text)
+    
+    __table_args__ = (
+        db.Index('ix_material_movements_material_id_at', 'material_id', 'at'),
+        db.Index('ix_material_movements_job_id_at', 'job_id', 'at'),
+    )
+    
+    # Relationships
+    material = db.relationship('Material', backref=db.backref('movements', lazy='dynamic'))
+    job = db.relationship('Job', backref=db.backref('material_movements', lazy='dynamic'))
+    
+    def __repr__(self):
+        return f'<MaterialMovement {self.kind} {self.quantity} of material {self.material_id}>'
+
+class JobFile(db.Model):
+    """Artwork file attached to a job; the content lives in app.files' store under its SHA-256"""
+    __tablename__ = 'job_files'
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False, index=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    
+    # Relationships
+    job = db.relationship('Job', backref=db.backref('files', lazy='dynamic', order_by='JobFile.uploaded_at'))
+    user = db.relationship('User')
+    preflight = db.relationship('FilePreflight', primaryjoin='JobFile.sha256 == foreign(FilePreflight.sha256)',
+                                uselist=False, viewonly=True)
+    
+    def __repr__(self):
+        return f'<JobFile {self.filename} for job {self.job_id}>'
+
+class FilePreflight(db.Model):
+    """Preflight results for stored content, shared by every JobFile with the same hash"""
+    __tablename__ = 'file_preflights'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, done or failed
+    file_type = db.Column(db.String(20))
+    pages = db.Column(db.Integer)
+    width_mm = db.Column(db.Float)  # Trim (or media) size of the first page, or the image size
+    height_mm = db.Column(db.Float)
+    dpi = db.Column(db.Float)  # Raster images only
+    color_space = db.Column(db.String(100))
+    has_thumbnail = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.Text)
+    checked_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<FilePreflight {self.sha256[:12]} {self.status}>'
+
+class FileUpload(db.Model):
+    """Chunked upload in progress; the bytes received so far are on disk"""
+    __tablename__ = 'file_uploads'
+    id = db.Column(db.String(43), primary_key=True)  # Random token
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    filename = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64))  # Expected hash, if the client sent one
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    job = db.relationship('Job')
+    
+    def __repr__(self):
+        return f'<FileUpload {self.id} {self.filename}>'
+
+class OrderForecast(db.Model):
+    """Stored due-date risk of an open order, written by app.forecast"""
+    __tablename__ = 'order_forecasts'
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), primary_key=True)
+    due_date = db.Column(db.DateTime)
+    probability = db.Column(db.Float, nullable=False)  # Share of simulations finishing after due_date
+    p50 = db.Column(db.DateTime, nullable=False)
+    p90 = db.Column(db.DateTime, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<OrderForecast {self.order_id} {self.probability:.0%}>'
+
+class Task(db.Model):
+    """Background task run by app.tasks; args and result are stored as JSON"""
+    __tablename__ = 'tasks'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done or failed
+    args = db.Column(db.Text)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_tasks_status_created_at', 'status', 'created_at'),
+    )
+    
+    user = db.relationship('User')
+    
+    def __repr__(self):
+        return f'<Task {self.id} {self.name} {self.status}>'
+
 class Invoice(db.Model):
     __tablename__ = 'invoices'
     id = db.Column(db.Integer, primary_key=True)
@@ -175,6 +333,14 @@ class Invoice(db.Model):
     status = db.Column(db.Enum(InvoiceStatus), default=InvoiceStatus.DRAFT)
     notes = db.Column(db.Text)
     
+    # Maintained from Payment rows by app.balances; never sum payments per request
+    amount_paid = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    balance_due = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    
+    __table_args__ = (
+        db.Index('ix_invoices_status_balance_due', 'status', 'balance_due'),
+    )
+    
     def __repr__(self):
         return f'<Invoice {self.invoice_number}>'
 
@@ -193,3 +359,13 @@ class Payment(db.Model):
     
     def __repr__(self):
         return f'<Payment {self.id} for Invoice {self.invoice_id}>'
+
+class DocumentSequence(db.Model):
+    """Per-prefix, per-day counter used to allocate document numbers"""
+    __tablename__ = 'document_sequences'
+    prefix = db.Column(db.String(10), primary_key=True)
+    day = db.Column(db.String(8), primary_key=True)  # YYYYMMDD
+    last_value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DocumentSequence {self.prefix}-{self.day}: {self.last_value}>'
@@ -0,0 +1,125 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from app import db
+from app.models import Job, Order, Material, MaterialMovement, JobStatus
+from app.imposition import best_plan, parse_colors
+from app.pricing import get_rates
+
+# Paper requirements for every open job, computed in one batch: job specs
+# are loaded as plain columns, sheets per job are worked out with array
+# arithmetic (one imposition plan per distinct size and run, on the best
+# SHEET_SIZES sheet), and demand is summed into a materials x date-buckets
+# matrix with np.add.at. Sheets already issued to a job in the material
+# ledger are netted off its demand. Jobs too large for every sheet are
+# left out of demand and counted in oversize_jobs.
+
+Bucket = namedtuple('Bucket', ['start', 'demand', 'projected'])
+MaterialPlan = namedtuple('MaterialPlan', ['material_id', 'name', 'unit', 'stock_level', 'reorder_level',
+                                           'demand', 'buckets', 'shortage', 'short_from', 'reorder_from'])
+MrpResult = namedtuple('MrpResult', ['materials', 'job_count', 'unmatched_jobs', 'oversize_jobs', 'bucket', 'as_of'])
+
+BUCKETS = ('day', 'week')
+
+def _bucket_start(day, bucket):
+    return day - timedelta(days=day.weekday()) if bucket == 'week' else day
+
+def _load_open_jobs():
+    """Specs of every non-completed job as parallel column tuples"""
+    rows = db.session.query(
+        Job.id, Job.quantity, Job.width, Job.height, Job.pages, Job.colors,
+        func.lower(func.trim(Job.paper_type)), Order.due_date
+    ).outerjoin(Order, Job.order_id == Order.id) \
+        .filter((Job.status != JobStatus.COMPLETED) | (Job.status.is_(None))) \
+        .execution_options(yield_per=10000).all()
+    return list(zip(*rows)) if rows else [()] * 8
+
+def _issued_to_jobs():
+    """Paper already issued per (job id, material id) to open jobs, from the ledger"""
+    issued = {}
+    rows = db.session.query(MaterialMovement.job_id, MaterialMovement.material_id,
+                            func.sum(-MaterialMovement.quantity)) \
+        .filter(MaterialMovement.kind == 'usage', MaterialMovement.job_id.isnot(None)) \
+        .join(Job, MaterialMovement.job_id == Job.id) \
+        .filter((Job.status != JobStatus.COMPLETED) | (Job.status.is_(None))) \
+        .group_by(MaterialMovement.job_id, MaterialMovement.material_id)
+    for job_id, material_id, quantity in rows:
+        issued[job_id, material_id] = float(quantity or 0)
+    return issued
+
+def run_mrp(bucket='week', as_of=None, rates=None):
+    """Net paper demand of all open jobs against stock, bucketed by order due date
+
+    Jobs due before as_of (or with no due date) fall into the first bucket.
+    Returns an MrpResult whose materials are sorted with shortages first.
+    """
+    rates = rates or get_rates()
+    today = (as_of or datetime.utcnow()).date()
+    job_ids, quantity, width, height, pages, colors, paper, due = _load_open_jobs()
+    materials = Material.query.order_by(Material.name).all()
+    material_index = {m.name.strip().lower(): i for i, m in enumerate(materials)}
+
+    n = len(job_ids)
+    mat = np.fromiter((material_index.get(p, -1) for p in paper), dtype=np.int64, count=n)
+    qty = np.fromiter((q or 0 for q in quantity), dtype=np.float64, count=n)
+    page_count = np.fromiter((p or 1 for p in pages), dtype=np.float64, count=n)
+    back = np.fromiter((parse_colors(c)[1] for c in colors), dtype=np.int64, count=n)
+    sides = np.where(back > 0, 2.0, 1.0)
+
+    # Pieces up on the best catalog sheet: one plan per distinct size, run and sides;
+    # NaN where the piece fits no sheet
+    specs = np.array([(float(w or 0), float(h or 0), q, p, s)
+                      for w, h, q, p, s in zip(width, height, qty, page_count, sides)],
+                     dtype=np.float64).reshape(n, 5)
+    distinct, inverse = np.unique(specs, axis=0, return_inverse=True)
+    plans_up = []
+    for w, h, q, p, s in distinct:
+        plan = best_plan(w, h, max(q, 1), p, s) if w and h else None
+        plans_up.append(plan.layout.up if plan else (1.0 if not (w and h) else np.nan))
+    up = np.array(plans_up, dtype=np.float64)[inverse.reshape(-1)] if n else np.ones(0)
+    oversize = np.isnan(up)
+
+    leaves = np.ceil(page_count / sides)
+    sheets = np.ceil(qty * leaves / up * (1 + rates.spoilage)) + rates.makeready_sheets
+    sheets[(qty <= 0) | oversize] = 0.0
+
+    # Net off paper already issued to each job
+    issued = _issued_to_jobs() if n else {}
+    if issued:
+        position = {job_id: i for i, job_id in enumerate(job_ids)}
+        for (job_id, material_id), quantity_issued in issued.items():
+            i = position.get(job_id)
+            if i is not None and mat[i] >= 0 and materials[mat[i]].id == material_id:
+                sheets[i] = max(sheets[i] - quantity_issued, 0.0)
+
+    # Date buckets from order due dates; overdue and undated work is due now
+    first = _bucket_start(today, bucket)
+    starts = sorted({first} | {_bucket_start(max(d.date(), today), bucket) for d in due if d})
+    bucket_index = {start: i for i, start in enumerate(starts)}
+    bkt = np.fromiter((bucket_index[_bucket_start(max(d.date(), today), bucket)] if d else 0 for d in due),
+                      dtype=np.int64, count=n)
+
+    matched = mat >= 0
+    demand = np.zeros((len(materials), len(starts)), dtype=np.float64)
+    np.add.at(demand, (mat[matched], bkt[matched]), sheets[matched])
+    stock = np.array([float(m.stock_level or 0) for m in materials], dtype=np.float64)
+    reorder = np.array([float(m.reorder_level or 0) for m in materials], dtype=np.float64)
+    projected = stock[:, None] - np.cumsum(demand, axis=1)
+
+    plans = []
+    for i, material in enumerate(materials):
+        if not demand[i].any():
+            continue
+        short = np.flatnonzero(projected[i] < 0)
+        low = np.flatnonzero(projected[i] <= reorder[i])
+        plans.append(MaterialPlan(
+            material.id, material.name, material.unit, stock[i], reorder[i], float(demand[i].sum()),
+            [Bucket(starts[b], float(demand[i, b]), float(projected[i, b]))
+             for b in range(len(starts)) if demand[i, b]],
+            float(max(-projected[i, -1], 0.0)),
+            starts[short[0]] if short.size else None,
+            starts[low[0]] if low.size else None,
+        ))
+    plans.sort(key=lambda plan: (plan.short_from is None, plan.short_from or first, plan.name))
+    return MrpResult(plans, n, int((~matched & (qty > 0)).sum()), int((matched & oversize).sum()), bucket, today)
@@ -53,6 +53,7 @@ class QuoteForm(FlaskForm):
 class SearchForm(FlaskForm):
     query = StringField('Search', validators=[DataRequired()])
     search_type = SelectField('Search Type', choices=[
+        ('all', 'All'),
         ('customer', 'Customer'),
         ('order', 'Order'),
         ('job', 'Job')
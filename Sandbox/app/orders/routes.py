@@ -1,46 +1,66 @@
+import mimetypes
 import os
 from datetime import datetime
-from flask import render_template, redirect, url_for, flash, request, current_app
-from flask_login import login_required
-from werkzeug.utils import secure_filename
+from flask import render_template, redirect, url_for, flash, request, current_app, jsonify, abort, send_file, \
+    make_response
+from flask_login import login_required, current_user
 from app import db
 from app.orders import bp
 from app.orders.forms import CustomerForm, OrderForm, JobForm, QuoteForm, SearchForm
-from app.models import Customer, Order, Job, Product, OrderStatus, JobStatus
+from app.models import Customer, Order, Job, Product, OrderStatus, JobStatus, JobFile, FileUpload
+from app.queries import orders_with_counts, unpack_order_counts
+from app.pagination import paginate_query
+from app.sequences import next_number
+from app.search import search as search_index
+from app.exports import export_response
+from app.pricing import JobSpecs, PieceTooLarge, price_breaks, find_paper, get_rates
+from app.forecast import get_order_risks
+from app.scheduler import queue_reschedule
+from app.documents import quote_pdf
+from app.choices import get_choices
+from app.files import (blob_path, save_upload, delete_job_file, start_upload, append_chunk, finish_upload,
+                       cancel_upload, upload_offset, UploadError, OffsetMismatch)
+from app.preflight import queue_preflight, preflight_warnings, thumbnail_path
+
+# Most quantity breaks priced in one request
+MAX_PRICE_BREAKS = 50
+
+# Sort keys for list views; the trailing id makes the order total for cursors
+ORDER_LIST_KEYS = [(Order.created_at, True), (Order.id, True)]
+CUSTOMER_LIST_KEYS = [(Customer.name, False), (Customer.id, False)]
 
 @bp.route('/')
 @login_required
 def index():
     """List all orders"""
-    page = request.args.get('page', 1, type=int)
-    orders = Order.query.order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=current_app.config['ITEMS_PER_PAGE'], error_out=False)
+    # Customer and job/invoice counts come back with the page in one query
+    orders = paginate_query(orders_with_counts(), ORDER_LIST_KEYS,
+                            current_app.config['ITEMS_PER_PAGE'])
+    orders.items = unpack_order_counts(orders.items)
+    order_risks = get_order_risks([order.id for order in orders.items])
     
     return render_template('orders/index.html', 
-                          title='Orders', 
+                          title='Orders',
+                          order_risks=order_risks, 
                           orders=orders)
 
+@bp.route('/export/<fmt>')
+@login_required
+def export_orders(fmt):
+    """Download orders as CSV or XLSX"""
+    return export_response('orders', fmt, request.args)
+
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_order():
     """Create a new order"""
     form = OrderForm()
     # Populate customer choices
-    form.customer_id.choices = [(c.id, c.name) for c in Customer.query.order_by(Customer.name).all()]
+    form.customer_id.choices = get_choices('customer')
     
     if form.validate_on_submit():
-        # Generate a unique order number: ORD-YYYYMMDD-XXX
-        date_str = datetime.utcnow().strftime('%Y%m%d')
-        last_order = Order.query.filter(Order.order_number.like(f'ORD-{date_str}-%')).order_by(
-            Order.order_number.desc()).first()
-        
-        if last_order:
-            last_num = int(last_order.order_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-            
-        order_number = f'ORD-{date_str}-{new_num:03d}'
+        # Allocate a unique order number: ORD-YYYYMMDD-XXX
+        order_number = next_number('ORD')
         
         order = Order(
             order_number=order_number,
@@ -63,12 +83,23 @@ def view_order(id):
     """View an order and its jobs"""
     order = Order.query.get_or_404(id)
     jobs = order.jobs.all()
+    risk = get_order_risks([order.id]).get(order.id)
     
     return render_template('orders/view_order.html', 
                           title=f'Order {order.order_number}', 
                           order=order,
+                          risk=risk,
                           jobs=jobs)
 
+@bp.route('/<int:id>/pdf')
+@login_required
+def order_pdf(id):
+    """Quote (or order confirmation) as a PDF, served from the cache when unchanged"""
+    order = Order.query.get_or_404(id)
+    return send_file(quote_pdf(order), mimetype='application/pdf',
+                     as_attachment=bool(request.args.get('download')),
+                     download_name=f'{order.order_number}.pdf')
+
 @bp.route('/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_order(id):
@@ -76,7 +107,7 @@ def edit_order(id):
     order = Order.query.get_or_404(id)
     form = OrderForm()
     # Populate customer choices
-    form.customer_id.choices = [(c.id, c.name) for c in Customer.query.order_by(Customer.name).all()]
+    form.customer_id.choices = get_choices('customer')
     
     if form.validate_on_submit():
         order.customer_id = form.customer_id.data
@@ -85,6 +116,8 @@ def edit_order(id):
         order.notes = form.notes.data
         order.updated_at = datetime.utcnow()
         
+        # The due date sets the priority of every job on the order
+        queue_reschedule([job.id for job in order.jobs], user_id=current_user.id)
         db.session.commit()
         flash(f'Order {order.order_number} has been updated successfully', 'success')
         return redirect(url_for('orders.view_order', id=order.id))
@@ -108,21 +141,11 @@ def add_job(id):
     order = Order.query.get_or_404(id)
     form = JobForm()
     # Populate product choices
-    form.product_id.choices = [(p.id, p.name) for p in Product.query.order_by(Product.name).all()]
+    form.product_id.choices = get_choices('product')
     
     if form.validate_on_submit():
-        # Generate a unique job number: JOB-YYYYMMDD-XXX
-        date_str = datetime.utcnow().strftime('%Y%m%d')
-        last_job = Job.query.filter(Job.job_number.like(f'JOB-{date_str}-%')).order_by(
-            Job.job_number.desc()).first()
-        
-        if last_job:
-            last_num = int(last_job.job_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-            
-        job_number = f'JOB-{date_str}-{new_num:03d}'
+        # Allocate a unique job number: JOB-YYYYMMDD-XXX
+        job_number = next_number('JOB')
         
         job = Job(
             job_number=job_number,
@@ -140,23 +163,18 @@ def add_job(id):
             notes=form.notes.data
         )
         
-        # Handle file upload if present
+        db.session.add(job)
+        db.session.flush()
+        
+        # Handle file upload if present; large files go through the chunked upload endpoints
+        job_file = None
         if form.file_upload.data:
-            filename = secure_filename(form.file_upload.data.filename)
-            # Create directory if it doesn't exist
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], str(order.id))
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)
-            
-            # Save the file
-            file_path = os.path.join(upload_dir, filename)
-            form.file_upload.data.save(file_path)
-            
-            # Store relative path
-            job.file_path = os.path.join('uploads', str(order.id), filename)
+            job_file = save_upload(job, form.file_upload.data, current_user.id)
         
-        db.session.add(job)
+        queue_reschedule([job.id], user_id=current_user.id)
         db.session.commit()
+        if job_file:
+            queue_preflight(job_file)
         
         flash(f'Job {job_number} has been created successfully', 'success')
         return redirect(url_for('orders.view_order', id=order.id))
@@ -183,7 +201,7 @@ def edit_job(id):
     job = Job.query.get_or_404(id)
     form = JobForm()
     # Populate product choices
-    form.product_id.choices = [(p.id, p.name) for p in Product.query.order_by(Product.name).all()]
+    form.product_id.choices = get_choices('product')
     
     if form.validate_on_submit():
         job.product_id = form.product_id.data
@@ -198,26 +216,15 @@ def edit_job(id):
         job.notes = form.notes.data
         job.updated_at = datetime.utcnow()
         
-        # Handle file upload if present
+        # Handle file upload if present; it is added alongside the job's existing files
+        job_file = None
         if form.file_upload.data:
-            # Remove old file if exists
-            if job.file_path and os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], job.file_path)):
-                os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], job.file_path))
-            
-            filename = secure_filename(form.file_upload.data.filename)
-            # Create directory if it doesn't exist
-            upload_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], str(job.order_id))
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir)
-            
-            # Save the file
-            file_path = os.path.join(upload_dir, filename)
-            form.file_upload.data.save(file_path)
-            
-            # Store relative path
-            job.file_path = os.path.join('uploads', str(job.order_id), filename)
+            job_file = save_upload(job, form.file_upload.data, current_user.id)
         
+        queue_reschedule([job.id], user_id=current_user.id)
         db.session.commit()
+        if job_file:
+            queue_preflight(job_file)
         flash(f'Job {job.job_number} has been updated successfully', 'success')
         return redirect(url_for('orders.view_job', id=job.id))
     
@@ -239,13 +246,185 @@ def edit_job(id):
                           form=form, 
                           job=job)
 
+def job_file_payload(job_file):
+    preflight = job_file.preflight
+    payload = {
+        'id': job_file.id,
+        'filename': job_file.filename,
+        'size': job_file.size,
+        'sha256': job_file.sha256,
+        'uploaded_at': job_file.uploaded_at.isoformat() if job_file.uploaded_at else None,
+        'download_url': url_for('orders.download_file', id=job_file.job_id, file_id=job_file.id),
+        'preflight': None,
+    }
+    if preflight is not None:
+        payload['preflight'] = {
+            'status': preflight.status,
+            'file_type': preflight.file_type,
+            'pages': preflight.pages,
+            'width_mm': preflight.width_mm,
+            'height_mm': preflight.height_mm,
+            'dpi': preflight.dpi,
+            'color_space': preflight.color_space,
+            'error': preflight.error,
+            'warnings': preflight_warnings(job_file.job, preflight),
+            'thumbnail_url': url_for('orders.file_thumbnail', id=job_file.job_id, file_id=job_file.id)
+            if preflight.has_thumbnail else None,
+        }
+    return payload
+
+def upload_payload(upload, offset):
+    return {
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': offset,
+        'chunk_size': current_app.config['UPLOAD_CHUNK_SIZE'],
+        'upload_url': url_for('orders.upload_chunk', upload_id=upload.id),
+    }
+
+@bp.route('/jobs/<int:id>/files')
+@login_required
+def job_files(id):
+    """Files attached to a job, as JSON"""
+    job = Job.query.get_or_404(id)
+    return jsonify([job_file_payload(f) for f in job.files])
+
+# Stored content never changes, so clients may keep a download as long as they like
+FILE_MAX_AGE = 365 * 24 * 3600
+
+@bp.route('/jobs/<int:id>/files/<int:file_id>')
+@login_required
+def download_file(id, file_id):
+    """Download a job file, with Range and If-None-Match support
+    
+    The ETag is the content hash. When FILE_ACCEL_REDIRECT names an nginx
+    internal location for the file store, nginx sends the file itself
+    (including ranges); with USE_X_SENDFILE the front-end server does.
+    Otherwise the file goes out through the WSGI server's file wrapper,
+    which uses sendfile() where available.
+    """
+    job_file = JobFile.query.filter_by(id=file_id, job_id=id).first_or_404()
+    path = blob_path(job_file.sha256)
+    if not os.path.exists(path):
+        abort(404)
+    as_attachment = not request.args.get('inline')
+    accel = current_app.config['FILE_ACCEL_REDIRECT']
+    if accel:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = \
+            f"{accel.rstrip('/')}/{os.path.relpath(path, current_app.config['FILE_STORE_FOLDER'])}"
+        response.headers['Content-Type'] = mimetypes.guess_type(job_file.filename)[0] or 'application/octet-stream'
+        response.headers['Content-Disposition'] = \
+            f"{'attachment' if as_attachment else 'inline'}; filename=\"{job_file.filename}\""
+        response.set_etag(job_file.sha256)
+        response.cache_control.max_age = FILE_MAX_AGE
+        response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype=mimetypes.guess_type(job_file.filename)[0],
+                             as_attachment=as_attachment, download_name=job_file.filename,
+                             conditional=True, etag=job_file.sha256, max_age=FILE_MAX_AGE)
+    response.accept_ranges = 'bytes'
+    # Artwork is only for logged-in users; keep it out of shared caches
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@bp.route('/jobs/<int:id>/files/<int:file_id>/thumbnail')
+@login_required
+def file_thumbnail(id, file_id):
+    """PNG thumbnail of a job file, once preflight has made one"""
+    job_file = JobFile.query.filter_by(id=file_id, job_id=id).first_or_404()
+    if job_file.preflight is None or not job_file.preflight.has_thumbnail:
+        abort(404)
+    return send_file(thumbnail_path(job_file.sha256), mimetype='image/png', max_age=86400)
+
+@bp.route('/jobs/<int:id>/files/<int:file_id>/delete', methods=['POST'])
+@login_required
+def delete_file(id, file_id):
+    """Detach a file from a job"""
+    job_file = JobFile.query.filter_by(id=file_id, job_id=id).first_or_404()
+    delete_job_file(job_file)
+    db.session.commit()
+    flash(f'File {job_file.filename} removed', 'success')
+    return redirect(url_for('orders.view_job', id=id))
+
+@bp.route('/jobs/<int:id>/uploads', methods=['POST'])
+@login_required
+def create_upload(id):
+    """Open a resumable upload for a job file
+    
+    Takes filename, size and optionally sha256 (JSON or form). When the
+    hash is given and the same content is already on this job or was
+    uploaded by this user, the file is attached straight away and no bytes
+    need to be sent; otherwise the received bytes must match the hash.
+    """
+    job = Job.query.get_or_404(id)
+    data = request.get_json(silent=True) or request.form
+    try:
+        size = int(data.get('size', 0))
+        result = start_upload(job, data.get('filename'), size, current_user.id, data.get('sha256'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    db.session.commit()
+    if isinstance(result, JobFile):
+        queue_preflight(result)
+        return jsonify({'complete': True, 'file': job_file_payload(result)}), 201
+    return jsonify(upload_payload(result, 0)), 201
+
+def _get_upload_or_404(upload_id):
+    upload = FileUpload.query.get_or_404(upload_id)
+    if upload.user_id != current_user.id:
+        abort(404)
+    return upload
+
+@bp.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Bytes received so far for a resumable upload"""
+    upload = _get_upload_or_404(upload_id)
+    offset = upload_offset(upload)
+    return jsonify(upload_payload(upload, offset)), 200, {'Upload-Offset': str(offset)}
+
+@bp.route('/uploads/<upload_id>', methods=['PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    """Append the request body at the Upload-Offset header
+    
+    Responds 409 with the current offset if the chunk does not start
+    there, so the client can resume. The file is stored and attached to
+    the job once the declared size has been received.
+    """
+    upload = _get_upload_or_404(upload_id)
+    offset = request.headers.get('Upload-Offset', type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        return jsonify({'error': 'Upload-Offset and Content-Length are required'}), 400
+    try:
+        end = append_chunk(upload, offset, request.stream, length)
+        if end < upload.size:
+            return jsonify(upload_payload(upload, end)), 200, {'Upload-Offset': str(end)}
+        job_file = finish_upload(upload)
+    except OffsetMismatch as e:
+        return jsonify(upload_payload(upload, e.offset)), 409, {'Upload-Offset': str(e.offset)}
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    queue_preflight(job_file)
+    return jsonify({'complete': True, 'file': job_file_payload(job_file)}), 201
+
+@bp.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def abort_upload(upload_id):
+    """Discard a resumable upload"""
+    cancel_upload(_get_upload_or_404(upload_id))
+    return '', 204
+
 @bp.route('/customers')
 @login_required
 def customers():
     """List all customers"""
-    page = request.args.get('page', 1, type=int)
-    customers = Customer.query.order_by(Customer.name).paginate(
-        page=page, per_page=current_app.config['ITEMS_PER_PAGE'], error_out=False)
+    customers = paginate_query(Customer.query, CUSTOMER_LIST_KEYS,
+                               current_app.config['ITEMS_PER_PAGE'])
     
     return render_template('orders/customers.html', 
                           title='Customers', 
@@ -342,21 +521,11 @@ def create_quote():
     """Create a new quote"""
     form = QuoteForm()
     # Populate customer choices
-    form.customer_id.choices = [(c.id, c.name) for c in Customer.query.order_by(Customer.name).all()]
+    form.customer_id.choices = get_choices('customer')
     
     if form.validate_on_submit():
-        # Generate a unique order number: QUO-YYYYMMDD-XXX
-        date_str = datetime.utcnow().strftime('%Y%m%d')
-        last_order = Order.query.filter(Order.order_number.like(f'QUO-{date_str}-%')).order_by(
-            Order.order_number.desc()).first()
-        
-        if last_order:
-            last_num = int(last_order.order_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-            
-        order_number = f'QUO-{date_str}-{new_num:03d}'
+        # Allocate a unique order number: QUO-YYYYMMDD-XXX
+        order_number = next_number('QUO')
         
         order = Order(
             order_number=order_number,
@@ -373,33 +542,58 @@ def create_quote():
     
     return render_template('orders/create_quote.html', title='Create Quote', form=form)
 
+@bp.route('/quotes/price')
+@login_required
+def price_quote():
+    """Price-break table for a product and job specs, as JSON"""
+    product = Product.query.get_or_404(request.args.get('product_id', 0, type=int))
+    try:
+        quantities = [int(q) for q in request.args.get('quantities', '').split(',') if q.strip()]
+    except ValueError:
+        abort(400)
+    if not quantities or len(quantities) > MAX_PRICE_BREAKS or min(quantities) < 1:
+        abort(400)
+    
+    specs = JobSpecs(
+        width=request.args.get('width', type=float),
+        height=request.args.get('height', type=float),
+        pages=request.args.get('pages', 1, type=int),
+        colors=request.args.get('colors', '4/0'),
+        paper_type=request.args.get('paper_type')
+    )
+    paper = find_paper(specs.paper_type, request.args.get('material_id', type=int))
+    rates = get_rates(markup=request.args.get('markup', type=float))
+    try:
+        table = price_breaks(sorted(set(quantities)), specs, paper, rates)
+    except PieceTooLarge as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(
+        product={'id': product.id, 'name': product.name},
+        paper={'id': paper.id, 'name': paper.name, 'unit_price': paper.unit_price} if paper else None,
+        pieces_per_sheet=table.up,
+        markup=rates.markup,
+        breaks=table.rows()
+    )
+
 @bp.route('/search', methods=['GET', 'POST'])
 @login_required
 def search():
     """Search for customers, orders, or jobs"""
     form = SearchForm()
     results = None
+    hits = None
     
     if form.validate_on_submit() or request.args.get('query'):
         query = form.query.data or request.args.get('query')
         search_type = form.search_type.data or request.args.get('search_type', 'order')
+        page = request.args.get('page', 1, type=int)
         
-        if search_type == 'customer':
-            results = Customer.query.filter(
-                (Customer.name.ilike(f'%{query}%')) |
-                (Customer.contact_person.ilike(f'%{query}%')) |
-                (Customer.email.ilike(f'%{query}%'))
-            ).all()
-        elif search_type == 'order':
-            results = Order.query.filter(
-                (Order.order_number.ilike(f'%{query}%')) |
-                (Order.notes.ilike(f'%{query}%'))
-            ).all()
-        elif search_type == 'job':
-            results = Job.query.filter(
-                (Job.job_number.ilike(f'%{query}%')) |
-                (Job.notes.ilike(f'%{query}%'))
-            ).all()
+        # Ranked full-text lookup; 'all' searches every entity type at once
+        entity_types = None if search_type == 'all' else [search_type]
+        hits = search_index(query, entity_types, page=page,
+                            per_page=current_app.config['ITEMS_PER_PAGE'])
+        results = [hit.item for hit in hits.hits]
         
         form.query.data = query
         form.search_type.data = search_type
@@ -408,4 +602,5 @@ def search():
                           title='Search', 
                           form=form,
                           results=results,
+                          hits=hits,
                           search_type=form.search_type.data or 'order')
@@ -0,0 +1,175 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date
+from flask import request, current_app
+from sqlalchemy import tuple_, and_, or_
+from sqlalchemy.engine import Row
+
+# Process-local cache of expensive COUNT(*) results: key -> (expires_at, total),
+# oldest first. Expired entries are dropped on every store and at most
+# COUNT_CACHE_SIZE are kept, since keys include user-supplied filters.
+COUNT_CACHE_SIZE = 512
+_count_cache = OrderedDict()
+_count_lock = threading.Lock()
+
+class KeysetPagination:
+    """One page of a cursor-paginated query
+
+    Mirrors the parts of Flask-SQLAlchemy's Pagination the templates use
+    (items, per_page, has_next, has_prev, total, iteration) and adds opaque
+    next/prev cursor tokens in place of page numbers.
+    """
+    cursor_mode = True
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+    return value
+
+def encode_cursor(values, direction):
+    """Encode key values and a direction ('n' or 'p') as a URL-safe token"""
+    payload = json.dumps([direction, [_encode_value(v) for v in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Decode a cursor token into (direction, values), or None if it is invalid"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if direction not in ('n', 'p'):
+            return None
+        return direction, [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        return None
+
+def _after(keys, values, reverse=False):
+    """Filter for rows strictly after the given key values in keys' order"""
+    descending = [desc for column, desc in keys]
+    if reverse:
+        descending = [not desc for desc in descending]
+
+    columns = [column for column, desc in keys]
+    if all(descending) or not any(descending):
+        # Uniform direction: a row-value comparison can use a composite index
+        if descending[0]:
+            return tuple_(*columns) < tuple_(*values)
+        return tuple_(*columns) > tuple_(*values)
+
+    clauses = []
+    for i, (column, desc) in enumerate(zip(columns, descending)):
+        equal = [columns[j] == values[j] for j in range(i)]
+        step = column < values[i] if desc else column > values[i]
+        clauses.append(and_(*equal, step))
+    return or_(*clauses)
+
+def _ordering(keys, reverse=False):
+    ordering = []
+    for column, desc in keys:
+        if reverse:
+            desc = not desc
+        ordering.append(column.desc() if desc else column.asc())
+    return ordering
+
+def _key_values(item, keys):
+    entity = item[0] if isinstance(item, Row) else item
+    return [getattr(entity, column.key) for column, desc in keys]
+
+def cached_count(query, cache_key, ttl):
+    """COUNT(*) for query, reused for ttl seconds under cache_key"""
+    now = time.monotonic()
+    cached = _count_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = query.order_by(None).count()
+    with _count_lock:
+        _count_cache.pop(cache_key, None)
+        _count_cache[cache_key] = (now + ttl, total)
+        for key in [key for key, (expires_at, _) in _count_cache.items() if expires_at <= now]:
+            del _count_cache[key]
+        while len(_count_cache) > COUNT_CACHE_SIZE:
+            _count_cache.popitem(last=False)
+    return total
+
+def keyset_paginate(query, keys, cursor=None, per_page=20, count_key=None, count_ttl=60):
+    """Paginate query by the given (column, descending) keys instead of OFFSET
+
+    The last key must be unique (normally the primary key) so the order is
+    total and cursors are stable. Pass count_key to include a cached total.
+    """
+    decoded = decode_cursor(cursor) if cursor else None
+    backwards = decoded is not None and decoded[0] == 'p'
+
+    page_query = query
+    if decoded is not None:
+        page_query = page_query.filter(_after(keys, decoded[1], reverse=backwards))
+    rows = page_query.order_by(*_ordering(keys, reverse=backwards)).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if more or backwards:
+            next_cursor = encode_cursor(_key_values(rows[-1], keys), 'n')
+        if decoded is not None and (more or not backwards):
+            prev_cursor = encode_cursor(_key_values(rows[0], keys), 'p')
+
+    total = cached_count(query, count_key, count_ttl) if count_key else None
+    return KeysetPagination(rows, per_page, next_cursor, prev_cursor, total)
+
+def paginate_query(query, keys, per_page, default_mode='cursor', with_count=False):
+    """Paginate a list view by cursor or by page number
+
+    Keyset pagination is the default; ?mode=offset or a ?page= number (as
+    in old bookmarks) switches to page numbers, unless a ?cursor= token is
+    also given. In cursor mode the total is only computed when with_count
+    is set, and is then cached briefly.
+    """
+    cursor = request.args.get('cursor')
+    mode = request.args.get('mode') or ('offset' if 'page' in request.args else default_mode)
+    if cursor is None and mode == 'offset':
+        page = request.args.get('page', 1, type=int)
+        return query.order_by(*_ordering(keys)).paginate(page=page, per_page=per_page, error_out=False)
+
+    count_key = None
+    if with_count:
+        filters = sorted((k, v) for k, v in request.args.items(multi=True) if k not in ('cursor', 'mode'))
+        count_key = (request.endpoint, tuple(filters))
+    return keyset_paginate(query, keys, cursor=cursor, per_page=per_page, count_key=count_key,
+                           count_ttl=current_app.config.get('PAGINATION_COUNT_TTL', 60))
@@ -0,0 +1,214 @@
+import itertools
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import zlib
+from datetime import datetime
+from flask import current_app
+from PIL import Image
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import FilePreflight
+from app.files import blob_path
+from app.imposition import parse_colors
+from app.tasks import task, enqueue, run_in_process
+
+# Artwork preflight. Each stored file is checked once per SHA-256: after an
+# upload a FilePreflight row is queued, and a task runs analyse_file() on
+# the process pool to read the page count, trim size, colour spaces and
+# (for raster images) resolution, and to write a PNG thumbnail. A reprint
+# of known artwork finds the existing row and costs nothing. Checks against
+# a job's own specs are made when the results are shown, since the same
+# file can be attached to jobs with different specs.
+#
+# PDFs (and PDF-compatible .ai files) are scanned with regular expressions
+# over a memory map of the file plus any compressed object streams, which
+# covers the page tree and boxes without a PDF library. PDF thumbnails need
+# Ghostscript on the PATH; raster images are handled by Pillow.
+
+POINTS_TO_MM = 25.4 / 72
+MAX_IMAGE_PIXELS = 1_000_000_000  # Print-resolution artwork is far past Pillow's default limit
+MAX_OBJECT_STREAM = 32 * 1024 * 1024  # Inflated bytes kept per PDF object stream; the rest is not scanned
+
+PAGES_RE = re.compile(rb'/Type\s*/Pages\b')
+PAGE_RE = re.compile(rb'/Type\s*/Page\b')
+COUNT_RE = re.compile(rb'/Count\s+(\d+)')
+BOX_RE = re.compile(rb'/(TrimBox|MediaBox)\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]')
+OBJSTM_RE = re.compile(rb'/Type\s*/ObjStm\b')
+COLOR_RE = re.compile(rb'/(DeviceCMYK|DeviceRGB|DeviceGray|ICCBased|Separation|DeviceN|Lab)\b')
+
+IMAGE_MODES = {'CMYK': 'CMYK', 'RGB': 'RGB', 'RGBA': 'RGB', 'L': 'Gray', 'LA': 'Gray',
+               '1': 'Bitmap', 'P': 'Indexed', 'LAB': 'Lab'}
+
+# Analysis. These run in worker processes and only see paths and numbers.
+
+def _object_streams(data):
+    """Inflated contents of the compressed object streams in a PDF, one at a time and each capped"""
+    for match in OBJSTM_RE.finditer(data):
+        start = data.find(b'stream', match.end())
+        if start < 0:
+            continue
+        header = data[data.rfind(b'obj', 0, match.start()):start]
+        if b'/FlateDecode' not in header:
+            continue
+        start += 6
+        if data[start:start + 2] == b'\r\n':
+            start += 2
+        elif data[start:start + 1] in (b'\r', b'\n'):
+            start += 1
+        end = data.find(b'endstream', start)
+        try:
+            yield zlib.decompressobj().decompress(data[start:end if end > 0 else None], MAX_OBJECT_STREAM)
+        except zlib.error:
+            continue
+
+def _pdf_info(path):
+    info = {'file_type': 'pdf', 'pages': None, 'width_mm': None, 'height_mm': None, 'color_space': None}
+    count, page_objects, boxes, spaces = 0, 0, {}, set()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for region in itertools.chain([data], _object_streams(data)):
+            for match in PAGES_RE.finditer(region):
+                near = region[max(match.start() - 512, 0):match.end() + 512]
+                count = max([count] + [int(c) for c in COUNT_RE.findall(near)])
+            page_objects += sum(1 for _ in PAGE_RE.finditer(region))
+            for match in BOX_RE.finditer(region):
+                boxes.setdefault(match.group(1), [float(v) for v in match.groups()[1:]])
+            spaces.update(name.decode() for name in COLOR_RE.findall(region))
+    info['pages'] = count or page_objects or None
+    box = boxes.get(b'TrimBox') or boxes.get(b'MediaBox')
+    if box:
+        info['width_mm'] = round(abs(box[2] - box[0]) * POINTS_TO_MM, 1)
+        info['height_mm'] = round(abs(box[3] - box[1]) * POINTS_TO_MM, 1)
+    if spaces:
+        info['color_space'] = ', '.join(sorted(spaces))
+    return info
+
+def _save_thumbnail(image, thumbnail_path, size):
+    image.thumbnail((size, size))
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGB')
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    temp = f'{thumbnail_path}.{os.getpid()}.tmp'
+    image.save(temp, 'PNG')
+    os.replace(temp, thumbnail_path)
+    return True
+
+def _pdf_thumbnail(path, thumbnail_path, size):
+    gs = shutil.which('gs')
+    if not gs:
+        return False
+    with tempfile.TemporaryDirectory() as folder:
+        page = os.path.join(folder, 'page.png')
+        subprocess.run([gs, '-q', '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sDEVICE=png16m', '-dFirstPage=1',
+                        '-dLastPage=1', '-r36', f'-sOutputFile={page}', path],
+                       check=True, timeout=120, capture_output=True)
+        with Image.open(page) as image:
+            return _save_thumbnail(image, thumbnail_path, size)
+
+def _image_info(path, thumbnail_path, size):
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(path) as image:
+        width, height = image.size
+        dpi = image.info.get('dpi')
+        dpi = float(dpi[0]) if dpi and dpi[0] else None
+        info = {
+            'file_type': (image.format or 'image').lower(),
+            'pages': getattr(image, 'n_frames', 1),
+            'width_mm': round(width / dpi * 25.4, 1) if dpi else None,
+            'height_mm': round(height / dpi * 25.4, 1) if dpi else None,
+            'dpi': round(dpi, 1) if dpi else None,
+            'color_space': IMAGE_MODES.get(image.mode, image.mode),
+        }
+        image.draft('RGB', (size, size))
+        info['has_thumbnail'] = _save_thumbnail(image, thumbnail_path, size)
+    return info
+
+def analyse_file(path, thumbnail_path, size):
+    """Preflight facts for a stored file, writing its thumbnail if one can be made"""
+    with open(path, 'rb') as f:
+        is_pdf = f.read(1024).lstrip().startswith(b'%PDF')
+    if is_pdf:
+        info = _pdf_info(path)
+        try:
+            info['has_thumbnail'] = _pdf_thumbnail(path, thumbnail_path, size)
+        except (subprocess.SubprocessError, OSError):
+            info['has_thumbnail'] = False
+        return info
+    try:
+        return _image_info(path, thumbnail_path, size)
+    except (OSError, Image.DecompressionBombError):
+        return {'file_type': 'other', 'has_thumbnail': False}
+
+# Queueing and results
+
+def thumbnail_path(sha256):
+    return os.path.join(current_app.config['FILE_STORE_FOLDER'], 'thumbnails', sha256[:2], f'{sha256}.png')
+
+def queue_preflight(job_file):
+    """Queue a preflight for a job file's content unless it has been (or is being) checked"""
+    record = db.session.get(FilePreflight, job_file.sha256)
+    if record is not None and record.status != 'failed':
+        return record
+    if record is None:
+        record = FilePreflight(sha256=job_file.sha256)
+        db.session.add(record)
+    record.status = 'pending'
+    try:
+        enqueue('preflight', job_file.sha256, user_id=job_file.user_id)
+        db.session.commit()
+    except IntegrityError:
+        # Another request queued the same content first
+        db.session.rollback()
+        return db.session.get(FilePreflight, job_file.sha256)
+    return record
+
+@task('preflight')
+def preflight_task(sha256):
+    """Analyse stored content on the process pool and save the results"""
+    record = db.session.get(FilePreflight, sha256)
+    if record is None:
+        # The row was removed after the task was queued
+        return None
+    try:
+        info = run_in_process(analyse_file, blob_path(sha256), thumbnail_path(sha256),
+                              current_app.config['PREFLIGHT_THUMBNAIL_SIZE'])
+    except Exception as e:
+        record.status, record.error, record.checked_at = 'failed', f'{type(e).__name__}: {e}', datetime.utcnow()
+        db.session.commit()
+        raise
+    for key, value in info.items():
+        setattr(record, key, value)
+    record.status, record.error, record.checked_at = 'done', None, datetime.utcnow()
+    db.session.commit()
+    return info
+
+def _size_matches(actual, trim, bleed, tolerance):
+    return any(abs(actual - size) <= tolerance for size in (trim, trim + 2 * bleed))
+
+def preflight_warnings(job, preflight):
+    """Differences between a file's preflight results and the job's specs"""
+    if preflight is None or preflight.status != 'done':
+        return []
+    config = current_app.config
+    warnings = []
+    if preflight.pages and job.pages and preflight.pages != job.pages:
+        warnings.append(f'File has {preflight.pages} page(s); job specifies {job.pages}')
+    if preflight.width_mm and preflight.height_mm and job.width and job.height:
+        bleed, tolerance = config['IMPOSITION_BLEED'], config['PREFLIGHT_SIZE_TOLERANCE']
+        width, height = float(job.width), float(job.height)
+        fits = any(_size_matches(preflight.width_mm, w, bleed, tolerance) and
+                   _size_matches(preflight.height_mm, h, bleed, tolerance)
+                   for w, h in ((width, height), (height, width)))
+        if not fits:
+            warnings.append(f'File is {preflight.width_mm:g} x {preflight.height_mm:g} mm; '
+                            f'job is {width:g} x {height:g} mm')
+    if preflight.dpi and preflight.dpi < config['PREFLIGHT_MIN_DPI']:
+        warnings.append(f'Resolution is {preflight.dpi:g} dpi (minimum {config["PREFLIGHT_MIN_DPI"]})')
+    front, back = parse_colors(job.colors)
+    spaces = preflight.color_space or ''
+    if max(front, back) >= 4 and 'RGB' in spaces and 'CMYK' not in spaces:
+        warnings.append('Artwork is RGB; the job prints in process colour (CMYK)')
+    return warnings
@@ -0,0 +1,122 @@
+from collections import namedtuple
+import math
+import numpy as np
+from flask import current_app
+from sqlalchemy import func
+from app.models import Material
+from app.imposition import layout, parse_colors
+
+# Cost-plus pricing for a job at many quantities at once. For each quantity:
+#   sheets = ceil(quantity * leaves / up * (1 + spoilage)) + makeready sheets
+#   cost   = sheets * paper price + ink per colour per side + press hours * rate
+#   price  = cost * (1 + markup)
+# Every step is an array operation over the quantities, so a 20-break table
+# costs the same as a single price.
+
+PricingRates = namedtuple('PricingRates', ['sheet_size', 'press_rate', 'press_speed', 'setup_hours',
+                                           'makeready_sheets', 'spoilage', 'ink_cost', 'markup'])
+
+JobSpecs = namedtuple('JobSpecs', ['width', 'height', 'pages', 'colors', 'paper_type'])
+
+class PieceTooLarge(ValueError):
+    """Raised when a finished piece does not fit on the pricing sheet"""
+
+class PriceTable:
+    """Cost breakdown and price for each quantity break, as parallel arrays"""
+
+    COLUMNS = ('quantity', 'sheets', 'paper_cost', 'ink_cost', 'press_hours',
+               'press_cost', 'total_cost', 'price', 'unit_price')
+
+    def __init__(self, up, paper, **columns):
+        self.up = up
+        self.paper = paper
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.quantity)
+
+    def rows(self):
+        """One dict per quantity break, rounded for display"""
+        data = [getattr(self, name).tolist() for name in self.COLUMNS]
+        rows = []
+        for values in zip(*data):
+            row = dict(zip(self.COLUMNS, values))
+            row['quantity'] = int(row['quantity'])
+            row['sheets'] = int(row['sheets'])
+            for key in ('paper_cost', 'ink_cost', 'press_cost', 'total_cost', 'price'):
+                row[key] = round(row[key], 2)
+            row['press_hours'] = round(row['press_hours'], 2)
+            row['unit_price'] = round(row['unit_price'], 4)
+            rows.append(row)
+        return rows
+
+def get_rates(**overrides):
+    """Pricing rates from the app config, with optional overrides"""
+    config = current_app.config
+    rates = PricingRates(
+        sheet_size=config['PRICING_SHEET_SIZE'],
+        press_rate=config['PRICING_PRESS_RATE'],
+        press_speed=config['PRICING_PRESS_SPEED'],
+        setup_hours=config['PRICING_SETUP_HOURS'],
+        makeready_sheets=config['PRICING_MAKEREADY_SHEETS'],
+        spoilage=config['PRICING_SPOILAGE'],
+        ink_cost=config['PRICING_INK_COST'],
+        markup=config['PRICING_MARKUP'],
+    )
+    return rates._replace(**{k: v for k, v in overrides.items() if v is not None})
+
+def pieces_per_sheet(width, height, sheet_size):
+    """Pieces up on the pricing sheet from the imposition layout; 1 when there is no size
+
+    Raises PieceTooLarge if the piece (with bleed) does not fit the sheet.
+    """
+    if not width or not height:
+        return 1
+    up = layout(width, height, *sheet_size).up
+    if not up:
+        raise PieceTooLarge(f'{width:g} x {height:g} mm does not fit the '
+                            f'{sheet_size[0]:g} x {sheet_size[1]:g} mm pricing sheet')
+    return up
+
+def find_paper(paper_type=None, material_id=None):
+    """Material used as paper: by id, else by case-insensitive name match"""
+    if material_id:
+        return Material.query.get(material_id)
+    if paper_type:
+        return Material.query.filter(func.lower(Material.name) == paper_type.strip().lower()).first()
+    return None
+
+def price_breaks(quantities, specs, paper=None, rates=None, up=None):
+    """Price a job at every quantity in one vectorized pass
+
+    specs is a JobSpecs (or a Job); paper is the Material printed on, or
+    None to leave paper cost out. Returns a PriceTable; raises
+    PieceTooLarge for a size that does not fit the pricing sheet.
+    """
+    rates = rates or get_rates()
+    q = np.asarray(quantities, dtype=np.float64)
+    front, back = parse_colors(specs.colors)
+    sides = 2 if back else 1
+    leaves = math.ceil((specs.pages or 1) / sides)
+    if up is None:
+        up = pieces_per_sheet(float(specs.width or 0), float(specs.height or 0), rates.sheet_size)
+    paper_price = float(paper.unit_price or 0) if paper is not None else 0.0
+
+    sheets = np.ceil(q * leaves / up * (1 + rates.spoilage)) + rates.makeready_sheets
+    paper_cost = sheets * paper_price
+    ink_cost = sheets * (front + back) * rates.ink_cost
+    press_hours = rates.setup_hours + sheets * sides / rates.press_speed
+    press_cost = press_hours * rates.press_rate
+    total_cost = paper_cost + ink_cost + press_cost
+    price = total_cost * (1 + rates.markup)
+
+    return PriceTable(up, paper, quantity=q, sheets=sheets, paper_cost=paper_cost, ink_cost=ink_cost,
+                      press_hours=press_hours, press_cost=press_cost, total_cost=total_cost,
+                      price=price, unit_price=price / q)
+
+def price_job(job, quantities=None, rates=None):
+    """Price breaks for an existing job, defaulting to its own quantity"""
+    if quantities is None:
+        quantities = [job.quantity or 1]
+    return price_breaks(quantities, job, find_paper(job.paper_type), rates)
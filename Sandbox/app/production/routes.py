@@ -1,52 +1,92 @@
-from datetime import datetime
-from flask import render_template, redirect, url_for, flash, request, current_app
-from flask_login import login_required
+from datetime import datetime, timedelta
+from flask import render_template, redirect, url_for, flash, request, current_app, jsonify, abort, send_file
+from flask_login import login_required, current_user
 from app import db
 from app.production import bp
 from app.production.forms import (UpdateJobStatusForm, ProductionScheduleForm, 
                                 JobCompletionForm, MaterialUsageForm, 
                                 QualityCheckForm, ProductionReportForm)
 from app.models import Job, Material, Order, JobStatus, OrderStatus
+from app.queries import filter_jobs
+from app.board import get_production_board
+from app.job_history import change_job_status
+from app.materials import consume_material, get_low_stock_materials, InsufficientStock
+from app.mrp import run_mrp, BUCKETS
+from app.scheduler import run_schedule, get_schedule, queue_reschedule, lateness_payload
+from app.forecast import get_order_risks
+from app.capacity import capacity_heatmap, MAX_DAYS
+from app.pagination import paginate_query
+from app.exports import export_response
+from app.tasks import enqueue, task_payload
+from app.documents import job_ticket_pdf
+from app.choices import get_choices
+
+# Sort keys for the materials list; the trailing id makes the order total for cursors
+MATERIAL_LIST_KEYS = [(Material.name, False), (Material.id, False)]
 
 @bp.route('/')
 @login_required
 def index():
     """Production dashboard showing jobs in progress and pending"""
-    # Get jobs by status
-    pending_jobs = Job.query.filter_by(status=JobStatus.PENDING).order_by(Job.created_at).all()
-    prepress_jobs = Job.query.filter_by(status=JobStatus.PREPRESS).order_by(Job.start_date).all()
-    press_jobs = Job.query.filter_by(status=JobStatus.PRESS).order_by(Job.start_date).all()
-    postpress_jobs = Job.query.filter_by(status=JobStatus.POSTPRESS).order_by(Job.start_date).all()
-    qc_jobs = Job.query.filter_by(status=JobStatus.QUALITY_CHECK).order_by(Job.start_date).all()
+    # All active jobs with order, customer and product, grouped by status in one pass
+    board = get_production_board()
+    order_risks = get_order_risks({job.order_id for jobs in board.columns.values() for job in jobs})
     
     return render_template('production/index.html', 
                           title='Production Dashboard',
-                          pending_jobs=pending_jobs,
-                          prepress_jobs=prepress_jobs,
-                          press_jobs=press_jobs,
-                          postpress_jobs=postpress_jobs,
-                          qc_jobs=qc_jobs)
+                          board=board,
+                          order_risks=order_risks,
+                          pending_jobs=board.jobs(JobStatus.PENDING),
+                          prepress_jobs=board.jobs(JobStatus.PREPRESS),
+                          press_jobs=board.jobs(JobStatus.PRESS),
+                          postpress_jobs=board.jobs(JobStatus.POSTPRESS),
+                          qc_jobs=board.jobs(JobStatus.QUALITY_CHECK))
 
 @bp.route('/schedule')
 @login_required
 def schedule():
     """Production schedule view"""
-    jobs = Job.query.filter(
-        Job.status.in_([JobStatus.PENDING, JobStatus.PREPRESS, JobStatus.PRESS, JobStatus.POSTPRESS, JobStatus.QUALITY_CHECK])
-    ).order_by(Job.start_date, Job.created_at).all()
-    
-    # Group jobs by status for scheduling display
-    job_schedule = {
-        'pending': [j for j in jobs if j.status == JobStatus.PENDING],
-        'prepress': [j for j in jobs if j.status == JobStatus.PREPRESS],
-        'press': [j for j in jobs if j.status == JobStatus.PRESS],
-        'postpress': [j for j in jobs if j.status == JobStatus.POSTPRESS],
-        'quality_check': [j for j in jobs if j.status == JobStatus.QUALITY_CHECK]
-    }
+    # Same grouped result as the dashboard, ordered by start date
+    board = get_production_board()
     
     return render_template('production/schedule.html', 
                           title='Production Schedule',
-                          job_schedule=job_schedule)
+                          job_schedule=board.as_schedule())
+
+@bp.route('/schedule/run', methods=['POST'])
+@login_required
+def run_production_schedule():
+    """Reschedule all open jobs against stage capacity and store the proposed dates
+    
+    With background=1 the run is queued and its task status returned (202).
+    """
+    if request.args.get('background'):
+        record = enqueue('run_schedule', user_id=current_user.id)
+        db.session.commit()
+        return jsonify(task_payload(record)), 202
+    schedule = run_schedule(apply=True)
+    return jsonify(lateness_payload(schedule))
+
+@bp.route('/schedule/lateness')
+@login_required
+def schedule_lateness():
+    """Projected lateness of open jobs under the current schedule, as JSON"""
+    return jsonify(lateness_payload(get_schedule()))
+
+@bp.route('/capacity')
+@login_required
+def capacity():
+    """Booked hours per stage per day for a calendar heatmap, as JSON"""
+    try:
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() \
+            if request.args.get('start') else datetime.utcnow().date()
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() \
+            if request.args.get('end') else start + timedelta(days=89)
+    except ValueError:
+        abort(400)
+    if end < start or (end - start).days >= MAX_DAYS:
+        abort(400)
+    return jsonify(capacity_heatmap(start, end))
 
 @bp.route('/jobs/<int:id>')
 @login_required
@@ -58,6 +98,15 @@ def view_job(id):
                           title=f'Production: {job.job_number}',
                           job=job)
 
+@bp.route('/jobs/<int:id>/ticket')
+@login_required
+def job_ticket(id):
+    """Job ticket as a PDF, served from the cache when unchanged"""
+    job = Job.query.get_or_404(id)
+    return send_file(job_ticket_pdf(job), mimetype='application/pdf',
+                     as_attachment=bool(request.args.get('download')),
+                     download_name=f'{job.job_number}-ticket.pdf')
+
 @bp.route('/jobs/<int:id>/update_status', methods=['GET', 'POST'])
 @login_required
 def update_job_status(id):
@@ -67,10 +116,12 @@ def update_job_status(id):
     
     if form.validate_on_submit():
         old_status = job.status
-        job.status = JobStatus[form.status.data]
+        change_job_status(job, JobStatus[form.status.data], note=form.notes.data or None)
         
         # If moving to first production phase from pending, set start date
-        if old_status == JobStatus.PENDING and job.status != JobStatus.PENDING and not job.start_date:
+        # (replacing a start date proposed by the scheduler, not one set by hand)
+        if old_status == JobStatus.PENDING and job.status != JobStatus.PENDING and \
+                not (job.start_date and job.scheduled_manually):
             job.start_date = datetime.utcnow()
         
         # If moving to completed, ensure the job completion date is set
@@ -88,13 +139,8 @@ def update_job_status(id):
             if all_completed:
                 job.order.status = OrderStatus.COMPLETED
         
-        # Add notes if provided
-        if form.notes.data:
-            if job.notes:
-                job.notes += f"\n\n[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Status changed to {job.status.value}:\n{form.notes.data}"
-            else:
-                job.notes = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Status changed to {job.status.value}:\n{form.notes.data}"
-        
+        then = ('forecast_job_completed', job.id) if job.status == JobStatus.COMPLETED else None
+        queue_reschedule([job.id], then, user_id=current_user.id)
         db.session.commit()
         flash(f'Job status updated to {job.status.value}', 'success')
         return redirect(url_for('production.view_job', id=job.id))
@@ -119,6 +165,8 @@ def schedule_job(id):
         job.start_date = form.start_date.data
         job.completion_date = form.completion_date.data
         job.estimated_hours = form.estimated_hours.data
+        # Dates set here are kept when the scheduler moves other jobs; clearing the start date hands the job back
+        job.scheduled_manually = job.start_date is not None
         
         # Add notes if provided
         if form.notes.data:
@@ -127,6 +175,7 @@ def schedule_job(id):
             else:
                 job.notes = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Production schedule updated:\n{form.notes.data}"
         
+        queue_reschedule([job.id], user_id=current_user.id)
         db.session.commit()
         flash('Job scheduled successfully', 'success')
         return redirect(url_for('production.view_job', id=job.id))
@@ -150,7 +199,7 @@ def complete_job(id):
     form = JobCompletionForm()
     
     if form.validate_on_submit():
-        job.status = JobStatus.COMPLETED
+        change_job_status(job, JobStatus.COMPLETED, note=form.notes.data or None)
         job.completion_date = form.completion_date.data
         job.actual_hours = form.actual_hours.data
         
@@ -164,13 +213,8 @@ def complete_job(id):
         if all_completed:
             job.order.status = OrderStatus.COMPLETED
         
-        # Add notes if provided
-        if form.notes.data:
-            if job.notes:
-                job.notes += f"\n\n[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Job completed:\n{form.notes.data}"
-            else:
-                job.notes = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Job completed:\n{form.notes.data}"
-        
+        then = ('forecast_job_completed', job.id) if job.status == JobStatus.COMPLETED else None
+        queue_reschedule([job.id], then, user_id=current_user.id)
         db.session.commit()
         flash('Job marked as completed', 'success')
         return redirect(url_for('production.view_job', id=job.id))
@@ -194,19 +238,21 @@ def quality_check(id):
     
     if form.validate_on_submit():
         if form.passed.data == 'pass':
-            job.status = JobStatus.COMPLETED
+            new_status = JobStatus.COMPLETED
             job.completion_date = datetime.utcnow()
             result_text = "PASSED"
         else:
-            job.status = JobStatus.PRESS  # Send back to production
+            new_status = JobStatus.PRESS  # Send back to production
             result_text = "FAILED - Requires rework"
         
-        # Add notes about quality check
-        if job.notes:
-            job.notes += f"\n\n[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Quality Check {result_text}:\n{form.notes.data}"
-        else:
-            job.notes = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] Quality Check {result_text}:\n{form.notes.data}"
+        # Record the result and notes on the status event
+        note = f"Quality Check {result_text}"
+        if form.notes.data:
+            note += f":\n{form.notes.data}"
+        change_job_status(job, new_status, note=note)
         
+        then = ('forecast_job_completed', job.id) if job.status == JobStatus.COMPLETED else None
+        queue_reschedule([job.id], then, user_id=current_user.id)
         db.session.commit()
         flash(f'Quality check completed: {result_text}', 'success')
         return redirect(url_for('production.view_job', id=job.id))
@@ -220,14 +266,56 @@ def quality_check(id):
 @login_required
 def materials():
     """List all materials"""
-    page = request.args.get('page', 1, type=int)
-    materials = Material.query.order_by(Material.name).paginate(
-        page=page, per_page=current_app.config['ITEMS_PER_PAGE'], error_out=False)
+    materials = paginate_query(Material.query, MATERIAL_LIST_KEYS,
+                               current_app.config['ITEMS_PER_PAGE'])
     
     return render_template('production/materials.html',
                           title='Materials Inventory',
                           materials=materials)
 
+@bp.route('/materials/low-stock')
+@login_required
+def low_stock():
+    """JSON feed of all materials at or below their reorder level"""
+    materials = get_low_stock_materials()
+    return jsonify(materials=[{
+        'id': m.id,
+        'name': m.name,
+        'unit': m.unit,
+        'stock_level': m.stock_level,
+        'reorder_level': m.reorder_level,
+        'shortfall': max(-m.reorder_margin, 0.0),
+    } for m in materials], count=len(materials))
+
+@bp.route('/mrp')
+@login_required
+def mrp():
+    """Material requirements of all open jobs, netted against stock, as JSON"""
+    bucket = request.args.get('bucket', 'week')
+    if bucket not in BUCKETS:
+        abort(400)
+    result = run_mrp(bucket=bucket)
+    return jsonify(
+        as_of=result.as_of.isoformat(),
+        bucket=result.bucket,
+        job_count=result.job_count,
+        unmatched_jobs=result.unmatched_jobs,
+        oversize_jobs=result.oversize_jobs,
+        materials=[{
+            'id': plan.material_id,
+            'name': plan.name,
+            'unit': plan.unit,
+            'stock_level': plan.stock_level,
+            'reorder_level': plan.reorder_level,
+            'demand': plan.demand,
+            'shortage': plan.shortage,
+            'short_from': plan.short_from.isoformat() if plan.short_from else None,
+            'reorder_from': plan.reorder_from.isoformat() if plan.reorder_from else None,
+            'buckets': [{'start': b.start.isoformat(), 'demand': b.demand, 'projected': b.projected}
+                        for b in plan.buckets],
+        } for plan in result.materials]
+    )
+
 @bp.route('/jobs/<int:id>/material_usage', methods=['GET', 'POST'])
 @login_required
 def record_material_usage(id):
@@ -236,26 +324,18 @@ def record_material_usage(id):
     form = MaterialUsageForm()
     
     # Populate material choices
-    form.material_id.choices = [(m.id, f"{m.name} ({m.stock_level} {m.unit} available)") 
-                               for m in Material.query.order_by(Material.name).all()]
+    form.material_id.choices = get_choices('material')
     
     if form.validate_on_submit():
         material = Material.query.get(form.material_id.data)
         
-        # Update stock level
-        if material.stock_level >= form.quantity.data:
-            material.stock_level -= form.quantity.data
-            
-            # Add notes about material usage
-            usage_note = f"Used {form.quantity.data} {material.unit} of {material.name}"
-            if form.notes.data:
-                usage_note += f": {form.notes.data}"
-                
-            if job.notes:
-                job.notes += f"\n\n[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] {usage_note}"
-            else:
-                job.notes = f"[{datetime.utcnow().strftime('%Y-%m-%d %H:%M')}] {usage_note}"
-            
+        # Decrement stock atomically and record the usage in the ledger
+        try:
+            consume_material(material.id, form.quantity.data, job_id=job.id,
+                             note=form.notes.data or None, user_id=current_user.id)
+        except InsufficientStock as e:
+            flash(f'Error: Not enough {material.name} in stock. Available: {e.available} {material.unit}', 'danger')
+        else:
             db.session.commit()
             flash(f'Recorded usage of {form.quantity.data} {material.unit} of {material.name}', 'success')
             
@@ -264,8 +344,6 @@ def record_material_usage(id):
                 flash(f'Warning: {material.name} stock is low ({material.stock_level} {material.unit} remaining)', 'warning')
                 
             return redirect(url_for('production.view_job', id=job.id))
-        else:
-            flash(f'Error: Not enough {material.name} in stock. Available: {material.stock_level} {material.unit}', 'danger')
     
     return render_template('production/material_usage.html',
                           title=f'Record Material Usage: {job.job_number}',
@@ -284,22 +362,8 @@ def reports():
         start_date = form.start_date.data
         end_date = form.end_date.data
         
-        # Base query - jobs within date range
-        query = Job.query.filter(
-            (Job.created_at >= start_date) & 
-            (Job.created_at <= end_date)
-        )
-        
-        # Filter by status if specified
-        if form.status.data != 'all':
-            if form.status.data == 'pending':
-                query = query.filter_by(status=JobStatus.PENDING)
-            elif form.status.data == 'in_progress':
-                query = query.filter(Job.status.in_([
-                    JobStatus.PREPRESS, JobStatus.PRESS, JobStatus.POSTPRESS, JobStatus.QUALITY_CHECK
-                ]))
-            elif form.status.data == 'completed':
-                query = query.filter_by(status=JobStatus.COMPLETED)
+        # Jobs within date range, filtered by status group if specified
+        query = filter_jobs(Job.query, start_date, end_date, form.status.data)
         
         # Execute query
         jobs = query.order_by(Job.created_at).all()
@@ -340,3 +404,9 @@ def reports():
                           title='Production Reports',
                           form=form,
                           report_data=report_data)
+
+@bp.route('/export/<fmt>')
+@login_required
+def export_jobs(fmt):
+    """Download jobs as CSV or XLSX using the production report filters"""
+    return export_response('jobs', fmt, request.args)
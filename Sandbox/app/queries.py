@@ -0,0 +1,76 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from app.models import Order, Job, Invoice, JobStatus, InvoiceStatus
+
+# Correlated subqueries so list views can show per-order counts without
+# touching the dynamic Order.jobs / Order.invoices relationships per row.
+def job_count_column():
+    """Number of jobs for the enclosing Order row"""
+    return select(func.count(Job.id)).where(Job.order_id == Order.id) \
+        .correlate(Order).scalar_subquery().label('job_count')
+
+def invoice_count_column():
+    """Number of invoices for the enclosing Order row"""
+    return select(func.count(Invoice.id)).where(Invoice.order_id == Order.id) \
+        .correlate(Order).scalar_subquery().label('invoice_count')
+
+def with_order_relations(query):
+    """Load each order's customer in the same query"""
+    return query.options(joinedload(Order.customer))
+
+def with_invoice_relations(query):
+    """Load each invoice's order and customer in the same query"""
+    return query.options(joinedload(Invoice.order).joinedload(Order.customer))
+
+def with_job_relations(query):
+    """Load each job's order, customer and product in the same query"""
+    return query.options(
+        joinedload(Job.order).joinedload(Order.customer),
+        joinedload(Job.product)
+    )
+
+def orders_with_counts(query=None):
+    """Order query with customer joined and job/invoice counts as extra columns"""
+    if query is None:
+        query = Order.query
+    return with_order_relations(query).add_columns(job_count_column(), invoice_count_column())
+
+def unpack_order_counts(rows):
+    """Turn (Order, job_count, invoice_count) rows into orders carrying the counts"""
+    orders = []
+    for order, job_count, invoice_count in rows:
+        order.job_count = job_count
+        order.invoice_count = invoice_count
+        orders.append(order)
+    return orders
+
+# Production report status filter values and the job statuses they cover
+JOB_STATUS_GROUPS = {
+    'pending': [JobStatus.PENDING],
+    'in_progress': [JobStatus.PREPRESS, JobStatus.PRESS, JobStatus.POSTPRESS, JobStatus.QUALITY_CHECK],
+    'completed': [JobStatus.COMPLETED],
+}
+
+def filter_invoices(query, status='all', start_date=None, end_date=None, customer_id=0):
+    """Apply the invoice list filters (status name, created_at range, customer)"""
+    if status and status != 'all':
+        query = query.filter(Invoice.status == InvoiceStatus[status])
+    if start_date:
+        query = query.filter(Invoice.created_at >= start_date)
+    if end_date:
+        query = query.filter(Invoice.created_at <= end_date)
+    if customer_id:
+        # Subquery rather than a join so this composes with queries already joined to orders
+        query = query.filter(Invoice.order_id.in_(
+            select(Order.id).where(Order.customer_id == customer_id)))
+    return query
+
+def filter_jobs(query, start_date=None, end_date=None, status='all'):
+    """Apply the production report filters (created_at range, status group)"""
+    if start_date:
+        query = query.filter(Job.created_at >= start_date)
+    if end_date:
+        query = query.filter(Job.created_at <= end_date)
+    if status and status != 'all':
+        query = query.filter(Job.status.in_(JOB_STATUS_GROUPS[status]))
+    return query
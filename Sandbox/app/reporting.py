@@ -0,0 +1,82 @@
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func, case
+from app import db
+from app.models import Invoice, Order, Customer, InvoiceStatus
+
+OUTSTANDING_STATUSES = [InvoiceStatus.SENT, InvoiceStatus.OVERDUE]
+
+MonthlyRow = namedtuple('MonthlyRow', ['month_key', 'month', 'count', 'total', 'paid', 'outstanding'])
+InvoiceReport = namedtuple('InvoiceReport', ['rows', 'count', 'total_amount', 'truncated'])
+
+# Invoice report types: status filter and sort order
+REPORT_TYPES = {
+    'outstanding': ('Outstanding Invoices Report', OUTSTANDING_STATUSES, Invoice.due_date.asc()),
+    'paid': ('Paid Invoices Report', [InvoiceStatus.PAID], Invoice.created_at.desc()),
+    'overdue': ('Overdue Invoices Report', [InvoiceStatus.OVERDUE], Invoice.due_date.asc()),
+}
+
+def month_bucket(column):
+    """SQL expression truncating a datetime column to a 'YYYY-MM' key"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc('month', column), 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def _in_range(query, start_date, end_date):
+    return query.filter(Invoice.created_at >= start_date, Invoice.created_at <= end_date)
+
+def monthly_invoice_summary(start_date, end_date):
+    """Invoice count and totals per month, grouped in the database
+
+    Returns (rows, totals) where rows is a list of MonthlyRow and totals is
+    a dict with total_invoiced, total_paid and total_outstanding.
+    """
+    month = month_bucket(Invoice.created_at).label('month_key')
+    amount = func.coalesce(Invoice.total_amount, 0.0)
+    query = _in_range(db.session.query(
+        month,
+        func.count(Invoice.id),
+        func.coalesce(func.sum(amount), 0.0),
+        func.coalesce(func.sum(case((Invoice.status == InvoiceStatus.PAID, amount), else_=0.0)), 0.0),
+        func.coalesce(func.sum(case((Invoice.status.in_(OUTSTANDING_STATUSES), amount), else_=0.0)), 0.0)
+    ), start_date, end_date).group_by(month).order_by(month)
+
+    rows = []
+    for month_key, count, total, paid, outstanding in query:
+        label = datetime.strptime(month_key, '%Y-%m').strftime('%B %Y')
+        rows.append(MonthlyRow(month_key, label, count, float(total), float(paid), float(outstanding)))
+
+    totals = {
+        'total_invoiced': sum(row.total for row in rows),
+        'total_paid': sum(row.paid for row in rows),
+        'total_outstanding': sum(row.outstanding for row in rows),
+    }
+    return rows, totals
+
+def invoice_status_report(report_type, start_date, end_date, max_rows=1000):
+    """Rows and SQL-side totals for the outstanding, paid and overdue reports
+
+    Rows are plain tuples of the columns the report shows rather than ORM
+    objects, and at most max_rows are returned; count and total_amount
+    always cover the whole range.
+    """
+    title, statuses, ordering = REPORT_TYPES[report_type]
+    base = _in_range(Invoice.query, start_date, end_date).filter(Invoice.status.in_(statuses))
+
+    count, total_amount = base.with_entities(
+        func.count(Invoice.id), func.coalesce(func.sum(Invoice.total_amount), 0.0)
+    ).one()
+
+    rows = base.outerjoin(Order, Invoice.order_id == Order.id) \
+        .outerjoin(Customer, Order.customer_id == Customer.id) \
+        .with_entities(
+            Invoice.id,
+            Invoice.invoice_number,
+            Customer.name.label('customer_name'),
+            Invoice.created_at,
+            Invoice.due_date,
+            Invoice.total_amount,
+            Invoice.status
+        ).order_by(ordering, Invoice.id).limit(max_rows).all()
+
+    return title, InvoiceReport(rows, count, float(total_amount), count > len(rows))
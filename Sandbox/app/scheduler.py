@@ -0,0 +1,360 @@
+from collections import namedtuple
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import fcntl
+import heapq
+import math
+import threading
+import numpy as np
+from flask import current_app
+from sqlalchemy import update, or_
+from app import db
+from app.models import Job, Order, JobStatus
+from app.tasks import task, enqueue
+
+# Finite-capacity list scheduling. Open jobs are taken in priority order
+# (earliest order due date, then oldest) and each remaining stage is put on
+# the workstation of that stage that frees up first, kept in a min-heap of
+# free times per stage. Times are working hours from the start of the
+# day the schedule was built, so every process building a schedule that
+# day gets the same dates for the same jobs.
+#
+# Placing a job only depends on the jobs ahead of it, so the workstation
+# heaps are snapshotted every CHECKPOINT_EVERY jobs; when one job changes
+# it is moved to its new position and only the jobs from the nearest
+# checkpoint before its old or new position are placed again.
+#
+# Job and order edits do not reschedule in the request: queue_reschedule()
+# adds a task to the edit's transaction, and the task re-reads only the
+# edited jobs plus jobs and orders updated since the schedule was last
+# synced. Jobs an operator scheduled by hand are placed like any other but
+# their dates are never overwritten.
+
+STAGES = [JobStatus.PREPRESS, JobStatus.PRESS, JobStatus.POSTPRESS]
+
+# Stages still to run for a job in each status
+REMAINING_STAGES = {
+    JobStatus.PENDING: STAGES,
+    JobStatus.PREPRESS: STAGES,
+    JobStatus.PRESS: STAGES[1:],
+    JobStatus.POSTPRESS: STAGES[2:],
+}
+
+CHECKPOINT_EVERY = 256
+
+# Rows updated this long before the last sync are read again, for
+# transactions that stamped updated_at before it and committed after
+SYNC_OVERLAP = timedelta(minutes=5)
+
+JobInput = namedtuple('JobInput', ['job_id', 'job_number', 'status', 'hours', 'due_date', 'created_at',
+                                   'manual'])
+Placement = namedtuple('Placement', ['job_id', 'start', 'end', 'stages'])
+LatenessRow = namedtuple('LatenessRow', ['job_id', 'job_number', 'due_date', 'start_date',
+                                         'completion_date', 'late_hours'])
+
+class WorkCalendar:
+    """Converts working hours after an anchor into datetimes, Monday to Friday"""
+
+    def __init__(self, anchor, day_start, hours_per_day):
+        self.day_start = day_start
+        self.hours_per_day = hours_per_day
+        day = datetime.combine(anchor.date(), datetime.min.time())
+        opening = day + timedelta(hours=day_start)
+        if day.weekday() >= 5 or anchor >= opening + timedelta(hours=hours_per_day):
+            day = self._next_workday(day)
+            self.offset = 0.0
+        else:
+            self.offset = max((anchor - opening).total_seconds() / 3600.0, 0.0)
+        self.first_day = day
+
+    @staticmethod
+    def _next_workday(day):
+        day += timedelta(days=1)
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        return day
+
+    def to_hours(self, moments):
+        """Working hours from the anchor to each datetime (negative if before it), as an array"""
+        moments = list(moments)
+        days = np.array([m.date() for m in moments], dtype='datetime64[D]')
+        within = np.array([(m - datetime.combine(m.date(), datetime.min.time())).total_seconds() / 3600.0
+                           for m in moments], dtype=np.float64).reshape(-1)
+        within = np.clip(within - self.day_start, 0.0, self.hours_per_day)
+        within = np.where(np.is_busday(days), within, 0.0) if len(moments) else within
+        whole_days = np.busday_count(np.datetime64(self.first_day.date()), days)
+        return whole_days * self.hours_per_day + within - self.offset
+
+    def to_datetime(self, hours):
+        hours += self.offset
+        days = int(hours // self.hours_per_day)
+        within = hours - days * self.hours_per_day
+        if days and not within:
+            # Finishing exactly at closing time belongs to the earlier day
+            days, within = days - 1, self.hours_per_day
+        # Whole weeks first, then the remaining working days
+        weeks, days = divmod(days, 5)
+        day = self.first_day + timedelta(weeks=weeks)
+        for _ in range(days):
+            day = self._next_workday(day)
+        return day + timedelta(hours=self.day_start + within)
+
+class Schedule:
+    """Incrementally maintained finite-capacity schedule of open jobs"""
+
+    def __init__(self, machines, split, calendar):
+        self.machines = machines
+        self.split = split
+        self.calendar = calendar
+        self.inputs = {}
+        self.keys = []  # Sorted priority keys, one per job
+        self.placements = {}
+        self.checkpoints = []
+        self.synced_at = None  # When the inputs were last read from the jobs table
+
+    @staticmethod
+    def priority(job):
+        due = job.due_date.timestamp() if job.due_date else math.inf
+        created = job.created_at.timestamp() if job.created_at else 0.0
+        return (due, created, job.job_id)
+
+    def build(self, jobs):
+        """Schedule every job from scratch; returns the ids of all placed jobs"""
+        self.inputs = {job.job_id: job for job in jobs}
+        self.keys = sorted(self.priority(job) for job in jobs)
+        self.placements = {}
+        self.checkpoints = []
+        return self._replay(0)
+
+    def update(self, changes):
+        """Move, add or remove jobs, given {job_id: JobInput or None to remove}
+
+        Returns the ids of jobs whose placement changed.
+        """
+        positions = []
+        for job_id, job in changes.items():
+            old = self.inputs.pop(job_id, None)
+            if old is not None:
+                index = bisect_left(self.keys, self.priority(old))
+                del self.keys[index]
+                positions.append(index)
+                self.placements.pop(job_id, None)
+            if job is not None:
+                key = self.priority(job)
+                self.inputs[job_id] = job
+                insort(self.keys, key)
+                positions.append(bisect_left(self.keys, key))
+        if not positions:
+            return set()
+        return self._replay(min(positions))
+
+    def _fresh_heaps(self):
+        return {stage: [0.0] * max(self.machines.get(stage.name, 1), 1) for stage in STAGES}
+
+    def _replay(self, start_index):
+        # checkpoints[k] holds the heaps just before job (k + 1) * CHECKPOINT_EVERY is placed
+        checkpoint = min(start_index // CHECKPOINT_EVERY, len(self.checkpoints))
+        if checkpoint:
+            heaps = {stage: list(heap) for stage, heap in self.checkpoints[checkpoint - 1].items()}
+            del self.checkpoints[checkpoint - 1:]
+        else:
+            heaps = self._fresh_heaps()
+            self.checkpoints = []
+
+        changed = set()
+        for index in range(checkpoint * CHECKPOINT_EVERY, len(self.keys)):
+            if index and index % CHECKPOINT_EVERY == 0:
+                self.checkpoints.append({stage: list(heap) for stage, heap in heaps.items()})
+            job = self.inputs[self.keys[index][2]]
+            placement = self._place(job, heaps)
+            if self.placements.get(job.job_id) != placement:
+                self.placements[job.job_id] = placement
+                changed.add(job.job_id)
+        return changed
+
+    def _place(self, job, heaps):
+        ready, start, stages = 0.0, None, []
+        for stage in REMAINING_STAGES.get(job.status, []):
+            hours = job.hours * self.split.get(stage.name, 0.0)
+            free = heapq.heappop(heaps[stage])
+            begin = max(free, ready)
+            ready = begin + hours
+            heapq.heappush(heaps[stage], ready)
+            stages.append((stage, begin, ready))
+            if start is None:
+                start = begin
+        return Placement(job.job_id, start or 0.0, ready, tuple(stages))
+
+    def dates(self, job_id):
+        """Proposed (start_date, completion_date) for a scheduled job"""
+        placement = self.placements[job_id]
+        return self.calendar.to_datetime(placement.start), self.calendar.to_datetime(placement.end)
+
+    def lateness_report(self):
+        """Every scheduled job with its projected completion, latest first"""
+        rows = []
+        for job_id, job in self.inputs.items():
+            start, end = self.dates(job_id)
+            late = (end - job.due_date).total_seconds() / 3600.0 if job.due_date else 0.0
+            rows.append(LatenessRow(job_id, job.job_number, job.due_date, start, end, max(late, 0.0)))
+        rows.sort(key=lambda row: (-row.late_hours, row.completion_date))
+        return rows
+
+def lateness_payload(schedule):
+    """Lateness report as a JSON-ready dict"""
+    rows = schedule.lateness_report()
+    late = [row for row in rows if row.late_hours > 0]
+    return {
+        'job_count': len(rows),
+        'late_count': len(late),
+        'total_late_hours': round(sum(row.late_hours for row in late), 2),
+        'jobs': [{
+            'id': row.job_id,
+            'job_number': row.job_number,
+            'due_date': row.due_date.isoformat() if row.due_date else None,
+            'start_date': row.start_date.isoformat(),
+            'completion_date': row.completion_date.isoformat(),
+            'late_hours': round(row.late_hours, 2),
+        } for row in rows]
+    }
+
+def _input_query():
+    return db.session.query(Job.id, Job.job_number, Job.status, Job.estimated_hours,
+                            Order.due_date, Job.created_at, Job.scheduled_manually) \
+        .outerjoin(Order, Job.order_id == Order.id)
+
+def _job_input(row):
+    id, number, status, hours, due, created, manual = row
+    hours = hours or current_app.config['SCHEDULE_DEFAULT_HOURS']
+    return JobInput(id, number, status, hours, due, created, bool(manual))
+
+def _job_inputs():
+    """Inputs of every open job"""
+    return [_job_input(row) for row in _input_query().filter(Job.status.in_(list(REMAINING_STAGES)))]
+
+def _changed_inputs(job_ids, updated_since):
+    """{job_id: JobInput, or None when it is no longer open} for the given jobs and for
+    jobs that were, or whose order was, updated at or after updated_since"""
+    query = _input_query().filter(or_(Job.id.in_(job_ids), Job.updated_at >= updated_since,
+                                      Order.updated_at >= updated_since))
+    inputs = dict.fromkeys(job_ids)
+    for row in query:
+        inputs[row[0]] = _job_input(row) if row[2] in REMAINING_STAGES else None
+    return inputs
+
+def new_schedule(anchor=None):
+    """Empty schedule using the configured workstations and calendar, anchored at the start of today"""
+    config = current_app.config
+    anchor = anchor or datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    calendar = WorkCalendar(anchor, config['SCHEDULE_DAY_START'], config['SCHEDULE_HOURS_PER_DAY'])
+    return Schedule(config['SCHEDULE_MACHINES'], config['SCHEDULE_STAGE_SPLIT'], calendar)
+
+def write_dates(schedule, job_ids):
+    """Store proposed dates for the given jobs, without committing
+
+    Jobs already in production keep their actual start_date; only their
+    completion_date is updated. Jobs scheduled by hand keep both dates.
+    """
+    rows = []
+    for job_id in job_ids:
+        if job_id not in schedule.inputs or schedule.inputs[job_id].manual:
+            continue
+        start, end = schedule.dates(job_id)
+        row = {'id': job_id, 'completion_date': end}
+        if schedule.inputs[job_id].status == JobStatus.PENDING:
+            row['start_date'] = start
+        rows.append(row)
+    pending = [row for row in rows if 'start_date' in row]
+    started = [row for row in rows if 'start_date' not in row]
+    for batch in (pending, started):
+        if batch:
+            db.session.execute(update(Job), batch)
+    return len(rows)
+
+# Schedule kept between tasks in this process and rebuilt daily; each
+# worker process keeps its own copy. Before a copy is updated it reads the
+# jobs changed since its last sync, and updates from all processes on the
+# host take SCHEDULE_LOCK_FILE, so a worker never writes dates from a
+# schedule that misses another worker's committed changes. Only tasks take
+# the lock; requests never wait for it.
+_current = None
+_lock = threading.Lock()
+
+@contextmanager
+def _schedule_lock():
+    """This process's schedule lock plus the host-wide lock file"""
+    with _lock, open(current_app.config['SCHEDULE_LOCK_FILE'], 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def _fresh(schedule):
+    return schedule is not None and schedule.calendar.first_day.date() >= \
+        WorkCalendar(datetime.utcnow(), schedule.calendar.day_start, schedule.calendar.hours_per_day).first_day.date()
+
+def _rebuild(apply):
+    global _current
+    schedule = new_schedule()
+    schedule.synced_at = datetime.utcnow()
+    schedule.build(_job_inputs())
+    if apply:
+        write_dates(schedule, schedule.inputs)
+        db.session.commit()
+    _current = schedule
+    return schedule
+
+def run_schedule(apply=True):
+    """Rebuild the schedule for all open jobs and optionally store the proposed dates"""
+    with _schedule_lock():
+        return _rebuild(apply)
+
+@task('run_schedule')
+def run_schedule_task():
+    """Rebuild and store the schedule in the background; returns the lateness totals"""
+    payload = lateness_payload(run_schedule(apply=True))
+    payload.pop('jobs')
+    return payload
+
+def get_schedule():
+    """Current schedule, rebuilt (without storing dates) if there is none for today"""
+    if _fresh(_current):
+        return _current
+    return run_schedule(apply=False)
+
+def reschedule_jobs(job_ids):
+    """Re-place changed jobs and store the dates of every job that moved; commits
+
+    job_ids are the jobs the caller changed (all jobs of an order when its
+    due date changes). Jobs and orders updated since this process's
+    schedule was last synced, such as through other workers, are applied
+    in the same pass. Without a schedule for today in this process the
+    whole schedule is rebuilt and stored. Returns the ids of moved jobs.
+    """
+    with _schedule_lock():
+        if not _fresh(_current):
+            return set(_rebuild(apply=True).inputs)
+        synced_at = datetime.utcnow()
+        inputs = _changed_inputs(job_ids, _current.synced_at - SYNC_OVERLAP)
+        changes = {job_id: job for job_id, job in inputs.items() if _current.inputs.get(job_id) != job}
+        changed = _current.update(changes)
+        _current.synced_at = synced_at
+        write_dates(_current, changed)
+        db.session.commit()
+        return changed
+
+def queue_reschedule(job_ids, then=None, user_id=None):
+    """Queue reschedule_jobs() for the given jobs in the caller's transaction; does not commit
+
+    then is an optional (task name, *args) queued once the jobs are placed,
+    with the sorted ids of the jobs that moved appended to its arguments.
+    """
+    return enqueue('reschedule_jobs', sorted(job_ids), list(then) if then else None, user_id=user_id)
+
+@task('reschedule_jobs')
+def reschedule_jobs_task(job_ids, then=None):
+    """reschedule_jobs() in the background; returns how many jobs moved"""
+    moved = reschedule_jobs(job_ids)
+    if then:
+        enqueue(then[0], *then[1:], sorted(moved))
+        db.session.commit()
+    return {'moved': len(moved)}
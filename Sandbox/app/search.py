@@ -0,0 +1,195 @@
+import re
+from collections import namedtuple
+from sqlalchemy import event, text, or_
+from app import db
+from app.models import Customer, Order, Job
+
+# Entity types stored in the index. Each indexed row is keyed by
+# doc_id = entity_id * TYPE_STRIDE + code, so updates and deletes hit
+# the primary key / rowid instead of scanning the index.
+ENTITY_TYPES = {
+    'customer': (0, Customer),
+    'order': (1, Order),
+    'job': (2, Job),
+}
+MODEL_TYPES = {model: name for name, (code, model) in ENTITY_TYPES.items()}
+TYPE_STRIDE = 4
+
+SearchHit = namedtuple('SearchHit', ['entity_type', 'entity_id', 'rank', 'item'])
+SearchPage = namedtuple('SearchPage', ['hits', 'page', 'per_page', 'has_next'])
+
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        entity_type UNINDEXED, entity_id UNINDEXED, title, body,
+        tokenize = 'unicode61')""",
+]
+
+POSTGRES_DDL = [
+    """CREATE TABLE IF NOT EXISTS search_index (
+        doc_id BIGINT PRIMARY KEY,
+        entity_type VARCHAR(20) NOT NULL,
+        entity_id INTEGER NOT NULL,
+        title TEXT,
+        body TEXT,
+        document TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(body, '')), 'B')
+        ) STORED)""",
+    "CREATE INDEX IF NOT EXISTS ix_search_index_document ON search_index USING GIN (document)",
+]
+
+_ready_engines = set()
+
+def _backend(connection):
+    """Return 'sqlite', 'postgresql' or None when full-text search is unavailable"""
+    name = connection.dialect.name
+    return name if name in ('sqlite', 'postgresql') else None
+
+def ensure_search_index(connection):
+    """Create the search index table for this database if needed"""
+    backend = _backend(connection)
+    if backend is None:
+        return False
+    key = str(connection.engine.url)
+    if key not in _ready_engines:
+        for ddl in SQLITE_DDL if backend == 'sqlite' else POSTGRES_DDL:
+            connection.execute(text(ddl))
+        _ready_engines.add(key)
+    return True
+
+def _doc_id(entity_type, entity_id):
+    return entity_id * TYPE_STRIDE + ENTITY_TYPES[entity_type][0]
+
+def _document(obj):
+    """Title and body text indexed for a Customer, Order or Job"""
+    if isinstance(obj, Customer):
+        return obj.name, ' '.join(filter(None, [obj.contact_person, obj.email]))
+    if isinstance(obj, Order):
+        return obj.order_number, obj.notes
+    return obj.job_number, obj.notes
+
+def _remove(connection, entity_type, entity_id):
+    column = 'rowid' if connection.dialect.name == 'sqlite' else 'doc_id'
+    connection.execute(text(f'DELETE FROM search_index WHERE {column} = :doc_id'),
+                       {'doc_id': _doc_id(entity_type, entity_id)})
+
+def _store(connection, obj):
+    entity_type = MODEL_TYPES[type(obj)]
+    title, body = _document(obj)
+    _remove(connection, entity_type, obj.id)
+    column = 'rowid' if connection.dialect.name == 'sqlite' else 'doc_id'
+    connection.execute(text(
+        f'INSERT INTO search_index ({column}, entity_type, entity_id, title, body) '
+        'VALUES (:doc_id, :entity_type, :entity_id, :title, :body)'
+    ), {
+        'doc_id': _doc_id(entity_type, obj.id),
+        'entity_type': entity_type,
+        'entity_id': obj.id,
+        'title': title or '',
+        'body': body or '',
+    })
+
+@event.listens_for(db.session, 'after_flush')
+def _sync_search_index(session, flush_context):
+    """Keep search_index in step with inserted, updated and deleted rows"""
+    changed = [obj for obj in list(session.new) + list(session.dirty) if type(obj) in MODEL_TYPES]
+    deleted = [obj for obj in session.deleted if type(obj) in MODEL_TYPES]
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    if not ensure_search_index(connection):
+        return
+    for obj in changed:
+        _store(connection, obj)
+    for obj in deleted:
+        _remove(connection, MODEL_TYPES[type(obj)], obj.id)
+
+def rebuild_search_index(batch_size=1000):
+    """Re-index every customer, order and job; returns the number of documents"""
+    connection = db.session.connection()
+    if not ensure_search_index(connection):
+        return 0
+    connection.execute(text('DELETE FROM search_index'))
+    total = 0
+    for entity_type, (code, model) in ENTITY_TYPES.items():
+        for obj in model.query.order_by(model.id).yield_per(batch_size):
+            _store(connection, obj)
+            total += 1
+    db.session.commit()
+    return total
+
+def _terms(query):
+    """Split user input into plain word tokens safe for FTS query syntax"""
+    return re.findall(r'\w+', query or '')
+
+def _ranked_ids(connection, terms, entity_types, limit, offset):
+    """Return (entity_type, entity_id, rank) rows, best match first"""
+    params = {'limit': limit, 'offset': offset}
+    type_names = ', '.join(f':type_{i}' for i in range(len(entity_types)))
+    params.update({f'type_{i}': name for i, name in enumerate(entity_types)})
+
+    if connection.dialect.name == 'sqlite':
+        params['match'] = ' '.join(f'"{term}"*' for term in terms)
+        sql = ('SELECT entity_type, entity_id, bm25(search_index, 0, 0, 10.0, 1.0) AS rank '
+               'FROM search_index WHERE search_index MATCH :match '
+               f'AND entity_type IN ({type_names}) '
+               'ORDER BY rank LIMIT :limit OFFSET :offset')
+    else:
+        params['match'] = ' & '.join(f'{term}:*' for term in terms)
+        sql = ("SELECT entity_type, entity_id, -ts_rank(document, to_tsquery('simple', :match)) AS rank "
+               "FROM search_index WHERE document @@ to_tsquery('simple', :match) "
+               f'AND entity_type IN ({type_names}) '
+               'ORDER BY rank LIMIT :limit OFFSET :offset')
+    return connection.execute(text(sql), params).fetchall()
+
+def _like_ranked_ids(terms, entity_types, limit, offset):
+    """Substring fallback for databases without a full-text backend"""
+    pattern = f"%{' '.join(terms)}%"
+    filters = {
+        'customer': lambda: Customer.query.filter(or_(
+            Customer.name.ilike(pattern), Customer.contact_person.ilike(pattern), Customer.email.ilike(pattern))),
+        'order': lambda: Order.query.filter(or_(Order.order_number.ilike(pattern), Order.notes.ilike(pattern))),
+        'job': lambda: Job.query.filter(or_(Job.job_number.ilike(pattern), Job.notes.ilike(pattern))),
+    }
+    rows = []
+    for entity_type in entity_types:
+        model = ENTITY_TYPES[entity_type][1]
+        ids = filters[entity_type]().with_entities(model.id).order_by(model.id.desc()).limit(offset + limit)
+        rows.extend((entity_type, entity_id, 0.0) for (entity_id,) in ids)
+    return rows[offset:offset + limit]
+
+def search(query, entity_types=None, page=1, per_page=20):
+    """Ranked, paginated search across customers, orders and jobs
+
+    Returns a SearchPage whose hits carry the loaded model instance. One
+    extra row is fetched to work out has_next without a COUNT query.
+    """
+    entity_types = [t for t in (entity_types or ENTITY_TYPES) if t in ENTITY_TYPES]
+    terms = _terms(query)
+    page = max(page, 1)
+    if not terms or not entity_types:
+        return SearchPage([], page, per_page, False)
+
+    offset = (page - 1) * per_page
+    connection = db.session.connection()
+    if ensure_search_index(connection):
+        rows = _ranked_ids(connection, terms, entity_types, per_page + 1, offset)
+    else:
+        rows = _like_ranked_ids(terms, entity_types, per_page + 1, offset)
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    # Load the matched rows with one query per entity type
+    ids_by_type = {}
+    for entity_type, entity_id, rank in rows:
+        ids_by_type.setdefault(entity_type, []).append(entity_id)
+    loaded = {}
+    for entity_type, ids in ids_by_type.items():
+        model = ENTITY_TYPES[entity_type][1]
+        for item in model.query.filter(model.id.in_(ids)):
+            loaded[(entity_type, item.id)] = item
+
+    hits = [SearchHit(entity_type, entity_id, rank, loaded[(entity_type, entity_id)])
+            for entity_type, entity_id, rank in rows if (entity_type, entity_id) in loaded]
+    return SearchPage(hits, page, per_page, has_next)
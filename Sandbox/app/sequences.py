@@ -0,0 +1,83 @@
+from datetime import datetime
+from sqlalchemy import update, select
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import DocumentSequence, Order, Job, Invoice
+
+# Document prefixes and the column whose values they number. The column is
+# only used to seed a day's counter from numbers issued before it existed.
+PREFIXES = {
+    'ORD': Order.order_number,
+    'QUO': Order.order_number,
+    'JOB': Job.job_number,
+    'INV': Invoice.invoice_number,
+}
+
+def format_number(prefix, day, value):
+    """Format a document number, e.g. ORD-20240131-007"""
+    return f'{prefix}-{day}-{value:03d}'
+
+def _existing_max(prefix, day):
+    """Highest number already issued for a prefix/day, from the documents themselves"""
+    column = PREFIXES[prefix]
+    highest = 0
+    pattern = f'{prefix}-{day}-%'
+    for (number,) in db.session.query(column).filter(column.like(pattern)):
+        suffix = number.rsplit('-', 1)[-1]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+def _increment(prefix, day, count):
+    """Atomically bump a counter row and return its new value, or None if missing"""
+    stmt = update(DocumentSequence).where(
+        DocumentSequence.prefix == prefix,
+        DocumentSequence.day == day
+    ).values(last_value=DocumentSequence.last_value + count)
+
+    if db.engine.dialect.update_returning:
+        return db.session.execute(stmt.returning(DocumentSequence.last_value)).scalar()
+
+    # The UPDATE holds the row (PostgreSQL) or database (SQLite) write lock
+    # until commit, so reading back inside the same transaction is safe.
+    if db.session.execute(stmt).rowcount == 0:
+        return None
+    return db.session.execute(select(DocumentSequence.last_value).where(
+        DocumentSequence.prefix == prefix,
+        DocumentSequence.day == day
+    )).scalar()
+
+def reserve_numbers(prefix, count, when=None):
+    """Reserve count consecutive document numbers for prefix on the given day
+
+    The counter is updated in the caller's transaction, so the numbers are
+    released again if that transaction rolls back, and concurrent callers
+    for the same prefix and day wait on the counter row instead of colliding
+    on the unique document number index.
+    """
+    if prefix not in PREFIXES:
+        raise ValueError(f'Unknown document prefix: {prefix}')
+    if count < 1:
+        raise ValueError('count must be at least 1')
+
+    day = (when or datetime.utcnow()).strftime('%Y%m%d')
+    last_value = _increment(prefix, day, count)
+
+    if last_value is None:
+        # First number of the day: create the counter, continuing from any
+        # numbers issued before the counter existed.
+        seed = _existing_max(prefix, day)
+        try:
+            with db.session.begin_nested():
+                db.session.add(DocumentSequence(prefix=prefix, day=day, last_value=seed + count))
+            last_value = seed + count
+        except IntegrityError:
+            # Another worker created the row first; take the next values from it
+            last_value = _increment(prefix, day, count)
+
+    first_value = last_value - count + 1
+    return [format_number(prefix, day, value) for value in range(first_value, last_value + 1)]
+
+def next_number(prefix, when=None):
+    """Allocate a single document number for prefix"""
+    return reserve_numbers(prefix, 1, when)[0]
@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app, url_for, g
+from sqlalchemy import update, event
+from app import db
+from app.models import Task
+
+# In-process background tasks. A task is a registered function taking
+# JSON-serialisable arguments; enqueue() adds a Task row to the caller's
+# transaction, and once that commits the id is handed to a thread pool,
+# where the function runs inside an app context and its return value (or
+# error) is written back to the row. A rolled back transaction takes its
+# tasks with it. Tasks that need
+# a lot of CPU call run_in_process() for the heavy part, which runs on a
+# process pool and so does not hold the GIL of the web worker.
+#
+# Rows are claimed with a conditional update, so a task runs once even
+# when several worker processes (or `flask run_tasks`) pick it up. Pools
+# are per process; each gunicorn worker keeps its own.
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+# Task name -> function, filled in by the @task decorator
+TASKS = {}
+
+def task(name):
+    """Register a function as a background task under name"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+_lock = threading.Lock()
+_pools = {'pid': None, 'threads': None, 'processes': None}
+
+def _pool(kind):
+    with _lock:
+        if _pools['pid'] != os.getpid():
+            # Pools do not survive a fork; start fresh ones in this process
+            _pools.update(pid=os.getpid(), threads=None, processes=None)
+        if _pools[kind] is None:
+            config = current_app.config
+            if kind == 'threads':
+                _pools[kind] = ThreadPoolExecutor(max_workers=config['TASK_THREADS'],
+                                                  thread_name_prefix='task')
+            else:
+                _pools[kind] = ProcessPoolExecutor(max_workers=config['TASK_PROCESSES'],
+                                                   mp_context=multiprocessing.get_context('spawn'))
+        return _pools[kind]
+
+def run_in_process(func, *args):
+    """Call a module-level function on the process pool and wait for its result
+
+    func must not use the app or the database; pass it plain data.
+    """
+    return _pool('processes').submit(func, *args).result()
+
+def map_in_process(func, items):
+    """Call func on each item across the process pool, yielding results in order"""
+    return _pool('processes').map(func, items)
+
+def enqueue(name, *args, user_id=None):
+    """Add a task to the session, to start in the background once it commits; does not commit"""
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name!r}')
+    record = Task(name=name, args=json.dumps(list(args)), user_id=user_id)
+    db.session.add(record)
+    db.session.flush()
+    db.session.info.setdefault('queued_tasks', []).append(record.id)
+    return record
+
+@event.listens_for(db.session, 'after_commit')
+def _start_queued(session):
+    """Hand tasks enqueued in the committed transaction to the thread pool"""
+    task_ids = session.info.pop('queued_tasks', None)
+    if task_ids:
+        app = current_app._get_current_object()
+        pool = _pool('threads')
+        for task_id in task_ids:
+            pool.submit(_run_in_context, app, task_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def _drop_queued(session):
+    session.info.pop('queued_tasks', None)
+
+def _run_in_context(app, task_id):
+    with app.app_context():
+        run_task(task_id)
+
+def _finish(task_id, status, result=None, error=None):
+    # Only a task still marked running is finished; one fail_stale() gave up on keeps that status
+    finished = db.session.execute(update(Task).where(Task.id == task_id, Task.status == 'running').values(
+        status=status, result=result, error=error, finished_at=datetime.utcnow())).rowcount
+    db.session.commit()
+    if not finished:
+        current_app.logger.warning('Task %s finished after it was marked failed; result dropped', task_id)
+
+def run_task(task_id):
+    """Claim a queued task and run it here; returns False if it was already taken"""
+    claimed = db.session.execute(
+        update(Task).where(Task.id == task_id, Task.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow())).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+    record = db.session.get(Task, task_id)
+    g.task_id = task_id
+    try:
+        func = TASKS[record.name]
+        result = func(*json.loads(record.args or '[]'))
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Task %s (%s) failed', task_id, record.name)
+        _finish(task_id, 'failed', error=f'{type(e).__name__}: {e}')
+    else:
+        _finish(task_id, 'done', result=json.dumps(result))
+    return True
+
+def result_path(filename, task_id=None):
+    """Where a task (by default the running one) writes a result file"""
+    task_id = task_id or g.task_id
+    folder = current_app.config['TASK_RESULT_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f'{task_id}-{os.path.basename(filename)}')
+
+def task_payload(record):
+    """Task state as a JSON-ready dict, with a download link for file results"""
+    result = json.loads(record.result) if record.result else None
+    payload = {
+        'id': record.id,
+        'name': record.name,
+        'status': record.status,
+        'created_at': record.created_at.isoformat(),
+        'started_at': record.started_at.isoformat() if record.started_at else None,
+        'finished_at': record.finished_at.isoformat() if record.finished_at else None,
+        'result': result,
+        'error': record.error,
+        'status_url': url_for('main.task_status', id=record.id),
+    }
+    if isinstance(result, dict) and result.get('file'):
+        payload['download_url'] = url_for('main.task_download', id=record.id)
+    return payload
+
+def run_pending(limit=None):
+    """Run queued tasks in this process, oldest first; returns how many ran here"""
+    query = db.session.query(Task.id).filter(Task.status == 'queued').order_by(Task.created_at)
+    if limit:
+        query = query.limit(limit)
+    return sum(run_task(task_id) for (task_id,) in query.all())
+
+def fail_stale(seconds):
+    """Mark tasks running for longer than seconds as failed, e.g. after a worker restart
+
+    A task that is in fact still running keeps the failed status when it
+    ends; its result is not stored.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=seconds)
+    count = db.session.execute(
+        update(Task).where(Task.status == 'running', Task.started_at < cutoff)
+        .values(status='failed', error='Interrupted', finished_at=datetime.utcnow())).rowcount
+    db.session.commit()
+    return count
+
+def purge_tasks(days):
+    """Delete finished tasks older than days, with their result files"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    old = Task.query.filter(Task.status.in_(['done', 'failed']), Task.finished_at < cutoff).all()
+    for record in old:
+        result = json.loads(record.result) if record.result else None
+        if isinstance(result, dict) and result.get('file'):
+            path = result_path(result['file'], record.id)
+            if os.path.exists(path):
+                os.remove(path)
+        db.session.delete(record)
+    db.session.commit()
+    return len(old)
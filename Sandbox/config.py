@@ -4,6 +4,15 @@ from dotenv import load_dotenv
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
+def _optional_float(name, default):
+    """Float from the environment; an empty value, 'off' or 'none' gives None"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    if value.strip().lower() in ('', 'off', 'none'):
+        return None
+    return float(value)
+
 class Config:
     """Application configuration settings"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
@@ -15,10 +24,72 @@ class Config:
     
     # File upload configuration
     UPLOAD_FOLDER = os.path.join(basedir, 'app/static/uploads')
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max upload size
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB max request body (form uploads and each upload chunk)
+    FILE_STORE_FOLDER = os.path.join(basedir, 'file_store')  # Job artwork, stored by SHA-256
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Chunk size suggested to resumable upload clients
+    UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024  # Largest file accepted through resumable uploads
+    UPLOAD_EXPIRE_HOURS = 48  # Unfinished uploads idle this long are discarded
+    FILE_ORPHAN_GRACE_HOURS = 24  # Stored files no job refers to are removed once untouched this long
+    FILE_ACCEL_REDIRECT = os.environ.get('FILE_ACCEL_REDIRECT')  # nginx internal location mapped to FILE_STORE_FOLDER
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') is not None  # Let Apache/lighttpd send files (X-Sendfile)
+    PREFLIGHT_THUMBNAIL_SIZE = 256  # Longest side of artwork thumbnails, in pixels
+    PREFLIGHT_MIN_DPI = 300  # Raster artwork below this resolution is flagged
+    PREFLIGHT_SIZE_TOLERANCE = 1.0  # mm of slack when comparing artwork to the job's trim size
+    
+    # Query instrumentation
+    SQL_INSTRUMENTATION = True  # Server-Timing header and a JSON log line per request
+    SQL_SLOW_QUERY_MS = _optional_float('SQL_SLOW_QUERY_MS', 500.0)  # Log statement and parameters of slower queries; 'off' disables
     
     # Pagination settings
     ITEMS_PER_PAGE = 20
+    PAGINATION_COUNT_TTL = 60  # Seconds to reuse a cursor-mode total count
+    CHOICES_TTL = 300  # Seconds a process reuses cached customer/product/material choices
+    REPORT_MAX_ROWS = 1000  # Rows listed in a report; totals always cover the full range
+    
+    # Imposition: press sheet catalog (width x height in mm) and allowances
+    SHEET_SIZES = {
+        'SRA3': (320.0, 450.0),
+        '12x18': (305.0, 457.0),
+        '13x19': (330.0, 483.0),
+        '19x25': (483.0, 635.0),
+        '23x35': (584.0, 889.0),
+        '25x38': (635.0, 965.0),
+    }
+    IMPOSITION_BLEED = 3.0  # Bleed added on every side of each piece
+    IMPOSITION_MARGIN = 5.0  # Unprintable gripper edge on every side of the sheet
+    
+    # Quote pricing
+    PRICING_SHEET_SIZE = (457.0, 305.0)  # Press sheet width x height in mm (18" x 12")
+    PRICING_PRESS_RATE = 85.0  # Press cost per hour
+    PRICING_PRESS_SPEED = 3000  # Impressions per hour
+    PRICING_SETUP_HOURS = 0.5  # Makeready time charged once per job
+    PRICING_MAKEREADY_SHEETS = 50  # Sheets wasted setting up the press
+    PRICING_SPOILAGE = 0.05  # Extra sheets as a fraction of the run
+    PRICING_INK_COST = 0.01  # Ink/toner cost per colour per sheet side
+    PRICING_MARKUP = 0.40  # Markup applied over cost
+    
+    # Finite-capacity scheduling
+    SCHEDULE_MACHINES = {'PREPRESS': 2, 'PRESS': 2, 'POSTPRESS': 1}  # Parallel workstations per stage
+    SCHEDULE_STAGE_SPLIT = {'PREPRESS': 0.2, 'PRESS': 0.5, 'POSTPRESS': 0.3}  # Share of estimated_hours per stage
+    SCHEDULE_DEFAULT_HOURS = 1.0  # Used for jobs without estimated_hours
+    SCHEDULE_DAY_START = 8  # Working day starts at this hour
+    SCHEDULE_HOURS_PER_DAY = 8  # Working hours per day (Monday to Friday)
+    SCHEDULE_LOCK_FILE = os.path.join(basedir, 'schedule.lock')  # Serialises schedule updates across worker processes
+    
+    # Due-date risk forecast
+    FORECAST_SAMPLES = 1000  # Monte Carlo draws per order; `flask forecast` recomputes the stored forecast
+    
+    # Background tasks
+    TASK_THREADS = 4  # Worker threads per process for queued tasks
+    TASK_PROCESSES = 2  # Processes for CPU-heavy task steps
+    TASK_RESULT_FOLDER = os.path.join(basedir, 'task_results')  # Files produced by tasks
+    TASK_STALE_AFTER = 3600  # Seconds before a running task is considered interrupted
+    TASK_KEEP_DAYS = 7  # Finished tasks and their files are purged after this many days
+    
+    # PDF documents
+    DOCUMENT_HEADER = ['PrintMIS', 'admin@printmis.com']  # Sender lines printed at the top of every PDF
+    PDF_CACHE_FOLDER = os.path.join(basedir, 'pdf_cache')  # Rendered PDFs, named by a hash of their content
+    PDF_INLINE_ZIP_MAX = 20  # Invoices a request may zip itself; larger months go to the task runner
     
     # Email configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
@@ -26,4 +97,5 @@ class Config:
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER') or 'noreply@printmis.com'
     ADMINS = ['admin@printmis.com']
@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 import os
+import click
 from app import create_app, db
 from app.models import User, Customer, Order, Job, Product, Material, Invoice
 from app.products import add_default_products
-from app.materials import add_default_materials
+from app.materials import add_default_materials, reorder_report
+from app.search import rebuild_search_index
+from app.balances import check_balances
+from app.exports import EXPORTS, FORMATS, stream_export
+from app.mrp import run_mrp, BUCKETS
+from app.scheduler import run_schedule
+from app.forecast import refresh as refresh_forecast
+from app.tasks import run_pending, fail_stale, purge_tasks
+from app.files import expire_uploads, sweep_blobs
 from flask_migrate import upgrade
 
 app = create_app()
@@ -49,8 +58,16 @@ def init_db():
     if add_default_materials():
         print("Default materials added!")
     
+    # Build the full-text search index
+    print(f"Search index built ({rebuild_search_index()} documents)")
+    
     print("Database initialization complete!")
 
+@app.cli.command("search_reindex")
+def search_reindex():
+    """Rebuild the full-text search index for customers, orders and jobs."""
+    print(f"Indexed {rebuild_search_index()} documents.")
+
 @app.cli.command("demo_data")
 def create_demo_data():
     """Create demo data for testing."""
@@ -122,5 +139,119 @@ def create_demo_data():
     else:
         print("Demo data already exists!")
 
+@app.cli.command("check_balances")
+@click.option('--fix', is_flag=True, help='Rewrite mismatched balances from the payments table.')
+def check_invoice_balances(fix):
+    """Verify invoice amount_paid/balance_due against recorded payments."""
+    mismatches = check_balances(fix=fix)
+    for m in mismatches:
+        print(f"{m.invoice_number}: paid {m.amount_paid:.2f} (expected {m.expected_paid:.2f}), "
+              f"balance {m.balance_due:.2f} (expected {m.expected_balance:.2f})")
+    if not mismatches:
+        print("All invoice balances are consistent.")
+    elif fix:
+        print(f"Fixed {len(mismatches)} invoice(s).")
+    else:
+        print(f"{len(mismatches)} invoice(s) out of sync. Run with --fix to repair.")
+
+@app.cli.command("reorder_report")
+@click.option('--days', default=30, show_default=True, help='Days of usage history to average.')
+@click.option('--horizon', default=14, show_default=True, help='Also list materials with less cover than this many days.')
+def print_reorder_report(days, horizon):
+    """List materials to reorder with projected days of cover."""
+    lines = reorder_report(days=days, horizon=horizon)
+    if not lines:
+        print("No materials need reordering.")
+        return
+    print(f"{'Material':<30} {'In stock':>12} {'Reorder at':>12} {'Per day':>10} {'Cover (days)':>13} {'Shortfall':>10}")
+    for line in lines:
+        cover = f"{line.days_of_cover:.1f}" if line.days_of_cover is not None else 'n/a'
+        print(f"{line.name[:30]:<30} {line.stock_level:>12.2f} {line.reorder_level:>12.2f} "
+              f"{line.daily_usage:>10.2f} {cover:>13} {line.shortfall:>10.2f}")
+
+@app.cli.command("mrp")
+@click.option('--bucket', type=click.Choice(BUCKETS), default='week', show_default=True,
+              help='Group demand by order due day or week.')
+@click.option('--all', 'show_all', is_flag=True, help='List every material with demand, not just shortages.')
+def mrp(bucket, show_all):
+    """Net paper demand of all open jobs against stock and report shortages."""
+    result = run_mrp(bucket=bucket)
+    print(f"{result.job_count} open job(s) as of {result.as_of}; "
+          f"{result.unmatched_jobs} with no matching paper material, "
+          f"{result.oversize_jobs} too large for any sheet.")
+    plans = result.materials if show_all else [p for p in result.materials if p.short_from or p.reorder_from]
+    if not plans:
+        print("No shortages.")
+        return
+    for plan in plans:
+        status = f"SHORT {plan.shortage:.0f} from {plan.short_from}" if plan.short_from else \
+            (f"below reorder from {plan.reorder_from}" if plan.reorder_from else "covered")
+        print(f"\n{plan.name} ({plan.unit}): stock {plan.stock_level:.0f}, reorder at {plan.reorder_level:.0f}, "
+              f"demand {plan.demand:.0f} - {status}")
+        for b in plan.buckets:
+            print(f"  {b.start}  demand {b.demand:>10.0f}  projected {b.projected:>10.0f}")
+
+@app.cli.command("schedule")
+@click.option('--dry-run', is_flag=True, help='Report lateness without storing proposed dates.')
+@click.option('--limit', default=20, show_default=True, help='Late jobs to list.')
+def schedule(dry_run, limit):
+    """Schedule open jobs against stage capacity and report projected lateness."""
+    rows = run_schedule(apply=not dry_run).lateness_report()
+    late = [row for row in rows if row.late_hours > 0]
+    print(f"Scheduled {len(rows)} open job(s); {len(late)} projected late."
+          + ("" if dry_run else " Proposed dates stored."))
+    for row in late[:limit]:
+        print(f"{row.job_number:<20} due {row.due_date:%Y-%m-%d %H:%M}  "
+              f"done {row.completion_date:%Y-%m-%d %H:%M}  late {row.late_hours:.1f} h")
+
+@app.cli.command("forecast")
+def forecast():
+    """Recompute and store the due-date risk of every open order; run from cron, e.g. every 15 minutes."""
+    risks = refresh_forecast()
+    at_risk = sum(1 for risk in risks.values() if risk.probability >= 0.5)
+    print(f"Forecast {len(risks)} open order(s); {at_risk} more likely late than not.")
+
+@app.cli.command("export")
+@click.argument('entity', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help='File to write (default: stdout).')
+@click.option('--status', default='all', help='Status filter, as in the list views.')
+@click.option('--start-date', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--end-date', type=click.DateTime(formats=['%Y-%m-%d']))
+@click.option('--customer-id', type=int, default=0)
+def export(entity, fmt, output, status, start_date, end_date, customer_id):
+    """Export orders, jobs, invoices or payments as CSV or XLSX."""
+    filters = {'status': status, 'start_date': start_date, 'end_date': end_date, 'customer_id': customer_id}
+    if output:
+        with open(output, 'wb') as f:
+            for chunk in stream_export(entity, fmt, filters):
+                f.write(chunk)
+        print(f"Exported {entity} to {output}")
+    else:
+        stream = click.get_binary_stream('stdout')
+        for chunk in stream_export(entity, fmt, filters):
+            stream.write(chunk)
+
+@app.cli.command("run_tasks")
+@click.option('--limit', default=0, help='Most queued tasks to run (0 for all).')
+def run_tasks(limit):
+    """Run queued background tasks here and clean up stale and old ones."""
+    stale = fail_stale(app.config['TASK_STALE_AFTER'])
+    if stale:
+        print(f"Marked {stale} interrupted task(s) as failed.")
+    print(f"Ran {run_pending(limit or None)} queued task(s).")
+    purged = purge_tasks(app.config['TASK_KEEP_DAYS'])
+    if purged:
+        print(f"Purged {purged} old task(s).")
+
+@app.cli.command("purge_uploads")
+@click.option('--hours', default=None, type=int, help='Idle hours before an unfinished upload is discarded.')
+def purge_uploads(hours):
+    """Discard idle unfinished uploads and stored files no job refers to."""
+    count = expire_uploads(hours or app.config['UPLOAD_EXPIRE_HOURS'])
+    print(f"Discarded {count} unfinished upload(s).")
+    count = sweep_blobs(app.config['FILE_ORPHAN_GRACE_HOURS'])
+    print(f"Removed {count} unreferenced stored file(s).")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,17 @@
+"""Add document_sequences table for ORD/QUO/JOB/INV number allocation
+
+Revision ID: add_document_sequences
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('document_sequences',
+        sa.Column('prefix', sa.String(length=10), nullable=False),
+        sa.Column('day', sa.String(length=8), nullable=False),
+        sa.Column('last_value', sa.Integer(), nullable=False, server_default='0'),
+        sa.PrimaryKeyConstraint('prefix', 'day')
+    )
+
+def downgrade():
+    op.drop_table('document_sequences')
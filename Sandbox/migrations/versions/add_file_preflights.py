@@ -0,0 +1,25 @@
+"""Add file_preflights for per-hash artwork checks and thumbnails
+
+Revision ID: add_file_preflights
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('file_preflights',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('file_type', sa.String(length=20), nullable=True),
+        sa.Column('pages', sa.Integer(), nullable=True),
+        sa.Column('width_mm', sa.Float(), nullable=True),
+        sa.Column('height_mm', sa.Float(), nullable=True),
+        sa.Column('dpi', sa.Float(), nullable=True),
+        sa.Column('color_space', sa.String(length=100), nullable=True),
+        sa.Column('has_thumbnail', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('checked_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256')
+    )
+
+def downgrade():
+    op.drop_table('file_preflights')
@@ -0,0 +1,28 @@
+"""Add maintained amount_paid and balance_due columns to invoices
+
+Revision ID: add_invoice_balances
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('invoices',
+        sa.Column('amount_paid', sa.Float(), nullable=False, server_default='0')
+    )
+    op.add_column('invoices',
+        sa.Column('balance_due', sa.Float(), nullable=False, server_default='0')
+    )
+    
+    # Backfill from existing payments
+    op.execute("""
+        UPDATE invoices SET amount_paid = COALESCE(
+            (SELECT SUM(amount) FROM payments WHERE payments.invoice_id = invoices.id), 0)
+    """)
+    op.execute("UPDATE invoices SET balance_due = COALESCE(total_amount, 0) - amount_paid")
+    
+    op.create_index('ix_invoices_status_balance_due', 'invoices', ['status', 'balance_due'])
+
+def downgrade():
+    op.drop_index('ix_invoices_status_balance_due', table_name='invoices')
+    op.drop_column('invoices', 'balance_due')
+    op.drop_column('invoices', 'amount_paid')
@@ -0,0 +1,41 @@
+"""Add job_files and file_uploads for content-addressed job artwork
+
+Revision ID: add_job_files
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('job_files',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('uploaded_at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_files_job_id', 'job_files', ['job_id'])
+    op.create_index('ix_job_files_sha256', 'job_files', ['sha256'])
+    
+    op.create_table('file_uploads',
+        sa.Column('id', sa.String(length=43), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('filename', sa.String(length=255), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+def downgrade():
+    op.drop_table('file_uploads')
+    op.drop_index('ix_job_files_sha256', table_name='job_files')
+    op.drop_index('ix_job_files_job_id', table_name='job_files')
+    op.drop_table('job_files')
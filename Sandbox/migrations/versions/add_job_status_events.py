@@ -0,0 +1,40 @@
+"""Add job_status_events table recording job status transitions
+
+Revision ID: add_job_status_events
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+JOB_STATUSES = ('PENDING', 'PREPRESS', 'PRESS', 'POSTPRESS', 'QUALITY_CHECK', 'COMPLETED')
+
+def upgrade():
+    # Reuse the jobstatus enum type created with the jobs table
+    job_status = postgresql.ENUM(*JOB_STATUSES, name='jobstatus', create_type=False)
+    op.create_table('job_status_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=False),
+        sa.Column('from_status', job_status, nullable=True),
+        sa.Column('to_status', job_status, nullable=False),
+        sa.Column('at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('note', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_status_events_job_id_at', 'job_status_events', ['job_id', 'at'])
+    op.create_index('ix_job_status_events_to_status_at', 'job_status_events', ['to_status', 'at'])
+    
+    # Seed one event per existing job with its current status; earlier
+    # history only exists as free text in jobs.notes
+    op.execute("""
+        INSERT INTO job_status_events (job_id, from_status, to_status, at)
+        SELECT id, NULL, COALESCE(status, 'PENDING'), COALESCE(updated_at, created_at, CURRENT_TIMESTAMP)
+        FROM jobs
+    """)
+
+def downgrade():
+    op.drop_index('ix_job_status_events_to_status_at', table_name='job_status_events')
+    op.drop_index('ix_job_status_events_job_id_at', table_name='job_status_events')
+    op.drop_table('job_status_events')
@@ -0,0 +1,18 @@
+"""Add jobs.scheduled_manually and index jobs/orders updated_at for schedule syncs
+
+Revision ID: add_jobs_scheduled_manually
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.add_column('jobs',
+        sa.Column('scheduled_manually', sa.Boolean(), nullable=False, server_default='0')
+    )
+    op.create_index('ix_jobs_updated_at', 'jobs', ['updated_at'])
+    op.create_index('ix_orders_updated_at', 'orders', ['updated_at'])
+
+def downgrade():
+    op.drop_index('ix_orders_updated_at', table_name='orders')
+    op.drop_index('ix_jobs_updated_at', table_name='jobs')
+    op.drop_column('jobs', 'scheduled_manually')
@@ -0,0 +1,11 @@
+"""Index jobs.start_date for date-range capacity queries
+
+Revision ID: add_jobs_start_date_index
+"""
+from alembic import op
+
+def upgrade():
+    op.create_index('ix_jobs_start_date', 'jobs', ['start_date'])
+
+def downgrade():
+    op.drop_index('ix_jobs_start_date', table_name='jobs')
@@ -0,0 +1,37 @@
+"""Add material_movements stock ledger
+
+Revision ID: add_material_movements
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('material_movements',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('material_id', sa.Integer(), nullable=False),
+        sa.Column('job_id', sa.Integer(), nullable=True),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('quantity', sa.Float(), nullable=False),
+        sa.Column('at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('note', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['material_id'], ['materials.id']),
+        sa.ForeignKeyConstraint(['job_id'], ['jobs.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_material_movements_material_id_at', 'material_movements', ['material_id', 'at'])
+    op.create_index('ix_material_movements_job_id_at', 'material_movements', ['job_id', 'at'])
+    
+    # Opening balance so each material's ledger sums to its current stock;
+    # create_material() records new materials' opening stock the same way
+    op.execute("""
+        INSERT INTO material_movements (material_id, kind, quantity, at, note)
+        SELECT id, 'adjustment', stock_level, CURRENT_TIMESTAMP, 'Opening stock'
+        FROM materials WHERE stock_level IS NOT NULL AND stock_level <> 0
+    """)
+
+def downgrade():
+    op.drop_index('ix_material_movements_job_id_at', table_name='material_movements')
+    op.drop_index('ix_material_movements_material_id_at', table_name='material_movements')
+    op.drop_table('material_movements')
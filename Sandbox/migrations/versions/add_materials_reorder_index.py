@@ -0,0 +1,14 @@
+"""Add expression index on materials stock level minus reorder level
+
+Revision ID: add_materials_reorder_index
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    # Same expression as Material.reorder_margin: a NULL level counts as zero
+    op.create_index('ix_materials_reorder_margin', 'materials',
+                    [sa.text('(coalesce(stock_level, 0) - coalesce(reorder_level, 0))')])
+
+def downgrade():
+    op.drop_index('ix_materials_reorder_margin', table_name='materials')
@@ -0,0 +1,21 @@
+"""Add order_forecasts for the stored due-date risk of open orders
+
+Revision ID: add_order_forecasts
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('order_forecasts',
+        sa.Column('order_id', sa.Integer(), nullable=False),
+        sa.Column('due_date', sa.DateTime(), nullable=True),
+        sa.Column('probability', sa.Float(), nullable=False),
+        sa.Column('p50', sa.DateTime(), nullable=False),
+        sa.Column('p90', sa.DateTime(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['order_id'], ['orders.id']),
+        sa.PrimaryKeyConstraint('order_id')
+    )
+
+def downgrade():
+    op.drop_table('order_forecasts')
@@ -0,0 +1,27 @@
+"""Add tasks table for background work
+
+Revision ID: add_tasks
+"""
+from alembic import op
+import sqlalchemy as sa
+
+def upgrade():
+    op.create_table('tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('args', sa.Text(), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_tasks_status_created_at', 'tasks', ['status', 'created_at'])
+
+def downgrade():
+    op.drop_index('ix_tasks_status_created_at', table_name='tasks')
+    op.drop_table('tasks')
@@ -0,0 +1,74 @@
+import pytest
+from flask.testing import FlaskClient
+from config import Config
+from app import create_app, db, tasks
+from app.models import User
+
+class RequestClient(FlaskClient):
+    """Test client that gives every request its own app context, g and session, as a server would"""
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            response = super().open(*args, **kwargs)
+        # Objects the test holds may have been changed by the request
+        db.session.expire_all()
+        return response
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App on a throwaway SQLite database, with every file folder under tmp_path"""
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        FILE_STORE_FOLDER = str(tmp_path / 'file_store')
+        TASK_RESULT_FOLDER = str(tmp_path / 'task_results')
+        PDF_CACHE_FOLDER = str(tmp_path / 'pdf_cache')
+        SCHEDULE_LOCK_FILE = str(tmp_path / 'schedule.lock')
+        SQL_SLOW_QUERY_MS = None
+
+    # Committed tasks stay queued; tests run the ones they care about with run_task()
+    monkeypatch.setattr(tasks, '_run_in_context', lambda app, task_id: None)
+    app = create_app(TestConfig)
+    app.test_client_class = RequestClient
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def user(app):
+    user = User(username='admin', email='admin@example.com', is_admin=True)
+    user.set_password('admin')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    """Test client logged in as an admin user"""
+    client = app.test_client()
+    response = client.post('/auth/login', data={'username': 'admin', 'password': 'admin'})
+    assert response.status_code == 302
+    return client
+
+@pytest.fixture
+def count_queries(app):
+    """Call count_queries(func, *args) to get (result, number of statements executed)"""
+    from sqlalchemy import event
+    statements = []
+
+    def record(*args):
+        statements.append(args[2])
+
+    def count_queries(func, *args, **kwargs):
+        del statements[:]
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return result, len(statements)
+    return count_queries
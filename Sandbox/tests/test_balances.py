@@ -0,0 +1,86 @@
+import pytest
+from app import db
+from app.balances import check_balances
+from app.models import Customer, Order, Invoice, Payment, InvoiceStatus
+
+def make_invoice(number, total):
+    customer = Customer(name=f'Customer {number}')
+    db.session.add(customer)
+    db.session.flush()
+    order = Order(order_number=f'ORD-{number}', customer_id=customer.id)
+    db.session.add(order)
+    db.session.flush()
+    invoice = Invoice(invoice_number=number, order_id=order.id, amount=total, total_amount=total)
+    db.session.add(invoice)
+    db.session.commit()
+    return invoice
+
+def assert_balances(invoice, paid):
+    db.session.refresh(invoice)
+    assert invoice.amount_paid == pytest.approx(paid)
+    assert invoice.balance_due == pytest.approx(invoice.total_amount - paid)
+
+def test_balances_follow_payment_changes(app):
+    first = make_invoice('INV-1', 500.0)
+    second = make_invoice('INV-2', 200.0)
+    assert_balances(first, 0)
+
+    payment = Payment(invoice_id=first.id, amount=150.0)
+    db.session.add_all([payment, Payment(invoice_id=first.id, amount=100.0)])
+    db.session.commit()
+    assert_balances(first, 250)
+
+    payment.amount = 175.0
+    db.session.commit()
+    assert_balances(first, 275)
+
+    # Moved to the other invoice
+    payment.invoice_id = second.id
+    db.session.commit()
+    assert_balances(first, 100)
+    assert_balances(second, 175)
+
+    # The total changes after payments were taken
+    first.total_amount = 400.0
+    db.session.commit()
+    assert_balances(first, 100)
+
+    db.session.delete(payment)
+    db.session.commit()
+    assert_balances(second, 0)
+    assert check_balances() == []
+
+def test_balance_is_current_right_after_flush(app):
+    invoice = make_invoice('INV-3', 300.0)
+    db.session.add(Payment(invoice_id=invoice.id, amount=120.0))
+    db.session.flush()
+    assert invoice.amount_paid == 120.0
+    db.session.rollback()
+    assert_balances(invoice, 0)
+    assert check_balances() == []
+
+def test_check_balances_repairs_bulk_changes(app):
+    invoice = make_invoice('INV-4', 100.0)
+    db.session.add(Payment(invoice_id=invoice.id, amount=40.0))
+    db.session.commit()
+    # Bulk deletes bypass the payment hooks
+    Payment.query.filter_by(invoice_id=invoice.id).delete()
+    db.session.commit()
+
+    mismatches = check_balances(fix=True)
+    assert [(m.invoice_id, m.expected_paid, m.expected_balance) for m in mismatches] == [(invoice.id, 0.0, 100.0)]
+    assert_balances(invoice, 0)
+    assert check_balances() == []
+
+def test_recording_payments_updates_balance_and_status(client):
+    invoice = make_invoice('INV-5', 100.0)
+    form = {'payment_date': '2024-05-01', 'payment_method': 'cash'}
+    response = client.post(f'/invoicing/{invoice.id}/payment', data=dict(form, amount='60'))
+    assert response.status_code == 302
+    assert_balances(invoice, 60)
+    assert invoice.status == InvoiceStatus.SENT
+
+    client.post(f'/invoicing/{invoice.id}/payment', data=dict(form, amount='40'))
+    assert_balances(invoice, 100)
+    assert invoice.status == InvoiceStatus.PAID
+    assert check_balances() == []
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+from app import db
+from app.board import ACTIVE_STATUSES, get_production_board, load_production_board
+from app.models import Customer, Order, Job, Product, JobStatus
+
+def add_jobs():
+    customer = Customer(name='Board Co')
+    product = Product(name='Leaflet')
+    db.session.add_all([customer, product])
+    db.session.flush()
+    order = Order(order_number='ORD-1', customer_id=customer.id)
+    db.session.add(order)
+    db.session.flush()
+    start = datetime(2024, 4, 1)
+    for i, status in enumerate([JobStatus.PRESS, JobStatus.PENDING, JobStatus.PRESS,
+                                JobStatus.COMPLETED, JobStatus.QUALITY_CHECK]):
+        db.session.add(Job(job_number=f'JOB-{i}', order_id=order.id, product_id=product.id,
+                           status=status, start_date=start - timedelta(days=i)))
+    db.session.commit()
+
+def test_active_jobs_grouped_by_status_in_start_order(app):
+    add_jobs()
+    board = load_production_board()
+    assert list(board.columns) == ACTIVE_STATUSES
+    assert [job.job_number for job in board.jobs(JobStatus.PRESS)] == ['JOB-2', 'JOB-0']
+    assert board.counts() == {JobStatus.PENDING: 1, JobStatus.PREPRESS: 0, JobStatus.PRESS: 2,
+                              JobStatus.POSTPRESS: 0, JobStatus.QUALITY_CHECK: 1}
+    assert board.jobs(JobStatus.COMPLETED) == []
+    assert set(board.as_schedule()) == {'pending', 'prepress', 'press', 'postpress', 'quality_check'}
+
+def test_board_and_relations_load_in_one_query(app, count_queries):
+    add_jobs()
+    db.session.expire_all()
+
+    def read_board():
+        board = load_production_board()
+        return [(job.order.customer.name, job.product.name) for jobs in board.columns.values() for job in jobs]
+    names, queries = count_queries(read_board)
+    assert len(names) == 4
+    assert queries == 1
+
+def test_board_is_loaded_once_per_request(app, count_queries):
+    add_jobs()
+    with app.app_context():
+        first, queries = count_queries(get_production_board)
+        assert queries == 1
+        second, queries = count_queries(get_production_board)
+        assert second is first and queries == 0
+    with app.app_context():
+        assert get_production_board() is not first
+
+def test_dashboard_lists_active_jobs(client):
+    add_jobs()
+    html = client.get('/production/').get_data(as_text=True)
+    assert 'JOB-0' in html and 'JOB-4' in html
+    assert 'JOB-3' not in html
@@ -0,0 +1,64 @@
+from datetime import date, datetime
+import random
+import pytest
+from app import db
+from app.capacity import capacity_heatmap
+from app.models import Job, JobStatus
+
+MONDAY = date(2024, 7, 1)
+
+def add_job(status, hours, start, end):
+    job = Job(status=status, estimated_hours=hours, start_date=start, completion_date=end)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def stage_hours(heatmap, stage):
+    return heatmap['hours'][heatmap['stages'].index(stage)]
+
+def test_window_is_split_between_stages_in_order(app):
+    add_job(JobStatus.PENDING, 10.0, datetime(2024, 7, 1, 9), datetime(2024, 7, 5, 16))
+    heatmap = capacity_heatmap(MONDAY, date(2024, 7, 7))
+    assert stage_hours(heatmap, 'prepress') == [2.0, 0, 0, 0, 0, 0, 0]
+    assert stage_hours(heatmap, 'press') == [0, 1.67, 1.67, 1.67, 0, 0, 0]
+    assert stage_hours(heatmap, 'postpress') == [0, 0, 0, 1.5, 1.5, 0, 0]
+    assert heatmap['total'][:5] == [2.0, 1.67, 1.67, 3.17, 1.5]
+    assert heatmap['capacity']['postpress'] == [8.0] * 5 + [0.0] * 2
+
+def test_only_remaining_stages_are_booked(app):
+    add_job(JobStatus.PRESS, 10.0, datetime(2024, 7, 1), datetime(2024, 7, 5))
+    add_job(JobStatus.COMPLETED, 10.0, datetime(2024, 7, 1), datetime(2024, 7, 5))
+    add_job(JobStatus.PENDING, 10.0, None, None)
+    heatmap = capacity_heatmap(MONDAY, date(2024, 7, 5))
+    assert sum(stage_hours(heatmap, 'prepress')) == 0
+    assert sum(heatmap['total']) == pytest.approx(8.0, abs=0.05)
+
+def test_weekends_are_skipped_unless_a_stage_falls_on_one(app):
+    # Friday to Monday: the press share on Saturday and Sunday moves to the working days
+    add_job(JobStatus.PRESS, 10.0, datetime(2024, 7, 5), datetime(2024, 7, 8))
+    # Saturday and Sunday only: booked on the weekend
+    add_job(JobStatus.POSTPRESS, 10.0, datetime(2024, 7, 13), datetime(2024, 7, 14))
+    heatmap = capacity_heatmap(date(2024, 7, 5), date(2024, 7, 14))
+    assert stage_hours(heatmap, 'press')[:4] == [5.0, 0, 0, 0]
+    assert stage_hours(heatmap, 'postpress')[:4] == [0, 0, 0, 3.0]
+    assert stage_hours(heatmap, 'postpress')[8:] == [0, 3.0]
+
+def test_hours_are_conserved_and_clipped_to_the_range(app):
+    rng = random.Random(7)
+    total = 0.0
+    for _ in range(40):
+        start = datetime(2024, 7, 1 + rng.randint(0, 20))
+        end = datetime(2024, 7, start.day + rng.randint(0, 9))
+        hours = rng.choice([1.0, 2.5, 8.0, 20.0])
+        add_job(JobStatus.PENDING, hours, start, end)
+        total += hours
+    heatmap = capacity_heatmap(date(2024, 6, 1), date(2024, 8, 31))
+    assert sum(heatmap['total']) == pytest.approx(total, abs=0.5)
+    assert sum(capacity_heatmap(date(2024, 7, 1), date(2024, 7, 10))['total']) < total
+
+def test_capacity_route(client):
+    add_job(JobStatus.PENDING, 10.0, datetime(2024, 7, 1), datetime(2024, 7, 5))
+    payload = client.get('/production/capacity?start=2024-07-01&end=2024-07-07').get_json()
+    assert payload['days'] == 7 and payload['start'] == '2024-07-01'
+    for query in ('start=2024-07-07&end=2024-07-01', 'start=2024-01-01&end=2025-12-31', 'start=July'):
+        assert client.get(f'/production/capacity?{query}').status_code == 400
@@ -0,0 +1,70 @@
+import pytest
+from app import db
+from app.choices import autocomplete, get_choices, invalidate
+from app.materials import consume_material
+from app.models import Customer, Material
+
+@pytest.fixture(autouse=True)
+def empty_cache(app):
+    invalidate()
+    yield
+    invalidate()
+
+@pytest.fixture
+def customers(app):
+    names = ['The Acme Company', 'Acme Print', 'Bolt Ltd', 'acme works']
+    db.session.add_all(Customer(name=name) for name in names)
+    db.session.commit()
+
+def test_choices_are_sorted_and_cached(customers, count_queries):
+    choices, queries = count_queries(get_choices, 'customer')
+    assert [label for id, label in choices] == ['Acme Print', 'Bolt Ltd', 'The Acme Company', 'acme works']
+    assert queries == 1
+    assert count_queries(get_choices, 'customer') == (choices, 0)
+
+def test_material_labels_leave_out_stock(app, count_queries):
+    paper = Material(name='Silk 350gsm', unit='sheets', stock_level=500)
+    db.session.add_all([paper, Material(name='Ink')])
+    db.session.commit()
+    assert get_choices('material') == [(2, 'Ink'), (paper.id, 'Silk 350gsm (sheets)')]
+
+    # Using stock does not touch the cached labels
+    consume_material(paper.id, 20)
+    db.session.commit()
+    assert count_queries(get_choices, 'material')[1] == 0
+
+def test_committed_changes_reload_their_kind(customers, count_queries):
+    get_choices('customer')
+    get_choices('product')
+    customer = Customer.query.filter_by(name='Bolt Ltd').first()
+    customer.name = 'Bolt & Co'
+    db.session.flush()
+    # Not yet committed: other threads keep the committed names
+    assert 'Bolt Ltd' in dict(get_choices('customer')).values()
+    db.session.commit()
+    assert 'Bolt & Co' in dict(get_choices('customer')).values()
+    assert count_queries(get_choices, 'product')[1] == 0
+
+def test_rolled_back_changes_keep_the_cache(customers, count_queries):
+    get_choices('customer')
+    db.session.add(Customer(name='Zed'))
+    db.session.flush()
+    db.session.rollback()
+    assert count_queries(get_choices, 'customer')[1] == 0
+
+def test_cache_expires(app, customers, count_queries):
+    get_choices('customer')
+    app.config['CHOICES_TTL'] = -1
+    assert count_queries(get_choices, 'customer')[1] == 1
+
+def test_autocomplete_prefers_name_prefixes(customers):
+    assert [text for id, text in autocomplete('customer', 'ACME')] == \
+        ['Acme Print', 'acme works', 'The Acme Company']
+    assert [text for id, text in autocomplete('customer', 'acme', limit=1)] == ['Acme Print']
+    assert autocomplete('customer', '  ') == []
+    assert autocomplete('customer', 'acme  wo')[0][1] == 'acme works'
+
+def test_autocomplete_endpoint(client, customers):
+    assert client.get('/autocomplete/customer?q=bolt').get_json() == [{'id': 3, 'text': 'Bolt Ltd'}]
+    assert len(client.get('/autocomplete/customer?q=a&limit=500').get_json()) == 3
+    assert client.get('/autocomplete/invoice?q=a').status_code == 404
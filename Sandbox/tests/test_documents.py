@@ -0,0 +1,85 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+import pytest
+from app import db, documents
+from app.documents import cache_path, invoice_documents, invoice_pdf
+from app.models import Customer, Invoice, Order
+from app.tasks import run_task
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Render in this process and count the documents rendered"""
+    rendered = []
+    render = documents.RENDERERS['invoice']
+    monkeypatch.setitem(documents.RENDERERS, 'invoice', lambda data: rendered.append(data['number']) or render(data))
+    monkeypatch.setattr(documents, 'map_in_process', lambda func, items: map(func, items))
+    return rendered
+
+def add_invoices(count, created_at=datetime(2024, 7, 10)):
+    customer = Customer(name='Acme', city='Leeds')
+    db.session.add(customer)
+    db.session.flush()
+    order = Order(order_number='ORD-1', customer_id=customer.id)
+    db.session.add(order)
+    db.session.flush()
+    invoices = [Invoice(invoice_number=f'INV-{i + 1}', order_id=order.id, created_at=created_at,
+                        amount=100.0 * (i + 1), total_amount=100.0 * (i + 1), balance_due=100.0 * (i + 1))
+                for i in range(count)]
+    db.session.add_all(invoices)
+    db.session.commit()
+    return invoices
+
+def test_cache_lookup_does_not_create_folders(app):
+    data = {'number': 'INV-1'}
+    path = cache_path('invoice', data)
+    assert path == cache_path('invoice', {'number': 'INV-1'})
+    assert path != cache_path('invoice', {'number': 'INV-2'})
+    assert not os.path.exists(app.config['PDF_CACHE_FOLDER'])
+
+def test_pdfs_are_cached_until_their_content_changes(app, renders):
+    invoice, = add_invoices(1)
+    path = invoice_pdf(invoice)
+    assert open(path, 'rb').read(5) == b'%PDF-'
+    assert invoice_pdf(invoice) == path
+    assert renders == ['INV-1']
+
+    invoice.notes = 'Thank you'
+    db.session.commit()
+    assert invoice_pdf(invoice) != path
+    assert renders == ['INV-1', 'INV-1']
+
+def test_invoice_documents(app):
+    invoice, = add_invoices(1)
+    data, = invoice_documents([invoice])
+    assert data['order_number'] == 'ORD-1'
+    assert data['customer'] == {'name': 'Acme', 'lines': ['Leeds']}
+    assert data['total'] == 100.0
+
+def test_small_month_is_zipped_in_the_request(client, renders):
+    invoices = add_invoices(3)
+    db.session.add(Invoice(invoice_number='INV-JUNE', order_id=invoices[0].order_id, created_at=datetime(2024, 6, 30)))
+    db.session.commit()
+    response = client.get('/invoicing/pdf/2024/7')
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.namelist() == ['INV-1.pdf', 'INV-2.pdf', 'INV-3.pdf']
+    assert client.get('/invoicing/pdf/2024/13').status_code == 404
+
+def test_large_month_goes_to_the_task_runner(client, renders, monkeypatch):
+    add_invoices(3)
+    client.application.config['PDF_INLINE_ZIP_MAX'] = 2
+    # Deciding must not build (or render) any document
+    monkeypatch.setattr(documents, 'invoice_documents', lambda invoices: pytest.fail('documents built'))
+    response = client.get('/invoicing/pdf/2024/7')
+    assert response.status_code == 202
+    assert renders == []
+
+    monkeypatch.undo()
+    monkeypatch.setattr(documents, 'map_in_process', lambda func, items: map(func, items))
+    run_task(response.get_json()['id'])
+    payload = client.get(response.get_json()['status_url']).get_json()
+    assert payload['status'] == 'done'
+    archive = zipfile.ZipFile(io.BytesIO(client.get(payload['download_url']).data))
+    assert len(archive.namelist()) == 3
@@ -0,0 +1,80 @@
+import hashlib
+import io
+import os
+import pytest
+from werkzeug.datastructures import FileStorage
+from app import db
+from app.files import blob_path, save_upload
+from app.models import Job
+
+CONTENT = b'%PDF-1.4\n' + b'x' * 1000
+
+def add_job():
+    job = Job(job_number=f'JOB-{Job.query.count() + 1}')
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+@pytest.fixture
+def job_file(client):
+    job = add_job()
+    job_file = save_upload(job, FileStorage(io.BytesIO(CONTENT), filename='proof.pdf'))
+    db.session.commit()
+    return job_file
+
+def url_for_file(job_file):
+    return f'/orders/jobs/{job_file.job_id}/files/{job_file.id}'
+
+def test_full_download_has_etag_and_private_caching(client, job_file):
+    response = client.get(url_for_file(job_file))
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.get_etag()[0] == hashlib.sha256(CONTENT).hexdigest()
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert 'private' in response.headers['Cache-Control']
+    assert 'public' not in response.headers['Cache-Control']
+    assert 'attachment' in response.headers['Content-Disposition']
+
+def test_range_request_gets_partial_content(client, job_file):
+    response = client.get(url_for_file(job_file), headers={'Range': 'bytes=0-8'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[:9]
+    assert response.headers['Content-Range'] == f'bytes 0-8/{len(CONTENT)}'
+
+    response = client.get(url_for_file(job_file), headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[-10:]
+
+def test_unsatisfiable_range_gets_416(client, job_file):
+    response = client.get(url_for_file(job_file), headers={'Range': f'bytes={len(CONTENT)}-'})
+    assert response.status_code == 416
+
+def test_matching_etag_gets_304(client, job_file):
+    etag = hashlib.sha256(CONTENT).hexdigest()
+    response = client.get(url_for_file(job_file), headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    response = client.get(url_for_file(job_file), headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+def test_accel_redirect_leaves_body_to_nginx(app, client, job_file):
+    app.config['FILE_ACCEL_REDIRECT'] = '/protected/'
+    response = client.get(url_for_file(job_file))
+    assert response.status_code == 200
+    assert response.data == b''
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    assert response.headers['X-Accel-Redirect'] == \
+        f'/protected/objects/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+    assert response.get_etag()[0] == sha256
+
+def test_file_of_another_job_is_not_found(client, job_file):
+    other = add_job()
+    assert client.get(f'/orders/jobs/{other.id}/files/{job_file.id}').status_code == 404
+
+def test_inline_download_and_missing_content(client, job_file):
+    response = client.get(url_for_file(job_file) + '?inline=1')
+    assert response.headers['Content-Disposition'].startswith('inline')
+    assert response.mimetype == 'application/pdf'
+    os.remove(blob_path(job_file.sha256))
+    assert client.get(url_for_file(job_file)).status_code == 404
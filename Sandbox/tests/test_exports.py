@@ -0,0 +1,112 @@
+import csv
+import io
+import zipfile
+from xml.etree import ElementTree
+import pytest
+from app import db, exports
+from app.exports import stream_csv, stream_xlsx
+from app.models import (Customer, Order, Job, Invoice, Payment, Task, OrderStatus, JobStatus,
+                        InvoiceStatus)
+from app.tasks import run_task
+
+EXPORT_URLS = {
+    'orders': '/orders/export/csv',
+    'jobs': '/production/export/csv',
+    'invoices': '/invoicing/export/csv',
+    'payments': '/invoicing/payments/export/csv',
+}
+
+@pytest.fixture
+def data(app):
+    customer = Customer(name='Export & Sons')
+    db.session.add(customer)
+    db.session.flush()
+    for i, (order_status, job_status, invoice_status) in enumerate([
+            (OrderStatus.APPROVED, JobStatus.PENDING, InvoiceStatus.SENT),
+            (OrderStatus.APPROVED, JobStatus.PRESS, InvoiceStatus.PAID)]):
+        order = Order(order_number=f'ORD-{i}', customer_id=customer.id, status=order_status, notes='a, "quoted" note')
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(Job(job_number=f'JOB-{i}', order_id=order.id, status=job_status, quantity=100))
+        invoice = Invoice(invoice_number=f'INV-{i}', order_id=order.id, total_amount=100.0, status=invoice_status)
+        db.session.add(invoice)
+        db.session.flush()
+        db.session.add(Payment(invoice_id=invoice.id, amount=25.0 * (i + 1), payment_method='cash'))
+    db.session.commit()
+
+def rows(response):
+    return list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+@pytest.mark.parametrize('name', ['orders', 'jobs', 'invoices'])
+@pytest.mark.parametrize('status', ['bogus', 'sent', 'PENDING; DROP TABLE jobs'])
+def test_unknown_status_is_rejected(client, data, name, status):
+    response = client.get(EXPORT_URLS[name], query_string={'status': status})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('name', ['orders', 'jobs', 'invoices', 'payments'])
+def test_malformed_date_is_rejected(client, data, name):
+    response = client.get(EXPORT_URLS[name], query_string={'start_date': '31/01/2024'})
+    assert response.status_code == 400
+
+def test_unknown_status_is_rejected_before_queueing(client, data):
+    response = client.get(EXPORT_URLS['orders'], query_string={'status': 'bogus', 'background': 1})
+    assert response.status_code == 400
+    assert Task.query.count() == 0
+
+@pytest.mark.parametrize('name, status, expected', [
+    ('orders', 'APPROVED', 2),
+    ('orders', 'CANCELLED', 0),
+    ('jobs', 'pending', 1),
+    ('jobs', 'in_progress', 1),
+    ('invoices', 'PAID', 1),
+    ('invoices', 'all', 2),
+])
+def test_known_status_filters_rows(client, data, name, status, expected):
+    response = client.get(EXPORT_URLS[name], query_string={'status': status})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    header, *body = rows(response)
+    assert header[0].endswith('Number')
+    assert len(body) == expected
+
+def test_payments_ignore_status(client, data):
+    response = client.get(EXPORT_URLS['payments'], query_string={'status': 'anything'})
+    assert response.status_code == 200
+    assert [row[3] for row in rows(response)[1:]] == ['25.0', '50.0']
+
+def test_unknown_format_is_not_found(client, data):
+    assert client.get('/orders/export/pdf').status_code == 404
+
+def test_csv_is_streamed_in_batches(data, monkeypatch):
+    monkeypatch.setattr(exports, 'BATCH_SIZE', 1)
+    chunks = list(stream_csv('orders'))
+    assert len(chunks) == 3
+    header, *body = list(csv.reader(io.StringIO(''.join(chunks))))
+    assert header == exports.EXPORTS['orders'][0]
+    assert body[0][:3] == ['ORD-0', 'Export & Sons', 'Approved']
+    assert body[0][6] == 'a, "quoted" note'
+
+def test_xlsx_is_a_readable_workbook(data, monkeypatch):
+    monkeypatch.setattr(exports, 'BATCH_SIZE', 1)
+    chunks = list(stream_xlsx('invoices'))
+    assert len(chunks) > 2
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as workbook:
+        assert workbook.testzip() is None
+        sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+    cells = [[''.join(cell.itertext()) for cell in row] for row in sheet.iterfind('.//s:row', ns)]
+    assert cells[0][0] == 'Invoice Number'
+    assert cells[1][:3] == ['INV-0', 'ORD-0', 'Export & Sons']
+    assert len(cells) == 3
+
+def test_background_export_writes_a_downloadable_file(client, data):
+    response = client.get('/orders/export/csv', query_string={'status': 'APPROVED', 'background': 1})
+    assert response.status_code == 202
+    task_id = response.get_json()['id']
+    assert run_task(task_id)
+
+    status = client.get(f'/tasks/{task_id}').get_json()
+    assert status['status'] == 'done'
+    download = client.get(status['download_url'])
+    assert download.status_code == 200
+    assert len(rows(download)) == 3
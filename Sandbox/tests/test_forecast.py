@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+import pytest
+from app import db, scheduler
+from app.forecast import OverrunModel, get_order_risks, job_completed, refresh, simulate
+from app.models import Customer, Job, JobStatus, Order, OrderForecast, OrderStatus, Product
+from app.scheduler import get_schedule
+
+@pytest.fixture(autouse=True)
+def no_schedule(monkeypatch):
+    monkeypatch.setattr(scheduler, '_current', None)
+
+def add_order(due_date, *hours, status=OrderStatus.APPROVED, product=None):
+    customer = Customer(name='Acme')
+    db.session.add(customer)
+    db.session.flush()
+    order = Order(customer_id=customer.id, status=status, due_date=due_date)
+    db.session.add(order)
+    db.session.flush()
+    db.session.add_all(Job(order_id=order.id, estimated_hours=h, product_id=product and product.id) for h in hours)
+    db.session.commit()
+    return order
+
+def constant_model(ratio):
+    model = OverrunModel()
+    for _ in range(5):
+        model.add(None, 1.0, ratio)
+    return model
+
+def test_only_work_hours_are_stretched(app):
+    due = datetime.utcnow() + timedelta(days=30)
+    first, second = add_order(due, 10.0), add_order(due + timedelta(days=1), 10.0)
+    schedule = get_schedule()
+    job = second.jobs.first()
+    placement = schedule.placements[job.id]
+    # The second job waits for the only postpress workstation
+    assert placement.end - placement.start > 10.0
+
+    risks = simulate(constant_model(2.0), schedule, samples=20, seed=1)
+    assert risks[second.id].p50 == schedule.calendar.to_datetime(placement.end + 10.0)
+    assert risks[second.id].p90 == risks[second.id].p50
+    # On time to plan, the finish is the scheduled one
+    assert simulate(constant_model(1.0), schedule, samples=20)[first.id].p50 == schedule.dates(
+        first.jobs.first().id)[1]
+
+def test_probability_of_missing_the_due_date(app):
+    now = datetime.utcnow()
+    late, safe = add_order(now - timedelta(days=1), 4.0), add_order(now + timedelta(days=60), 4.0)
+    risks = simulate(constant_model(1.0), get_schedule(), samples=50, seed=3)
+    assert risks[late.id].probability == 1.0
+    assert risks[safe.id].probability == 0.0
+
+def test_refresh_stores_open_dated_orders(app):
+    now = datetime.utcnow()
+    open_order = add_order(now + timedelta(days=3), 2.0)
+    undated = add_order(None, 2.0)
+    cancelled = add_order(now + timedelta(days=3), 2.0, status=OrderStatus.CANCELLED)
+    refresh()
+    stored = get_order_risks([open_order.id, undated.id, cancelled.id])
+    assert set(stored) == {open_order.id}
+    assert stored[open_order.id].due_date == open_order.due_date
+    assert get_order_risks([]) == {}
+
+    # A full refresh drops orders that are no longer open
+    open_order.status = OrderStatus.CANCELLED
+    db.session.commit()
+    refresh()
+    assert OrderForecast.query.count() == 0
+
+def test_job_completed_refreshes_affected_orders(app):
+    now = datetime.utcnow()
+    cards, posters = Product(name='Cards'), Product(name='Posters')
+    db.session.add_all([cards, posters])
+    db.session.commit()
+    done = add_order(now + timedelta(days=5), 4.0, 4.0, product=cards)
+    same_product = add_order(now + timedelta(days=5), 4.0, product=cards)
+    other = add_order(now + timedelta(days=5), 4.0, product=posters)
+    refresh()
+    stale = datetime(2000, 1, 1)
+    db.session.execute(OrderForecast.__table__.update().values(computed_at=stale))
+    db.session.commit()
+
+    job = done.jobs.first()
+    job.status, job.actual_hours = JobStatus.COMPLETED, 8.0
+    db.session.commit()
+    job_completed(job)
+    computed = {row.order_id: row.computed_at for row in OrderForecast.query}
+    assert computed[done.id] != stale and computed[same_product.id] != stale
+    assert computed[other.id] == stale
+
+def test_order_list_shows_stored_risk(client):
+    order = add_order(datetime.utcnow() - timedelta(days=2), 4.0)
+    refresh()
+    assert '100% late risk' in client.get('/orders/').get_data(as_text=True)
+    db.session.delete(OrderForecast.query.get(order.id))
+    db.session.commit()
+    assert 'late risk' not in client.get('/orders/').get_data(as_text=True)
@@ -0,0 +1,54 @@
+import math
+import pytest
+from app.imposition import best_plan, layout, layout_cache_info, parse_colors, sheets_needed
+
+def grid(piece_w, piece_h, sheet_w, sheet_h):
+    """Pieces up in a plain grid, the better of the two orientations"""
+    return max(math.floor(sheet_w / piece_w) * math.floor(sheet_h / piece_h),
+               math.floor(sheet_w / piece_h) * math.floor(sheet_h / piece_w))
+
+def test_layout_adds_a_rotated_strip(app):
+    # 96 x 56 with bleed on a 310 x 440 usable sheet: a 5 x 4 rotated block plus 3 across below
+    fit = layout(90, 50, 320, 450)
+    assert fit.up == 23
+    assert fit.up == sum(block.across * block.down for block in fit.blocks)
+    assert fit.up > grid(96, 56, 310, 440)
+    assert fit.efficiency == pytest.approx(23 * 90 * 50 / (320 * 450))
+
+@pytest.mark.parametrize('size', [(210, 297), (148, 105), (85, 55), (100, 100), (300, 40)])
+def test_layout_is_never_worse_than_a_grid(app, size):
+    fit = layout(*size, 483, 635, bleed=0, margin=0)
+    assert fit.up >= grid(*size, 483, 635)
+    assert 0 < fit.efficiency <= 1
+
+def test_layout_of_a_piece_that_does_not_fit(app):
+    assert layout(500, 500, 320, 450).up == 0
+
+def test_layouts_are_memoized_on_rounded_sizes(app):
+    layout(91.23, 55.01, 320, 450)
+    before = layout_cache_info()
+    assert layout(91.24, 55.0, 320.02, 450) == layout(91.23, 55.01, 320, 450)
+    after = layout_cache_info()
+    assert after.hits == before.hits + 2
+    assert after.misses == before.misses
+
+def test_sheets_needed():
+    assert sheets_needed(1000, 23) == 44
+    assert sheets_needed(1000, 10, pages=4, sides=2) == 200
+    assert sheets_needed(1000, 0) is None
+
+def test_parse_colors():
+    assert parse_colors('4/4') == (4, 4)
+    assert parse_colors(' 1 / 0 ') == (1, 0)
+    assert parse_colors('4') == (4, 0)
+    assert parse_colors('CMYK') == (4, 0)
+    assert parse_colors(None) == (4, 0)
+
+def test_best_plan_uses_least_paper(app):
+    sizes = {'small': (320, 450), 'large': (635, 965)}
+    plan = best_plan(90, 50, quantity=1000, sheet_sizes=sizes)
+    area = {name: sheets_needed(1000, layout(90, 50, *size).up) * size[0] * size[1]
+            for name, size in sizes.items()}
+    assert plan.sheet_name == min(area, key=area.get)
+    assert plan.sheets == sheets_needed(1000, plan.layout.up)
+    assert best_plan(900, 900, sheet_sizes=sizes) is None
@@ -0,0 +1,50 @@
+import json
+import logging
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app import db
+from config import _optional_float
+
+def log_events(caplog, event):
+    return [json.loads(record.getMessage()) for record in caplog.records
+            if record.name == 'app.sql' and json.loads(record.getMessage())['event'] == event]
+
+def test_requests_report_their_queries(client, caplog):
+    caplog.set_level(logging.INFO, logger='app.sql')
+    response = client.get('/')
+    timings = response.headers.getlist('Server-Timing')
+    assert timings[0].startswith('db;dur=') and timings[1].startswith('app;dur=')
+    line, = log_events(caplog, 'request')
+    assert line['endpoint'] == 'main.index' and line['status'] == 200
+    assert line['db_queries'] > 0
+    assert f'desc="{line["db_queries"]} queries"' in timings[0]
+
+def test_slow_queries_are_logged_with_parameters(app, caplog):
+    app.config['SQL_SLOW_QUERY_MS'] = 0
+    db.session.execute(text('SELECT :value'), {'value': 'x' * 5000})
+    line, = log_events(caplog, 'slow_query')
+    assert line['statement'] == 'SELECT ?'
+    assert line['endpoint'] is None
+    assert len(line['parameters']) == 2000
+
+def test_slow_query_logging_can_be_off(app, caplog):
+    app.config['SQL_SLOW_QUERY_MS'] = None
+    db.session.execute(text('SELECT 1'))
+    assert log_events(caplog, 'slow_query') == []
+
+def test_failed_statements_do_not_upset_timing(app):
+    connection = db.session.connection()
+    with pytest.raises(OperationalError):
+        connection.execute(text('SELECT * FROM no_such_table'))
+    assert connection.info['query_start'] == []
+
+@pytest.mark.parametrize('value, expected', [
+    (None, 500.0), ('250', 250.0), ('', None), ('off', None), (' None ', None),
+])
+def test_slow_query_threshold_from_the_environment(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv('SQL_SLOW_QUERY_MS', raising=False)
+    else:
+        monkeypatch.setenv('SQL_SLOW_QUERY_MS', value)
+    assert _optional_float('SQL_SLOW_QUERY_MS', 500.0) == expected
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import pytest
+from app import db
+from app.job_history import change_job_status, time_in_stage, stage_throughput, wip_at
+from app.models import Job, JobStatus, JobStatusEvent
+
+T0 = datetime(2024, 5, 6, 8, 0)
+
+def hours(n):
+    return T0 + timedelta(hours=n)
+
+def move(job, status, at, note=None):
+    change_job_status(job, status, note=note, at=at)
+    db.session.commit()
+
+def new_job(number, at=T0):
+    job = Job(job_number=number)
+    db.session.add(job)
+    change_job_status(job, JobStatus.PENDING, at=at)
+    db.session.commit()
+    return job
+
+def events(job):
+    return [(e.from_status, e.to_status, e.note) for e in
+            JobStatusEvent.query.filter_by(job_id=job.id).order_by(JobStatusEvent.at, JobStatusEvent.id)]
+
+def test_every_transition_is_recorded_once(app):
+    job = new_job('JOB-1')
+    move(job, JobStatus.PREPRESS, hours(1), note='Artwork approved')
+    move(job, JobStatus.PREPRESS, hours(2))  # not a transition
+    job.status = JobStatus.PRESS  # plain assignment is recorded too
+    db.session.commit()
+    job.notes = 'unrelated edit'
+    db.session.commit()
+    assert events(job) == [
+        (None, JobStatus.PENDING, None),
+        (JobStatus.PENDING, JobStatus.PREPRESS, 'Artwork approved'),
+        (JobStatus.PREPRESS, JobStatus.PRESS, None),
+    ]
+    assert job.notes == 'unrelated edit'
+
+def test_status_change_after_commit_knows_the_previous_status(app):
+    job = new_job('JOB-2')
+    db.session.expire_all()
+    move(job, JobStatus.PRESS, hours(1))
+    assert events(job)[-1][:2] == (JobStatus.PENDING, JobStatus.PRESS)
+
+def test_time_in_stage_throughput_and_wip(app):
+    first = new_job('JOB-1')
+    move(first, JobStatus.PREPRESS, hours(2))
+    move(first, JobStatus.PRESS, hours(5))
+    move(first, JobStatus.COMPLETED, hours(6))
+    second = new_job('JOB-2', at=hours(1))
+    move(second, JobStatus.PREPRESS, hours(2))
+    move(second, JobStatus.PRESS, hours(3))
+    move(second, JobStatus.PREPRESS, hours(4))  # sent back
+    move(second, JobStatus.PRESS, hours(6))
+    move(second, JobStatus.COMPLETED, hours(7))
+
+    stages = time_in_stage()
+    assert stages[JobStatus.PENDING].visits == 2
+    assert stages[JobStatus.PENDING].total_hours == pytest.approx(3.0)
+    assert stages[JobStatus.PREPRESS].visits == 3
+    assert stages[JobStatus.PREPRESS].total_hours == pytest.approx(3 + 1 + 2)
+    assert stages[JobStatus.PREPRESS].avg_hours == pytest.approx(2.0)
+    assert JobStatus.COMPLETED not in stages
+    assert time_in_stage(job_id=first.id)[JobStatus.PRESS].total_hours == pytest.approx(1.0)
+
+    counts = stage_throughput(hours(2), hours(4))
+    assert counts[JobStatus.PREPRESS] == 3 and counts[JobStatus.PRESS] == 1
+
+    wip = wip_at(hours(3.5))
+    assert (wip[JobStatus.PREPRESS], wip[JobStatus.PRESS]) == (1, 1)
+    assert wip_at(hours(4.5)) == {status: 2 if status == JobStatus.PREPRESS else 0 for status in JobStatus}
+    assert wip_at(hours(8))[JobStatus.COMPLETED] == 2
+
+def test_open_stage_is_measured_up_to_now(app):
+    job = new_job('JOB-3', at=datetime.utcnow() - timedelta(hours=5))
+    assert time_in_stage(job_id=job.id)[JobStatus.PENDING].total_hours == pytest.approx(5.0, abs=0.01)
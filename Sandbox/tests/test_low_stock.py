@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from app import db
+from app.materials import get_low_stock_materials, low_stock_query, reorder_report
+from app.models import Material, MaterialMovement
+
+AS_OF = datetime(2024, 6, 30, 12, 0)
+
+def add_materials():
+    levels = {
+        'Below': (5, 10),
+        'At': (10, 10),
+        'Above': (50, 10),
+        'No reorder level, empty': (0, None),
+        'No reorder level, stocked': (20, None),
+        'No stock level': (None, 3),
+    }
+    materials = {name: Material(name=name, unit='sheets', stock_level=stock, reorder_level=reorder)
+                 for name, (stock, reorder) in levels.items()}
+    db.session.add_all(materials.values())
+    db.session.commit()
+    return materials
+
+def test_low_stock_lists_materials_at_or_below_reorder_level(app):
+    add_materials()
+    assert [m.name for m in get_low_stock_materials()] == \
+        ['Below', 'No stock level', 'At', 'No reorder level, empty']
+    assert [m.name for m in get_low_stock_materials(limit=2)] == ['Below', 'No stock level']
+
+def test_missing_levels_match_the_python_margin(app):
+    materials = add_materials()
+    listed = {m.name for m in get_low_stock_materials()}
+    assert listed == {name for name, m in materials.items() if m.reorder_margin <= 0}
+
+def test_low_stock_query_uses_the_margin_index(app):
+    add_materials()
+    statement = low_stock_query().statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    plan = ' '.join(str(row) for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')))
+    assert 'ix_materials_reorder_margin' in plan
+
+def test_low_stock_feed(client):
+    add_materials()
+    payload = client.get('/production/materials/low-stock').get_json()
+    assert payload['count'] == 4
+    assert payload['materials'][0]['name'] == 'Below'
+    assert payload['materials'][0]['shortfall'] == 5
+    assert payload['materials'][1]['shortfall'] == 3
+
+def test_dashboard_shows_low_stock(client):
+    add_materials()
+    html = client.get('/').get_data(as_text=True)
+    assert 'Below' in html and 'Above' not in html
+
+def test_reorder_report_adds_materials_running_out(app):
+    materials = add_materials()
+    # 'Above' uses 5 sheets a day: 10 days of cover, inside a 14-day horizon
+    for day in range(30):
+        db.session.add(MaterialMovement(material_id=materials['Above'].id, kind='usage', quantity=-5,
+                                        at=AS_OF - timedelta(days=day, hours=1)))
+    db.session.commit()
+    lines = {line.name: line for line in reorder_report(days=30, horizon=14, as_of=AS_OF)}
+    assert set(lines) == {'Below', 'At', 'No reorder level, empty', 'No stock level', 'Above'}
+    assert lines['Above'].daily_usage == pytest.approx(5.0)
+    assert lines['Above'].days_of_cover == pytest.approx(10.0)
+    assert lines['Above'].shortfall == 0
+    assert lines['Below'].shortfall == 5
+    assert 'Above' not in {line.name for line in reorder_report(days=30, horizon=7, as_of=AS_OF)}
@@ -0,0 +1,113 @@
+import threading
+import pytest
+from sqlalchemy import func
+from app import db
+from app.materials import (InsufficientStock, create_material, update_material, update_stock,
+                           consume_material, post_usages, job_material_usage)
+from app.models import Material, MaterialMovement, Job
+
+@pytest.fixture
+def request_ctx(app):
+    # The material helpers flash their outcome
+    with app.test_request_context():
+        yield
+
+def ledger_total(material_id):
+    return db.session.query(func.coalesce(func.sum(MaterialMovement.quantity), 0.0)) \
+        .filter(MaterialMovement.material_id == material_id).scalar()
+
+def assert_stock_matches_ledger(*materials):
+    db.session.expire_all()
+    for material in materials:
+        assert db.session.get(Material, material.id).stock_level == pytest.approx(ledger_total(material.id))
+
+def add_job(number='JOB-1'):
+    job = Job(job_number=number)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def test_stock_level_is_sum_of_ledger(request_ctx):
+    paper = create_material('Silk 150gsm', '', 0.05, 1000, 200, 'sheets')
+    ink = create_material('Cyan ink', '', 30.0, 0, 2, 'litres')
+    assert_stock_matches_ledger(paper, ink)
+
+    job = add_job()
+    update_stock(ink.id, 5)
+    consume_material(paper.id, 300, job_id=job.id)
+    db.session.commit()
+    post_usages([(ink.id, 1.5), (paper.id, 100, 'Reprint')], job_id=job.id)
+    update_stock(paper.id, 50, is_addition=False)
+    assert_stock_matches_ledger(paper, ink)
+    assert paper.stock_level == 550
+    assert {usage.material_id: usage.quantity for usage in job_material_usage(job.id)} == \
+        {paper.id: 400, ink.id: 1.5}
+
+def test_opening_stock_is_an_adjustment(request_ctx):
+    paper = create_material('Kraft', '', 0.05, 250, 50, 'sheets')
+    opening = MaterialMovement.query.filter_by(material_id=paper.id).one()
+    assert (opening.kind, opening.quantity, opening.note) == ('adjustment', 250, 'Opening stock')
+    update_stock(paper.id, 100)
+    assert MaterialMovement.query.filter_by(material_id=paper.id, kind='receipt').count() == 1
+
+def test_insufficient_stock_changes_nothing(request_ctx):
+    paper = create_material('Gloss 300gsm', '', 0.1, 100, 10, 'sheets')
+    ink = create_material('Black ink', '', 25.0, 10, 2, 'litres')
+    job = add_job()
+
+    with pytest.raises(InsufficientStock) as error:
+        consume_material(paper.id, 101, job_id=job.id)
+    assert error.value.available == 100
+    db.session.rollback()
+
+    # One line short: the whole batch is left out
+    with pytest.raises(InsufficientStock):
+        post_usages([(ink.id, 1), (paper.id, 500)], job_id=job.id)
+    db.session.rollback()
+
+    assert not update_stock(ink.id, 11, is_addition=False)
+    db.session.rollback()
+    assert_stock_matches_ledger(paper, ink)
+    assert (paper.stock_level, ink.stock_level) == (100, 10)
+    assert MaterialMovement.query.filter_by(kind='usage').count() == 0
+
+def test_material_edit_keeps_concurrent_usage(request_ctx):
+    paper = create_material('Bond 90gsm', '', 0.02, 500, 50, 'sheets')
+    # The edit form shows 500; meanwhile 120 sheets are used on a job
+    consume_material(paper.id, 120, job_id=add_job().id)
+    db.session.commit()
+
+    # The user raises the level by 100 from what the form showed
+    assert update_material(paper.id, paper.name, '', 0.02, 600, 50, 'sheets', 500) is not None
+    assert_stock_matches_ledger(paper)
+    assert paper.stock_level == 480
+
+    # Lowering it by more than is left now fails and changes nothing
+    assert update_material(paper.id, 'Renamed', '', 0.02, 0, 50, 'sheets', 600) is None
+    assert_stock_matches_ledger(paper)
+    assert (paper.name, paper.stock_level) == ('Bond 90gsm', 480)
+
+def test_concurrent_usage_never_oversells(app, request_ctx):
+    paper = create_material('Offset 120gsm', '', 0.03, 50, 5, 'sheets')
+    job = add_job()
+    taken, refused = [], []
+
+    def worker():
+        with app.app_context():
+            for _ in range(10):
+                try:
+                    consume_material(paper.id, 3, job_id=job.id)
+                    db.session.commit()
+                    taken.append(3)
+                except InsufficientStock:
+                    db.session.rollback()
+                    refused.append(3)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(taken) == 48 and len(refused) == 40 - 16
+    assert_stock_matches_ledger(paper)
+    assert paper.stock_level == 2
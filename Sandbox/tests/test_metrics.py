@@ -0,0 +1,56 @@
+from app import db
+from app.metrics import get_status_snapshot
+from app.models import Customer, Order, Job, Invoice, OrderStatus, JobStatus, InvoiceStatus
+
+def add_orders(count, start=0):
+    for i in range(start, start + count):
+        customer = Customer(name=f'Customer {i}')
+        db.session.add(customer)
+        db.session.flush()
+        order = Order(order_number=f'ORD-{i}', customer_id=customer.id,
+                      status=list(OrderStatus)[i % len(OrderStatus)])
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(Job(job_number=f'JOB-{i}', order_id=order.id,
+                           status=list(JobStatus)[i % len(JobStatus)]))
+        db.session.add(Invoice(invoice_number=f'INV-{i}', order_id=order.id, total_amount=10.0 * (i + 1),
+                               status=list(InvoiceStatus)[i % len(InvoiceStatus)]))
+    db.session.commit()
+
+def test_snapshot_matches_per_status_counts(app):
+    add_orders(23)
+    snapshot = get_status_snapshot()
+
+    for status in OrderStatus:
+        assert snapshot.orders(status) == Order.query.filter_by(status=status).count()
+    for status in JobStatus:
+        assert snapshot.jobs(status) == Job.query.filter_by(status=status).count()
+    for status in InvoiceStatus:
+        invoices = Invoice.query.filter_by(status=status).all()
+        assert snapshot.invoices(status) == len(invoices)
+        assert snapshot.invoiced(status) == sum(invoice.total_amount for invoice in invoices)
+        assert snapshot.outstanding(status) == sum(invoice.balance_due for invoice in invoices)
+    assert snapshot.total_customers == 23
+    assert snapshot.order_count_map()['in_production'] == snapshot.orders(OrderStatus.IN_PRODUCTION)
+
+def test_empty_tables_give_zero_for_every_status(app):
+    snapshot = get_status_snapshot()
+    assert all(snapshot.orders(status) == 0 for status in OrderStatus)
+    assert snapshot.job_count_map() == {status.name.lower(): 0 for status in JobStatus}
+    assert snapshot.invoiced(*InvoiceStatus) == 0
+
+def test_snapshot_uses_one_query_per_table(app, count_queries):
+    add_orders(5)
+    _, queries = count_queries(get_status_snapshot)
+    assert queries == 4
+    _, queries = count_queries(get_status_snapshot, customers=False, jobs=False)
+    assert queries == 2
+
+def test_dashboard_query_count_does_not_grow_with_rows(client, count_queries):
+    add_orders(3)
+    response, few = count_queries(client.get, '/')
+    assert response.status_code == 200
+    add_orders(30, start=3)
+    response, many = count_queries(client.get, '/')
+    assert response.status_code == 200
+    assert many == few
@@ -0,0 +1,82 @@
+from datetime import datetime
+import math
+import pytest
+from app import db
+from app.imposition import best_plan
+from app.models import Job, JobStatus, Material, MaterialMovement, Order
+from app.mrp import run_mrp
+from app.pricing import get_rates
+
+AS_OF = datetime(2024, 7, 3, 9, 0)  # a Wednesday
+
+def expected_sheets(quantity, width, height, pages=1, sides=1):
+    rates = get_rates()
+    up = best_plan(width, height, quantity, pages, sides).layout.up
+    return math.ceil(quantity * math.ceil(pages / sides) / up * (1 + rates.spoilage)) + rates.makeready_sheets
+
+@pytest.fixture
+def stock(app):
+    silk = Material(name='Silk 350gsm', unit='sheets', stock_level=300, reorder_level=100)
+    bond = Material(name='Bond 90gsm', unit='sheets', stock_level=5000, reorder_level=0)
+    due_now, due_later = Order(due_date=datetime(2024, 7, 1)), Order(due_date=datetime(2024, 7, 17))
+    db.session.add_all([silk, bond, due_now, due_later])
+    db.session.flush()
+    jobs = {
+        'cards': Job(order_id=due_now.id, quantity=1000, width=90, height=50, colors='4/4',
+                     paper_type=' SILK 350gsm'),
+        'flyers': Job(order_id=due_later.id, quantity=2000, width=210, height=297, colors='4/0',
+                      paper_type='Silk 350gsm'),
+        'letters': Job(order_id=due_later.id, quantity=500, width=210, height=297, colors='1/0',
+                       paper_type='Bond 90gsm'),
+        'unknown paper': Job(quantity=100, width=90, height=50, paper_type='Vellum'),
+        'too big': Job(quantity=10, width=2000, height=2000, paper_type='Bond 90gsm'),
+        'done': Job(quantity=9999, width=90, height=50, paper_type='Silk 350gsm', status=JobStatus.COMPLETED),
+    }
+    db.session.add_all(jobs.values())
+    db.session.commit()
+    return silk, bond, jobs
+
+def test_demand_is_bucketed_by_due_date(stock):
+    silk, bond, jobs = stock
+    result = run_mrp(bucket='week', as_of=AS_OF)
+    assert result.job_count == 5
+    assert result.unmatched_jobs == 1
+    assert result.oversize_jobs == 1
+
+    plans = {plan.name: plan for plan in result.materials}
+    cards = expected_sheets(1000, 90, 50, sides=2)
+    flyers = expected_sheets(2000, 210, 297)
+    silk_plan = plans['Silk 350gsm']
+    assert [(b.start.isoformat(), b.demand) for b in silk_plan.buckets] == \
+        [('2024-07-01', cards), ('2024-07-15', flyers)]
+    assert silk_plan.buckets[-1].projected == 300 - cards - flyers
+    assert silk_plan.shortage == cards + flyers - 300
+    assert plans['Bond 90gsm'].demand == expected_sheets(500, 210, 297)
+    # Shortages sort first
+    assert result.materials[0].name == 'Silk 350gsm'
+
+def test_issued_paper_is_netted_off(stock):
+    silk, bond, jobs = stock
+    before = run_mrp(as_of=AS_OF)
+    db.session.add_all([
+        MaterialMovement(material_id=silk.id, job_id=jobs['cards'].id, kind='usage', quantity=-40),
+        # Paper issued from a different material than the job is specified on does not count
+        MaterialMovement(material_id=bond.id, job_id=jobs['flyers'].id, kind='usage', quantity=-30),
+        MaterialMovement(material_id=silk.id, job_id=jobs['done'].id, kind='usage', quantity=-500),
+    ])
+    db.session.commit()
+    after = run_mrp(as_of=AS_OF)
+    demand = lambda result, name: next(p.demand for p in result.materials if p.name == name)
+    assert demand(after, 'Silk 350gsm') == demand(before, 'Silk 350gsm') - 40
+    assert demand(after, 'Bond 90gsm') == demand(before, 'Bond 90gsm')
+
+def test_no_open_jobs(app):
+    result = run_mrp(as_of=AS_OF)
+    assert result.materials == [] and result.job_count == 0
+
+def test_mrp_route(client, stock):
+    payload = client.get('/production/mrp?bucket=day').get_json()
+    assert payload['bucket'] == 'day'
+    assert payload['oversize_jobs'] == 1
+    assert {m['name'] for m in payload['materials']} == {'Silk 350gsm', 'Bond 90gsm'}
+    assert client.get('/production/mrp?bucket=month').status_code == 400
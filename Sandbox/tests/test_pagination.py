@@ -0,0 +1,103 @@
+import re
+from datetime import datetime, timedelta
+from app import db, pagination
+from app.models import Customer, Order, Material, User
+from app.pagination import keyset_paginate, cached_count, decode_cursor
+
+ORDER_KEYS = [(Order.created_at, True), (Order.id, True)]
+
+def add_orders(count):
+    customer = Customer(name='Pager Ltd')
+    db.session.add(customer)
+    db.session.flush()
+    base = datetime(2024, 3, 1)
+    for i in range(count):
+        # Pairs share a timestamp so the id tie-breaker matters
+        db.session.add(Order(order_number=f'ORD-{i:03d}', customer_id=customer.id,
+                             created_at=base + timedelta(hours=i // 2)))
+    db.session.commit()
+
+def expected_order():
+    return [order.id for order in Order.query.order_by(Order.created_at.desc(), Order.id.desc())]
+
+def test_walk_forward_and_back_covers_every_row_once(app):
+    add_orders(23)
+    pages, cursor = [], None
+    while True:
+        page = keyset_paginate(Order.query, ORDER_KEYS, cursor=cursor, per_page=5)
+        pages.append([order.id for order in page])
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert [order_id for ids in pages for order_id in ids] == expected_order()
+    assert [len(ids) for ids in pages] == [5, 5, 5, 5, 3]
+
+    # Back from the last page gives the same pages in reverse
+    back = []
+    while page.has_prev:
+        page = keyset_paginate(Order.query, ORDER_KEYS, cursor=page.prev_cursor, per_page=5)
+        back.append([order.id for order in page])
+    assert back == pages[-2::-1]
+    assert not page.has_prev and page.has_next
+
+def test_mixed_sort_directions(app):
+    db.session.add_all([Material(name=name, stock_level=level)
+                        for name, level in [('B', 1), ('A', 5), ('B', 3), ('C', 2), ('A', 1)]])
+    db.session.commit()
+    keys = [(Material.name, False), (Material.stock_level, True), (Material.id, False)]
+    seen, cursor = [], None
+    for _ in range(3):
+        page = keyset_paginate(Material.query, keys, cursor=cursor, per_page=2)
+        seen += [(m.name, m.stock_level) for m in page]
+        cursor = page.next_cursor
+    assert seen == [('A', 5), ('A', 1), ('B', 3), ('B', 1), ('C', 2)]
+
+def test_bad_cursor_gives_first_page(app):
+    add_orders(3)
+    assert decode_cursor('not-a-cursor') is None
+    page = keyset_paginate(Order.query, ORDER_KEYS, cursor='not-a-cursor', per_page=2)
+    assert [order.id for order in page] == expected_order()[:2]
+
+def test_list_views_page_by_cursor_by_default(app, client):
+    app.config['ITEMS_PER_PAGE'] = 5
+    add_orders(12)
+    html = client.get('/orders/', query_string={'filter': 'x'}).get_data(as_text=True)
+    links = re.findall(r'href="(/orders/\?[^"]*(?:cursor|page)=[^"]*)"', html)
+    assert links and all('cursor=' in link and 'page=' not in link for link in links)
+    assert all('filter=x' in link for link in links)
+
+    numbers, url = [], '/orders/'
+    while url:
+        html = client.get(url.replace('&amp;', '&')).get_data(as_text=True)
+        numbers += re.findall(r'ORD-\d{3}', html)
+        next_link = re.search(r'href="(/orders/\?cursor=[^"]*)" aria-label="Next"', html)
+        url = next_link.group(1) if next_link else None
+    assert sorted(set(numbers)) == [f'ORD-{i:03d}' for i in range(12)]
+
+    # Page numbers still work for old links and ?mode=offset
+    html = client.get('/orders/?page=2').get_data(as_text=True)
+    assert 'page=3' in html and 'cursor=' not in html
+    assert 'page=2' in client.get('/orders/?mode=offset').get_data(as_text=True)
+
+def test_user_list_has_pagination_links(app, client):
+    app.config['ITEMS_PER_PAGE'] = 2
+    db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com') for i in range(4)])
+    db.session.commit()
+    html = client.get('/auth/users').get_data(as_text=True)
+    assert re.search(r'href="/auth/users\?cursor=[^"]*" aria-label="Next"', html)
+
+def test_count_cache_is_bounded_and_expires(app, monkeypatch):
+    add_orders(3)
+    monkeypatch.setattr(pagination, '_count_cache', pagination.OrderedDict())
+    monkeypatch.setattr(pagination, 'COUNT_CACHE_SIZE', 4)
+    for i in range(10):
+        assert cached_count(Order.query, ('orders', i), ttl=60) == 3
+    assert list(pagination._count_cache) == [('orders', i) for i in range(6, 10)]
+
+    # A cached total is reused until it expires
+    db.session.add(Order(order_number='ORD-999'))
+    db.session.commit()
+    assert cached_count(Order.query, ('orders', 9), ttl=60) == 3
+    assert cached_count(Order.query, ('orders', 'fresh'), ttl=0) == 4
+    # Storing with ttl=0 leaves only unexpired entries behind
+    assert ('orders', 'fresh') not in pagination._count_cache
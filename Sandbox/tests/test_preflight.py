@@ -0,0 +1,120 @@
+import io
+import os
+import zlib
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from app import db, preflight
+from app.files import save_upload
+from app.models import FilePreflight, Job, Task
+from app.preflight import analyse_file, preflight_task, preflight_warnings, queue_preflight, thumbnail_path
+
+PAGE_TREE = (b'1 0 obj << /Type /Pages /Kids [2 0 R 3 0 R] /Count 2 >> endobj\n'
+             b'2 0 obj << /Type /Page /MediaBox [0 0 612 792] /TrimBox [9 9 264.12 390.57] '
+             b'/Resources << /ColorSpace << /CS0 /DeviceCMYK >> >> >> endobj\n'
+             b'3 0 obj << /Type /Page >> endobj\n')
+
+def object_stream_pdf(content):
+    stream = zlib.compress(content)
+    return (b'%%PDF-1.5\n4 0 obj << /Type /ObjStm /N 3 /Filter /FlateDecode /Length %d >>\nstream\n' % len(stream)
+            + stream + b'\nendstream endobj\n%%EOF\n')
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_pdf_page_tree_trim_box_and_colours(tmp_path):
+    path = write(tmp_path, 'a.pdf', b'%PDF-1.4\n' + PAGE_TREE + b'%%EOF\n')
+    info = analyse_file(path, str(tmp_path / 'thumb.png'), 64)
+    assert info['file_type'] == 'pdf'
+    assert info['pages'] == 2
+    # TrimBox wins over MediaBox: 255.12 x 381.57 pt
+    assert (info['width_mm'], info['height_mm']) == (90.0, 134.6)
+    assert info['color_space'] == 'DeviceCMYK'
+
+def test_pdf_page_tree_inside_an_object_stream(tmp_path):
+    info = analyse_file(write(tmp_path, 'b.pdf', object_stream_pdf(PAGE_TREE)), str(tmp_path / 't.png'), 64)
+    assert info['pages'] == 2 and info['width_mm'] == 90.0
+
+def test_object_streams_are_inflated_up_to_the_cap(tmp_path, monkeypatch):
+    monkeypatch.setattr(preflight, 'MAX_OBJECT_STREAM', 1024)
+    data = object_stream_pdf(b' ' * 4096 + PAGE_TREE)
+    info = analyse_file(write(tmp_path, 'c.pdf', data), str(tmp_path / 't.png'), 64)
+    assert info['pages'] is None and info['width_mm'] is None
+
+def test_raster_image_size_resolution_and_thumbnail(tmp_path):
+    buffer = io.BytesIO()
+    Image.new('CMYK', (1063, 591)).save(buffer, 'JPEG', dpi=(300, 300))
+    thumb = str(tmp_path / 'thumbs' / 'img.png')
+    info = analyse_file(write(tmp_path, 'card.jpg', buffer.getvalue()), thumb, 64)
+    assert info['file_type'] == 'jpeg'
+    assert (info['width_mm'], info['height_mm'], info['dpi']) == (90.0, 50.0, 300.0)
+    assert info['color_space'] == 'CMYK'
+    assert info['has_thumbnail']
+    with Image.open(thumb) as image:
+        assert max(image.size) == 64
+
+def test_unknown_content(tmp_path):
+    assert analyse_file(write(tmp_path, 'x.bin', b'not artwork'), str(tmp_path / 't.png'), 64) == \
+        {'file_type': 'other', 'has_thumbnail': False}
+
+@pytest.fixture
+def job_file(app, monkeypatch):
+    # Analyse in this process
+    monkeypatch.setattr(preflight, 'run_in_process', lambda func, *args: func(*args))
+    buffer = io.BytesIO()
+    Image.new('RGB', (300, 300)).save(buffer, 'PNG', dpi=(150, 150))
+    buffer.seek(0)
+    job = Job(job_number='JOB-1', width=50, height=50, colors='4/0', pages=1)
+    db.session.add(job)
+    db.session.flush()
+    job_file = save_upload(job, FileStorage(buffer, filename='logo.png'))
+    db.session.commit()
+    return job_file
+
+def test_preflight_is_queued_once_per_content(job_file):
+    record = queue_preflight(job_file)
+    assert record.status == 'pending'
+    assert queue_preflight(job_file) is record
+    assert Task.query.filter_by(name='preflight').count() == 1
+
+    info = preflight_task(job_file.sha256)
+    assert record.status == 'done' and info['dpi'] == 150.0
+    assert os.path.exists(thumbnail_path(job_file.sha256))
+    assert queue_preflight(job_file).status == 'done'
+    assert Task.query.filter_by(name='preflight').count() == 1
+
+def test_preflight_of_a_removed_row_does_nothing(job_file):
+    queue_preflight(job_file)
+    db.session.delete(db.session.get(FilePreflight, job_file.sha256))
+    db.session.commit()
+    assert preflight_task(job_file.sha256) is None
+    assert not os.path.exists(thumbnail_path(job_file.sha256))
+
+def test_failed_preflight_is_recorded_and_can_be_requeued(job_file, monkeypatch):
+    record = queue_preflight(job_file)
+
+    def broken(*args):
+        raise OSError('disk gone')
+    monkeypatch.setattr(preflight, 'run_in_process', broken)
+    with pytest.raises(OSError):
+        preflight_task(job_file.sha256)
+    assert record.status == 'failed' and 'disk gone' in record.error
+    assert queue_preflight(job_file).status == 'pending'
+
+def test_warnings_compare_results_with_the_job(job_file):
+    queue_preflight(job_file)
+    preflight_task(job_file.sha256)
+    record = db.session.get(FilePreflight, job_file.sha256)
+    job = job_file.job
+    # 300 px at 150 dpi is 50.8 mm, within tolerance of the 50 mm trim
+    assert preflight_warnings(job, record) == [
+        'Resolution is 150 dpi (minimum 300)',
+        'Artwork is RGB; the job prints in process colour (CMYK)',
+    ]
+    job.width = 90
+    assert 'File is 50.8 x 50.8 mm; job is 90 x 50 mm' in preflight_warnings(job, record)
+    job.colors = '1/0'
+    assert not any('RGB' in warning for warning in preflight_warnings(job, record))
+    assert preflight_warnings(job, None) == []
@@ -0,0 +1,79 @@
+import math
+import pytest
+from app import db
+from app.models import Material, Product
+from app.pricing import JobSpecs, PieceTooLarge, find_paper, get_rates, pieces_per_sheet, price_breaks
+
+SPECS = JobSpecs(width=90, height=50, pages=1, colors='4/4', paper_type='Silk 350gsm')
+
+def scalar_price(quantity, specs, paper_price, rates, up):
+    """The pricing formula for one quantity, written out longhand"""
+    front, back = (int(c) for c in specs.colors.split('/'))
+    sides = 2 if back else 1
+    leaves = math.ceil(specs.pages / sides)
+    sheets = math.ceil(quantity * leaves / up * (1 + rates.spoilage)) + rates.makeready_sheets
+    press_hours = rates.setup_hours + sheets * sides / rates.press_speed
+    cost = sheets * paper_price + sheets * (front + back) * rates.ink_cost + press_hours * rates.press_rate
+    return cost * (1 + rates.markup)
+
+@pytest.fixture
+def paper(app):
+    paper = Material(name='Silk 350gsm', unit='sheets', unit_price=0.12, stock_level=1000)
+    db.session.add(paper)
+    db.session.commit()
+    return paper
+
+def test_price_breaks_match_the_scalar_formula(app, paper):
+    rates = get_rates()
+    quantities = [100, 250, 500, 1000, 5000]
+    table = price_breaks(quantities, SPECS, paper, rates)
+    assert len(table) == len(quantities)
+    for quantity, price in zip(quantities, table.price):
+        assert price == pytest.approx(scalar_price(quantity, SPECS, 0.12, rates, table.up))
+    # Setup is spread over the run, so the unit price falls as the quantity grows
+    assert list(table.unit_price) == sorted(table.unit_price, reverse=True)
+
+def test_rows_are_rounded_for_display(app, paper):
+    row = price_breaks([250], SPECS, paper).rows()[0]
+    assert row['quantity'] == 250 and isinstance(row['sheets'], int)
+    assert row['price'] == round(row['price'], 2)
+
+def test_rate_overrides_skip_missing_values(app):
+    rates = get_rates(markup=0.5, press_rate=None)
+    assert rates.markup == 0.5
+    assert rates.press_rate == app.config['PRICING_PRESS_RATE']
+
+def test_pieces_per_sheet(app):
+    assert pieces_per_sheet(0, 0, (457, 305)) == 1
+    assert pieces_per_sheet(90, 50, (457, 305)) > 1
+    with pytest.raises(PieceTooLarge):
+        pieces_per_sheet(600, 400, (457, 305))
+
+def test_find_paper_by_id_or_name(app, paper):
+    assert find_paper(material_id=paper.id) == paper
+    assert find_paper(' silk 350GSM ') == paper
+    assert find_paper('Bond') is None
+    assert find_paper() is None
+
+def test_price_quote_route(client, paper):
+    product = Product(name='Business cards')
+    db.session.add(product)
+    db.session.commit()
+    response = client.get('/orders/quotes/price', query_string={
+        'product_id': product.id, 'quantities': '500,100,500', 'width': 90, 'height': 50,
+        'colors': '4/4', 'material_id': paper.id, 'markup': 0.25})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert [row['quantity'] for row in payload['breaks']] == [100, 500]
+    assert payload['markup'] == 0.25
+    assert payload['paper']['name'] == 'Silk 350gsm'
+
+    too_large = client.get('/orders/quotes/price', query_string={
+        'product_id': product.id, 'quantities': '100', 'width': 600, 'height': 400})
+    assert too_large.status_code == 400
+    assert 'does not fit' in too_large.get_json()['error']
+
+    for quantities in ('', 'ten', '0', ','.join(['1'] * 51)):
+        response = client.get('/orders/quotes/price',
+                              query_string={'product_id': product.id, 'quantities': quantities})
+        assert response.status_code == 400
@@ -0,0 +1,64 @@
+from app import db
+from app.models import Customer, Order, Job, Invoice, Product, InvoiceStatus
+from app.queries import (orders_with_counts, unpack_order_counts, with_invoice_relations,
+                         with_job_relations, filter_invoices)
+
+def add_orders(count, start=0):
+    product = Product(name=f'Flyer {start}', unit_price=0.1)
+    db.session.add(product)
+    for i in range(start, start + count):
+        customer = Customer(name=f'Customer {i}')
+        db.session.add(customer)
+        db.session.flush()
+        order = Order(order_number=f'ORD-{i}', customer_id=customer.id)
+        db.session.add(order)
+        db.session.flush()
+        for k in range(i % 3):
+            db.session.add(Job(job_number=f'JOB-{i}-{k}', order_id=order.id, product=product))
+        db.session.add(Invoice(invoice_number=f'INV-{i}', order_id=order.id, total_amount=50.0,
+                               status=InvoiceStatus.SENT if i % 2 else InvoiceStatus.PAID))
+    db.session.commit()
+
+def test_order_counts_come_with_the_orders(app, count_queries):
+    add_orders(6)
+    db.session.expire_all()
+    orders, queries = count_queries(lambda: unpack_order_counts(orders_with_counts().all()))
+    assert queries == 1
+    for order in orders:
+        assert order.job_count == Job.query.filter_by(order_id=order.id).count()
+        assert order.invoice_count == 1
+
+    # The customer was loaded in the same query
+    db.session.expire_all()
+    orders = unpack_order_counts(orders_with_counts().all())
+    _, queries = count_queries(lambda: [order.customer.name for order in orders])
+    assert queries == 0
+
+def test_job_and_invoice_relations_are_loaded_up_front(app, count_queries):
+    add_orders(6)
+    db.session.expire_all()
+    jobs = with_job_relations(Job.query).all()
+    invoices = with_invoice_relations(Invoice.query).all()
+    _, queries = count_queries(lambda: [(job.order.customer.name, job.product.name) for job in jobs] +
+                               [invoice.order.customer.name for invoice in invoices])
+    assert queries == 0
+
+def test_filter_invoices_by_customer_composes_with_joined_loads(app):
+    add_orders(4)
+    customer = Customer.query.filter_by(name='Customer 1').one()
+    invoices = filter_invoices(with_invoice_relations(Invoice.query), status='SENT',
+                               customer_id=customer.id).all()
+    assert [invoice.invoice_number for invoice in invoices] == ['INV-1']
+
+def test_list_views_query_count_does_not_grow_with_rows(client, count_queries):
+    add_orders(3)
+    counts = {}
+    for url in ('/orders/', '/production/', '/invoicing/'):
+        response, counts[url] = count_queries(client.get, url)
+        assert response.status_code == 200
+    add_orders(15, start=3)
+    for url in counts:
+        response, queries = count_queries(client.get, url)
+        assert response.status_code == 200
+        # Cached counts may save a query, but nothing runs once per row
+        assert queries <= counts[url], url
@@ -0,0 +1,59 @@
+from datetime import datetime
+from app import db
+from app.models import Customer, Order, Invoice, InvoiceStatus
+from app.reporting import monthly_invoice_summary, invoice_status_report
+
+START, END = datetime(2024, 1, 1), datetime(2024, 3, 31, 23, 59)
+
+INVOICES = [
+    # number, created, due, total, status
+    ('INV-1', datetime(2024, 1, 5), datetime(2024, 2, 5), 100.0, InvoiceStatus.PAID),
+    ('INV-2', datetime(2024, 1, 20), datetime(2024, 2, 20), 250.0, InvoiceStatus.SENT),
+    ('INV-3', datetime(2024, 3, 2), datetime(2024, 3, 10), 80.0, InvoiceStatus.OVERDUE),
+    ('INV-4', datetime(2024, 3, 15), datetime(2024, 4, 15), 40.0, InvoiceStatus.DRAFT),
+    ('INV-5', datetime(2024, 3, 30), datetime(2024, 3, 31), None, InvoiceStatus.OVERDUE),
+    ('INV-6', datetime(2023, 12, 31), datetime(2024, 1, 31), 999.0, InvoiceStatus.PAID),
+]
+
+def add_invoices():
+    customer = Customer(name='Report Co')
+    db.session.add(customer)
+    db.session.flush()
+    order = Order(order_number='ORD-1', customer_id=customer.id)
+    db.session.add(order)
+    db.session.flush()
+    for number, created, due, total, status in INVOICES:
+        db.session.add(Invoice(invoice_number=number, order_id=order.id, created_at=created,
+                               due_date=due, total_amount=total, status=status))
+    db.session.commit()
+
+def test_monthly_summary_groups_in_range_by_month(app):
+    add_invoices()
+    rows, totals = monthly_invoice_summary(START, END)
+    assert [(row.month_key, row.month, row.count, row.total, row.paid, row.outstanding) for row in rows] == [
+        ('2024-01', 'January 2024', 2, 350.0, 100.0, 250.0),
+        ('2024-03', 'March 2024', 3, 120.0, 0.0, 80.0),
+    ]
+    assert totals == {'total_invoiced': 470.0, 'total_paid': 100.0, 'total_outstanding': 330.0}
+
+def test_empty_range_gives_no_rows(app):
+    add_invoices()
+    rows, totals = monthly_invoice_summary(datetime(2025, 1, 1), datetime(2025, 12, 31))
+    assert rows == [] and totals['total_invoiced'] == 0
+
+def test_status_reports_filter_sort_and_total(app):
+    add_invoices()
+    title, report = invoice_status_report('outstanding', START, END)
+    assert title == 'Outstanding Invoices Report'
+    assert [row.invoice_number for row in report.rows] == ['INV-2', 'INV-3', 'INV-5']
+    assert report.rows[0].customer_name == 'Report Co'
+    assert (report.count, report.total_amount, report.truncated) == (3, 330.0, False)
+
+    _, report = invoice_status_report('paid', START, END)
+    assert [row.invoice_number for row in report.rows] == ['INV-1']
+
+def test_totals_cover_rows_beyond_the_limit(app):
+    add_invoices()
+    _, report = invoice_status_report('outstanding', START, END, max_rows=1)
+    assert len(report.rows) == 1
+    assert (report.count, report.total_amount, report.truncated) == (3, 330.0, True)
@@ -0,0 +1,204 @@
+import json
+import random
+from datetime import datetime, timedelta
+import pytest
+from app import db, scheduler
+from app.models import Customer, Job, JobStatus, Order, OrderStatus, Task
+from app.scheduler import JobInput, new_schedule, reschedule_jobs, run_schedule, _job_inputs
+from app.tasks import run_task
+
+OPEN_STATUSES = [JobStatus.PENDING, JobStatus.PREPRESS, JobStatus.PRESS, JobStatus.POSTPRESS]
+
+@pytest.fixture(autouse=True)
+def no_schedule(monkeypatch):
+    # Small checkpoint spacing so updates replay from checkpoints other than the first
+    monkeypatch.setattr(scheduler, '_current', None)
+    monkeypatch.setattr(scheduler, 'CHECKPOINT_EVERY', 4)
+
+def add_jobs(*specs):
+    """One job per (status, estimated hours, due date), each on its own order"""
+    customer = Customer(name='Acme')
+    db.session.add(customer)
+    db.session.flush()
+    jobs = []
+    for status, hours, due_date in specs:
+        order = Order(customer_id=customer.id, status=OrderStatus.APPROVED, due_date=due_date)
+        db.session.add(order)
+        db.session.flush()
+        job = Job(job_number=f'JOB-{order.id}', order_id=order.id, status=status, estimated_hours=hours)
+        db.session.add(job)
+        jobs.append(job)
+    db.session.commit()
+    return jobs
+
+def random_input(rng, job_id, base):
+    due = base + timedelta(days=rng.randint(0, 20)) if rng.random() < 0.8 else None
+    return JobInput(job_id, f'J{job_id}', rng.choice(OPEN_STATUSES), rng.choice([0.5, 1.0, 2.0, 6.0]),
+                    due, base - timedelta(minutes=rng.randint(0, 10000)), False)
+
+def test_incremental_updates_match_full_build(app):
+    rng = random.Random(42)
+    base = datetime(2030, 1, 7)
+    jobs = {job_id: random_input(rng, job_id, base) for job_id in range(1, 41)}
+    schedule = new_schedule(base)
+    schedule.build(jobs.values())
+    next_id = 41
+
+    for _ in range(60):
+        changes = {job_id: random_input(rng, job_id, base) for job_id in rng.sample(sorted(jobs), 3)}
+        if rng.random() < 0.5:
+            changes[rng.choice(sorted(jobs))] = None
+        if rng.random() < 0.5:
+            changes[next_id] = random_input(rng, next_id, base)
+            next_id += 1
+        before = dict(schedule.placements)
+        changed = schedule.update(changes)
+        for job_id, job in changes.items():
+            if job is None:
+                jobs.pop(job_id, None)
+            else:
+                jobs[job_id] = job
+
+        expected = new_schedule(base)
+        expected.build(jobs.values())
+        assert schedule.placements == expected.placements
+        assert schedule.keys == expected.keys
+        moved = {job_id for job_id, placement in expected.placements.items() if before.get(job_id) != placement}
+        assert moved <= changed
+
+def assert_matches_rebuild():
+    expected = new_schedule()
+    expected.build(_job_inputs())
+    assert scheduler._current.placements == expected.placements
+    db.session.expire_all()
+    for job_id in expected.inputs:
+        job = db.session.get(Job, job_id)
+        start, end = expected.dates(job_id)
+        assert job.completion_date == end
+        if job.status == JobStatus.PENDING:
+            assert job.start_date == start
+
+def test_reschedule_jobs_matches_full_rebuild(app):
+    now = datetime.utcnow()
+    jobs = add_jobs(*[(OPEN_STATUSES[i % 4], 1.0 + i % 3, now + timedelta(days=10 - i)) for i in range(10)])
+    run_schedule(apply=True)
+    assert_matches_rebuild()
+
+    # A job gets longer and its order is now due first
+    job = jobs[5]
+    job.estimated_hours = 12.0
+    job.order.due_date = now - timedelta(days=1)
+    db.session.commit()
+    assert job.id in reschedule_jobs([job.id])
+    assert_matches_rebuild()
+
+    # A new job, and one finished
+    added, = add_jobs((JobStatus.PENDING, 3.0, now + timedelta(days=2)))
+    jobs[0].status = JobStatus.COMPLETED
+    db.session.commit()
+    reschedule_jobs([added.id, jobs[0].id])
+    assert jobs[0].id not in scheduler._current.inputs
+    assert_matches_rebuild()
+
+def test_reschedule_jobs_picks_up_changes_from_other_workers(app):
+    now = datetime.utcnow()
+    jobs = add_jobs(*[(JobStatus.PENDING, 2.0, now + timedelta(days=i)) for i in range(8)])
+    run_schedule(apply=True)
+
+    # Changed through another worker process; this process's schedule never heard of it
+    jobs[6].estimated_hours = 20.0
+    jobs[6].order.due_date = now - timedelta(days=3)
+    db.session.commit()
+
+    jobs[2].estimated_hours = 5.0
+    db.session.commit()
+    reschedule_jobs([jobs[2].id])
+    assert_matches_rebuild()
+
+def test_reschedule_jobs_only_reads_changed_jobs(app, monkeypatch):
+    now = datetime.utcnow()
+    jobs = add_jobs(*[(JobStatus.PENDING, 2.0, now + timedelta(days=i)) for i in range(6)])
+    run_schedule(apply=True)
+    # Everything was just written; pretend the last sync was long ago for all but one job
+    old = now - timedelta(days=1)
+    db.session.execute(Job.__table__.update().values(updated_at=old))
+    db.session.execute(Order.__table__.update().values(updated_at=old))
+    db.session.commit()
+    scheduler._current.synced_at = now
+
+    read = []
+    changed_inputs = scheduler._changed_inputs
+    monkeypatch.setattr(scheduler, '_changed_inputs',
+                        lambda job_ids, since: read.append(changed_inputs(job_ids, since)) or read[-1])
+    jobs[4].estimated_hours = 3.0
+    db.session.commit()
+    reschedule_jobs([jobs[1].id])
+    assert set(read[0]) == {jobs[1].id, jobs[4].id}
+    assert_matches_rebuild()
+
+def test_reschedule_jobs_rebuilds_without_schedule(app):
+    jobs = add_jobs(*[(JobStatus.PENDING, 1.0, None)] * 3)
+    assert reschedule_jobs([jobs[0].id]) == {job.id for job in jobs}
+    assert_matches_rebuild()
+
+def test_manually_scheduled_dates_are_kept(app):
+    now = datetime.utcnow()
+    jobs = add_jobs(*[(JobStatus.PENDING, 4.0, now + timedelta(days=i)) for i in range(4)])
+    manual_start, manual_end = datetime(2031, 3, 3, 9, 0), datetime(2031, 3, 7, 17, 0)
+    jobs[3].start_date, jobs[3].completion_date = manual_start, manual_end
+    jobs[3].scheduled_manually = True
+    db.session.commit()
+    run_schedule(apply=True)
+
+    jobs[0].estimated_hours = 30.0
+    db.session.commit()
+    moved = reschedule_jobs([jobs[0].id])
+    assert jobs[3].id in moved  # placed behind the longer job, but its dates stay
+    db.session.expire_all()
+    assert (jobs[3].start_date, jobs[3].completion_date) == (manual_start, manual_end)
+    assert jobs[1].start_date is not None and jobs[1].start_date != manual_start
+
+def latest_task():
+    return Task.query.order_by(Task.id.desc()).first()
+
+def test_edits_queue_the_reschedule(client):
+    job, = add_jobs((JobStatus.PENDING, 4.0, None))
+    response = client.post(f'/production/jobs/{job.id}/schedule', data={
+        'start_date': '2031-03-03', 'completion_date': '2031-03-05', 'estimated_hours': '6'})
+    assert response.status_code == 302
+    task = latest_task()
+    assert task.name == 'reschedule_jobs' and task.status == 'queued'
+    assert json.loads(task.args) == [[job.id], None]
+    assert job.scheduled_manually
+
+    run_task(task.id)
+    db.session.expire_all()
+    assert latest_task().status == 'done'
+    assert job.start_date == datetime(2031, 3, 3)
+
+    # Starting production keeps the start date set by hand
+    client.post(f'/production/jobs/{job.id}/update_status', data={'status': 'PREPRESS'})
+    assert job.start_date == datetime(2031, 3, 3)
+
+    # Clearing it hands the job back to the scheduler
+    client.post(f'/production/jobs/{job.id}/schedule', data={'estimated_hours': '6'})
+    assert not job.scheduled_manually
+
+def test_started_jobs_get_their_actual_start(client):
+    job, = add_jobs((JobStatus.PENDING, 4.0, None))
+    run_schedule(apply=True)
+    proposed = job.start_date
+    assert proposed is not None
+    client.post(f'/production/jobs/{job.id}/update_status', data={'status': 'PREPRESS'})
+    assert job.start_date != proposed
+
+def test_completing_a_job_forecasts_after_the_reschedule(client):
+    jobs = add_jobs(*[(JobStatus.POSTPRESS, 2.0, None)] * 2)
+    run_schedule(apply=True)
+    client.post(f'/production/jobs/{jobs[0].id}/update_status', data={'status': 'COMPLETED'})
+    task = latest_task()
+    assert json.loads(task.args) == [[jobs[0].id], ['forecast_job_completed', jobs[0].id]]
+    run_task(task.id)
+    follow_up = latest_task()
+    assert follow_up.name == 'forecast_job_completed'
+    assert json.loads(follow_up.args) == [jobs[0].id, [jobs[1].id]]
@@ -0,0 +1,71 @@
+from sqlalchemy import text
+from app import db
+from app.models import Customer, Order, Job
+from app.search import search, rebuild_search_index
+
+def found(query, entity_types=None, **kwargs):
+    return [(hit.entity_type, hit.item.id) for hit in search(query, entity_types, **kwargs).hits]
+
+def test_index_follows_inserts_updates_and_deletes(app):
+    customer = Customer(name='Harbour Printworks', contact_person='Ada Lane', email='ada@harbour.test')
+    db.session.add(customer)
+    db.session.commit()
+    assert found('harbour') == [('customer', customer.id)]
+    assert found('lane') == [('customer', customer.id)]
+
+    customer.name = 'Quayside Press'
+    db.session.commit()
+    assert found('harbour') == [('customer', customer.id)]  # still in the email address
+    assert found('printworks') == []
+    assert found('quayside') == [('customer', customer.id)]
+
+    db.session.delete(customer)
+    db.session.commit()
+    assert found('quayside') == []
+
+def test_prefix_terms_type_filter_and_ranking(app):
+    customer = Customer(name='Brochure Co')
+    db.session.add(customer)
+    db.session.flush()
+    order = Order(order_number='ORD-20240131-001', customer_id=customer.id, notes='Brochures for the spring fair')
+    db.session.add(order)
+    db.session.flush()
+    job = Job(job_number='JOB-20240131-001', order_id=order.id, notes='Saddle-stitched brochure')
+    db.session.add(job)
+    db.session.commit()
+
+    assert set(found('broch')) == {('customer', customer.id), ('order', order.id), ('job', job.id)}
+    assert found('broch', ['job']) == [('job', job.id)]
+    assert found('spring fair') == [('order', order.id)]
+    # A match in the title ranks above one in the body
+    assert found('brochure', ['customer', 'job'])[0] == ('customer', customer.id)
+    assert found('ORD-20240131') == [('order', order.id)]
+
+def test_search_syntax_in_input_is_treated_as_words(app):
+    db.session.add(Customer(name='Acme "Labels" Ltd'))
+    db.session.commit()
+    # Quotes, operators and wildcards do not reach the FTS parser; every word must match
+    assert len(found('acme" labels*')) == 1
+    assert found('acme OR nothing') == []
+    assert found('*') == []
+    assert found('') == []
+    assert found('acme', ['nonsense']) == []
+
+def test_pages_and_has_next(app):
+    db.session.add_all([Customer(name=f'Poster Shop {i}') for i in range(5)])
+    db.session.commit()
+    first = search('poster', per_page=2)
+    last = search('poster', page=3, per_page=2)
+    assert len(first.hits) == 2 and first.has_next
+    assert len(last.hits) == 1 and not last.has_next
+    ids = {hit.entity_id for page in (1, 2, 3) for hit in search('poster', page=page, per_page=2).hits}
+    assert len(ids) == 5
+
+def test_rebuild_restores_a_lost_index(app):
+    db.session.add_all([Customer(name='Signwriters'), Customer(name='Card Makers')])
+    db.session.commit()
+    db.session.execute(text('DELETE FROM search_index'))
+    db.session.commit()
+    assert found('signwriters') == []
+    assert rebuild_search_index() == 2
+    assert len(found('signwriters')) == 1
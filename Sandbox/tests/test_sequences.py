@@ -0,0 +1,57 @@
+import threading
+from datetime import datetime
+import pytest
+from app import db
+from app.models import Order, DocumentSequence
+from app.sequences import next_number, reserve_numbers
+
+DAY = datetime(2024, 1, 31, 15, 30)
+
+def test_numbers_are_consecutive_per_prefix_and_day(app):
+    assert next_number('ORD', DAY) == 'ORD-20240131-001'
+    assert next_number('ORD', DAY) == 'ORD-20240131-002'
+    assert reserve_numbers('ORD', 3, DAY) == ['ORD-20240131-003', 'ORD-20240131-004', 'ORD-20240131-005']
+    assert next_number('INV', DAY) == 'INV-20240131-001'
+    assert next_number('ORD', datetime(2024, 2, 1)) == 'ORD-20240201-001'
+
+def test_counter_continues_from_numbers_issued_before_it(app):
+    db.session.add_all([Order(order_number='ORD-20240131-007'), Order(order_number='ORD-20240131-012'),
+                        Order(order_number='ORD-20240130-050')])
+    db.session.commit()
+    assert next_number('ORD', DAY) == 'ORD-20240131-013'
+
+def test_rolled_back_numbers_are_issued_again(app):
+    next_number('JOB', DAY)
+    db.session.commit()
+    assert next_number('JOB', DAY) == 'JOB-20240131-002'
+    db.session.rollback()
+    assert next_number('JOB', DAY) == 'JOB-20240131-002'
+
+def test_invalid_requests_are_rejected(app):
+    with pytest.raises(ValueError):
+        next_number('XYZ', DAY)
+    with pytest.raises(ValueError):
+        reserve_numbers('ORD', 0, DAY)
+    assert DocumentSequence.query.count() == 0
+
+def test_concurrent_workers_never_share_a_number(app):
+    issued, errors = [], []
+
+    def worker():
+        try:
+            with app.app_context():
+                for _ in range(10):
+                    number = next_number('ORD', DAY)
+                    db.session.add(Order(order_number=number))
+                    db.session.commit()
+                    issued.append(number)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(issued) == [f'ORD-20240131-{n:03d}' for n in range(1, 41)]
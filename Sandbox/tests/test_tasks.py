@@ -0,0 +1,118 @@
+import json
+import os
+from datetime import datetime, timedelta
+import pytest
+from app import db, tasks
+from app.models import Task, User
+from app.tasks import enqueue, fail_stale, purge_tasks, result_path, run_pending, run_task, task
+
+calls = []
+
+@task('test_add')
+def add(a, b):
+    calls.append((a, b))
+    return a + b
+
+@task('test_fail')
+def fail():
+    raise RuntimeError('out of paper')
+
+@task('test_file')
+def write_file():
+    with open(result_path('report.txt'), 'w') as f:
+        f.write('done')
+    return {'file': 'report.txt', 'mimetype': 'text/plain'}
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """Task ids handed to the thread pool"""
+    ids = []
+    monkeypatch.setattr(tasks, '_run_in_context', lambda app, task_id: ids.append(task_id))
+    calls.clear()
+    return ids
+
+def test_tasks_start_only_after_commit(app, submitted):
+    record = enqueue('test_add', 2, 3)
+    assert record.status == 'queued' and submitted == []
+    db.session.commit()
+    tasks._pool('threads').shutdown(wait=True)
+    tasks._pools['threads'] = None
+    assert submitted == [record.id]
+
+def test_rolled_back_tasks_are_dropped(app, submitted):
+    enqueue('test_add', 1, 1)
+    db.session.rollback()
+    assert Task.query.count() == 0
+    db.session.commit()
+    assert submitted == []
+
+def test_unknown_task(app):
+    with pytest.raises(KeyError):
+        enqueue('no_such_task')
+
+def test_run_task_once(app, submitted):
+    record = enqueue('test_add', 2, 3)
+    db.session.commit()
+    assert run_task(record.id)
+    assert not run_task(record.id)
+    assert calls == [(2, 3)]
+    assert (record.status, json.loads(record.result)) == ('done', 5)
+    assert record.started_at and record.finished_at
+
+def test_failures_are_recorded(app, submitted):
+    record = enqueue('test_fail')
+    db.session.commit()
+    assert run_task(record.id)
+    assert record.status == 'failed'
+    assert record.error == 'RuntimeError: out of paper'
+
+def test_stale_tasks_stay_failed(app, submitted):
+    record = enqueue('test_add', 1, 2)
+    db.session.commit()
+    record.status, record.started_at = 'running', datetime.utcnow() - timedelta(hours=2)
+    db.session.commit()
+    assert fail_stale(3600) == 1
+    assert record.error == 'Interrupted'
+    # The interrupted task finishing late keeps its failed status
+    tasks._finish(record.id, 'done', result='3')
+    db.session.expire_all()
+    assert record.status == 'failed' and record.result is None
+
+def test_run_pending_oldest_first(app, submitted):
+    now = datetime.utcnow()
+    records = [enqueue('test_add', i, 0) for i in range(3)]
+    for i, record in enumerate(records):
+        record.created_at = now - timedelta(minutes=i)
+    db.session.commit()
+    assert run_pending(limit=2) == 2
+    assert calls == [(2, 0), (1, 0)]
+    assert run_pending() == 1
+
+def test_file_results_download_and_purge(client, submitted):
+    record = enqueue('test_file', user_id=User.query.first().id)
+    db.session.commit()
+    run_task(record.id)
+    payload = client.get(f'/tasks/{record.id}').get_json()
+    assert payload['status'] == 'done' and payload['download_url'].endswith('/download')
+    assert client.get(payload['download_url']).data == b'done'
+
+    path = result_path('report.txt', record.id)
+    record.finished_at = datetime.utcnow() - timedelta(days=10)
+    db.session.commit()
+    assert purge_tasks(7) == 1
+    assert not os.path.exists(path)
+    assert client.get(f'/tasks/{record.id}').status_code == 404
+
+def test_tasks_are_private_to_their_user(client, submitted):
+    other = User(username='other', email='other@example.com')
+    other.set_password('secret')
+    db.session.add(other)
+    db.session.commit()
+    record = enqueue('test_add', 1, 1, user_id=other.id)
+    db.session.commit()
+    # The test user is an admin
+    assert client.get(f'/tasks/{record.id}').status_code == 200
+    admin = User.query.filter_by(username='admin').first()
+    admin.is_admin = False
+    db.session.commit()
+    assert client.get(f'/tasks/{record.id}').status_code == 404
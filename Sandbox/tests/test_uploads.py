@@ -0,0 +1,165 @@
+import hashlib
+import io
+import os
+from werkzeug.datastructures import FileStorage
+from app import db, files
+from app.files import blob_path, save_upload
+from app.models import FileUpload, Job, JobFile, User
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+def add_job():
+    job = Job(job_number=f'JOB-{Job.query.count() + 1}')
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def open_upload(client, job, **fields):
+    data = {'filename': 'artwork.pdf', 'size': len(CONTENT)}
+    data.update(fields)
+    return client.post(f'/orders/jobs/{job.id}/uploads', json=data)
+
+def send(client, url, offset, data):
+    return client.patch(url, data=data, headers={'Upload-Offset': str(offset)})
+
+def test_chunks_advance_offset_and_attach_file(client):
+    job = add_job()
+    response = open_upload(client, job)
+    assert response.status_code == 201
+    assert response.get_json()['offset'] == 0
+    url = response.get_json()['upload_url']
+
+    response = send(client, url, 0, CONTENT[:4096])
+    assert response.status_code == 200
+    assert response.headers['Upload-Offset'] == '4096'
+    assert client.get(url).get_json()['offset'] == 4096
+
+    response = send(client, url, 4096, CONTENT[4096:])
+    assert response.status_code == 201
+    payload = response.get_json()
+    assert payload['complete']
+    assert payload['file']['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+    assert payload['file']['size'] == len(CONTENT)
+    with open(blob_path(payload['file']['sha256']), 'rb') as f:
+        assert f.read() == CONTENT
+    assert FileUpload.query.count() == 0
+
+def test_repeated_chunk_gets_409_with_current_offset(client):
+    job = add_job()
+    url = open_upload(client, job).get_json()['upload_url']
+    send(client, url, 0, CONTENT[:4096])
+
+    # A retried chunk (the client missed the first response) is not written twice
+    response = send(client, url, 0, CONTENT[:4096])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '4096'
+    assert response.get_json()['offset'] == 4096
+
+    # The client resumes from the offset it was given
+    response = send(client, url, 4096, CONTENT[4096:])
+    assert response.status_code == 201
+    assert response.get_json()['file']['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+def test_resume_without_running_hash_rehashes_file(client):
+    job = add_job()
+    url = open_upload(client, job).get_json()['upload_url']
+    send(client, url, 0, CONTENT[:4096])
+    # The rest arrives at a worker that has not seen the first chunk
+    files._hashers.clear()
+    response = send(client, url, 4096, CONTENT[4096:])
+    assert response.status_code == 201
+    assert response.get_json()['file']['sha256'] == hashlib.sha256(CONTENT).hexdigest()
+
+def test_offset_past_end_gets_409(client):
+    job = add_job()
+    url = open_upload(client, job).get_json()['upload_url']
+    response = send(client, url, 100, CONTENT[100:200])
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 0
+
+def test_chunk_past_declared_size_is_rejected(client):
+    job = add_job()
+    url = open_upload(client, job, size=10).get_json()['upload_url']
+    assert send(client, url, 0, CONTENT[:11]).status_code == 400
+    assert client.get(url).get_json()['offset'] == 0
+
+def test_sha256_mismatch_discards_upload(client):
+    job = add_job()
+    response = open_upload(client, job, sha256='0' * 64)
+    upload_id = response.get_json()['upload_id']
+    url = response.get_json()['upload_url']
+
+    response = send(client, url, 0, CONTENT)
+    assert response.status_code == 400
+    assert 'sha256' in response.get_json()['error']
+    assert db.session.get(FileUpload, upload_id) is None
+    assert JobFile.query.count() == 0
+    assert not os.path.exists(blob_path('0' * 64))
+
+def test_known_sha256_attaches_with_stored_size(client):
+    first, second = add_job(), add_job()
+    url = open_upload(client, first).get_json()['upload_url']
+    assert send(client, url, 0, CONTENT).get_json()['file']['sha256'] == SHA256
+
+    # Content this user uploaded before: the declared size is ignored and no bytes are sent
+    response = open_upload(client, second, sha256=SHA256, size=1)
+    assert response.status_code == 201
+    payload = response.get_json()
+    assert payload['complete']
+    assert payload['file']['size'] == len(CONTENT)
+    assert FileUpload.query.count() == 0
+    assert JobFile.query.filter_by(job_id=second.id).count() == 1
+
+def test_known_sha256_of_someone_else_needs_the_bytes(client):
+    other = User(username='other', email='other@example.com')
+    other.set_password('secret')
+    db.session.add(other)
+    theirs, mine = add_job(), add_job()
+    save_upload(theirs, FileStorage(io.BytesIO(CONTENT), filename='secret.pdf'), other.id)
+    db.session.commit()
+
+    # Knowing the hash of another user's file on another job does not attach it
+    response = open_upload(client, mine, sha256=SHA256)
+    assert response.status_code == 201
+    assert 'upload_url' in response.get_json()
+    assert JobFile.query.filter_by(job_id=mine.id).count() == 0
+    response = send(client, response.get_json()['upload_url'], 0, b'x' * len(CONTENT))
+    assert response.status_code == 400
+    assert JobFile.query.filter_by(job_id=mine.id).count() == 0
+
+    # Sending the content itself works
+    url = open_upload(client, mine, sha256=SHA256).get_json()['upload_url']
+    assert send(client, url, 0, CONTENT).status_code == 201
+
+    # Content already on the job can be attached again by anyone
+    response = open_upload(client, theirs, sha256=SHA256, filename='copy.pdf')
+    assert response.get_json()['complete']
+
+def test_start_upload_leaves_the_commit_to_the_caller(app):
+    job = add_job()
+    upload = files.start_upload(job, 'artwork.pdf', 10)
+    db.session.rollback()
+    assert db.session.get(FileUpload, upload.id) is None
+
+def test_invalid_uploads_are_rejected(client):
+    job = add_job()
+    assert open_upload(client, job, filename='setup.exe').status_code == 400
+    assert open_upload(client, job, size='many').status_code == 400
+    assert open_upload(client, job, size=0).status_code == 400
+    assert open_upload(client, job, sha256='xyz').status_code == 400
+
+def test_sweep_removes_only_old_unreferenced_content(app):
+    job = add_job()
+    kept = save_upload(job, FileStorage(io.BytesIO(CONTENT), filename='kept.pdf'))
+    dropped = save_upload(job, FileStorage(io.BytesIO(b'old proof'), filename='old.pdf'))
+    db.session.commit()
+    files.delete_job_file(dropped)
+    db.session.commit()
+    assert files.sweep_blobs(grace_hours=1) == 0  # touched too recently
+    old = os.path.getmtime(blob_path(dropped.sha256)) - 7200
+    os.utime(blob_path(dropped.sha256), (old, old))
+    os.utime(blob_path(kept.sha256), (old, old))
+    assert files.sweep_blobs(grace_hours=1) == 1
+    assert not os.path.exists(blob_path(dropped.sha256))
+    assert os.path.exists(blob_path(kept.sha256))